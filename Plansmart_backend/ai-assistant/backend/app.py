@@ -1,4 +1,3 @@
-<<<<<<< HEAD
 # from flask import Flask, request, jsonify, session
 # from flask_cors import CORS
 # from models import db, Task, Schedule, User
@@ -332,979 +331,39 @@
 
 
 
-from flask import Flask, request, jsonify, session, render_template, send_from_directory
-
-from flask_cors import CORS
-
-from models import db, Task, Schedule, User, Request, Response
-
-from scheduler import start_scheduler, schedule_reminder
-
-import re, os
-
-from datetime import datetime, timedelta
-
-import openai
-
-import os
-
-import ollama
-
- 
-
-app = Flask(__name__,
-
-    template_folder='templates',  # <-- tell Flask where your HTMLs are
-
-    static_folder='static'        # <-- tell Flask where your CSS/JS are
-
-)
-
-CORS(app, resources={r"/*": {"origins": "*"}})
-
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///ai_assistant.db'
-
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db.init_app(app)
-
- 
-
-# Set OpenAI API key
-
-openai.api_key = os.getenv('OPENAI_API_KEY')
-
- 
-
-with app.app_context():
-
-    db.create_all()
-
-    start_scheduler()
-
- 
-
-def parse_input_with_ollama(text, user_id=None):
-
-    # Get recent conversation history (last 10 requests and responses for better context)
-
-    history = []
-
-    if user_id:
-
-        recent_requests = Request.query.filter_by(user_id=user_id).order_by(Request.created_at.desc()).limit(10).all()
-
-        for req in reversed(recent_requests[:-1]):  # Exclude current
-
-            responses = Response.query.filter_by(request_id=req.id).all()
-
-            response_text = responses[0].text if responses else "No response"
-
-            history.append({"role": "user", "content": req.text})
-
-            history.append({"role": "assistant", "content": response_text})
-
- 
-
-    # Get user data for personalization
-
-    user_tasks = []
-
-    user_schedules = []
-
-    if user_id:
-
-        user_tasks = Task.query.filter_by(user_id=user_id).order_by(Task.created_at.desc()).limit(5).all()
-
-        user_schedules = Schedule.query.filter_by(user_id=user_id).order_by(Schedule.created_at.desc()).limit(5).all()
-
- 
-
-    tasks_str = "\n".join([f"- {t.description} (Due: {t.due_date.isoformat() if t.due_date else 'No due date'}, Completed: {t.completed})" for t in user_tasks])
-
-    schedules_str = "\n".join([f"- {s.title} at {s.start_time.isoformat()}" for s in user_schedules])
-
- 
-
-    prompt = f"""
-
-You are an advanced interactive AI assistant for a personal assistant app. You can create tasks, schedules, reminders, answer questions, and engage in natural conversation. Use the user's recent tasks and schedules to provide personalized suggestions and context.
-
- 
-
-User's recent tasks:
-
-{tasks_str}
-
- 
-
-User's recent schedules:
-
-{schedules_str}
-
- 
-
-User input: "{text}"
-
- 
-
-First, extract any actions if present:
-
-- Tasks: List of task descriptions to create (be specific and actionable).
-
-- Schedules: List of schedules with title and start_time (in ISO format, assume today if no date, infer reasonable times).
-
-- Update Schedules: List of schedules to update with title and new_start_time.
-
-- Reminders: List of reminders with description and time (in ISO format).
-
-- Query: If querying tasks, set completed to true or false, or specify filters like "today's tasks".
-
-- Clarification: If input is unclear, set to true and ask for more details.
-
- 
-
-Return a JSON object with keys: tasks, schedules, update_schedules, reminders, query, clarification.
-
- 
-
-Then, generate a conversational response that confirms actions, provides context from user data, engages the user, and asks follow-up questions if needed.
-
- 
-
-Example JSON:
-
-{{
-
-  "tasks": ["Finish the quarterly report by end of day"],
-
-  "schedules": [{{"title": "Team Meeting", "start_time": "2023-10-01T14:00:00"}}],
-
-  "update_schedules": [],
-
-  "reminders": [{{"description": "Call dentist", "time": "2023-10-02T09:00:00"}}],
-
-  "query": {{"completed": false, "filter": "today"}},
-
-  "clarification": false,
-
-  "response": "I've added 'Finish the quarterly report' to your tasks, noting you have a meeting at 2 PM. Do you need help with anything else today?"
-
-}}
-
- 
-
-Handle multi-step requests, natural language, and provide helpful, personalized responses.
-
-"""
-
-    messages = history + [{"role": "user", "content": prompt}]
-
-    try:
-
-        response = ollama.chat(
-
-            model='llama2',  # Assuming llama2 is available; can be changed to other models like mistral
-
-            messages=messages,
-
-            options={'temperature': 0.7, 'num_predict': 500}
-
-        )
-
-        result = response['message']['content'].strip()
-
-        import json
-
-        parsed = json.loads(result)
-
-        return parsed
-
-    except Exception as e:
-
-        print(f"Ollama error: {e}")
-
-        # Improved fallback
-
-        return parse_input_improved(text)
-
- 
-
-def parse_input_improved(text):
-
-    # Improved fallback parsing with better regex and natural language handling
-
-    tasks = []
-
-    schedules = []
-
-    update_schedules = []
-
-    reminders = []
-
-    query = {}
-
-    clarification = False
-
- 
-
-    # Detect tasks: various patterns
-
-    task_patterns = [
-
-        r'(?:create|add|make) (?:a |an )?task(?: to)? (.+)',
-
-        r'(?:i need to|i have to|i should) (.+)',
-
-        r'(?:remind me|note) (.+)'
-
-    ]
-
-    for pattern in task_patterns:
-
-        match = re.search(pattern, text, re.IGNORECASE)
-
-        if match:
-
-            tasks.append(match.group(1).strip())
-
-            break
-
- 
-
-    # Detect schedules: various patterns
-
-    schedule_patterns = [
-
-        r'(?:schedule|set up|plan) (.+?) (?:at|for) (.+)',
-
-        r'(?:meeting|appointment) (.+?) (?:at|on) (.+)'
-
-    ]
-
-    for pattern in schedule_patterns:
-
-        match = re.search(pattern, text, re.IGNORECASE)
-
-        if match:
-
-            title = match.group(1).strip()
-
-            time_str = match.group(2).strip()
-
-            # Improved time parsing
-
-            try:
-
-                # Try HH:MM format
-
-                start_time = datetime.strptime(time_str, '%H:%M')
-
-                start_time = datetime.combine(datetime.today(), start_time.time())
-
-                schedules.append({'title': title, 'start_time': start_time.isoformat()})
-
-            except ValueError:
-
-                try:
-
-                    # Try "at 3pm" or similar
-
-                    time_match = re.search(r'(\d{1,2})(?::(\d{2}))?\s*(am|pm)', time_str, re.IGNORECASE)
-
-                    if time_match:
-
-                        hour = int(time_match.group(1))
-
-                        minute = int(time_match.group(2)) if time_match.group(2) else 0
-
-                        ampm = time_match.group(3).lower()
-
-                        if ampm == 'pm' and hour != 12:
-
-                            hour += 12
-
-                        elif ampm == 'am' and hour == 12:
-
-                            hour = 0
-
-                        start_time = datetime.combine(datetime.today(), datetime.min.time().replace(hour=hour, minute=minute))
-
-                        schedules.append({'title': title, 'start_time': start_time.isoformat()})
-
-                    else:
-
-                        clarification = True
-
-                except:
-
-                    clarification = True
-
-            break
-
- 
-
-    # Detect update schedules
-
-    update_match = re.search(r'(?:update|change|reschedule) (.+?) (?:to|at) (.+)', text, re.IGNORECASE)
-
-    if update_match:
-
-        title = update_match.group(1).strip()
-
-        new_time_str = update_match.group(2).strip()
-
-        # Similar parsing as above
-
-        try:
-
-            start_time = datetime.strptime(new_time_str, '%H:%M')
-
-            start_time = datetime.combine(datetime.today(), start_time.time())
-
-            update_schedules.append({'title': title, 'new_start_time': start_time.isoformat()})
-
-        except ValueError:
-
-            clarification = True
-
- 
-
-    # Detect reminders
-
-    reminder_match = re.search(r'(?:remind me|set a reminder) (?:to )?(.+?) (?:in|at) (.+)', text, re.IGNORECASE)
-
-    if reminder_match:
-
-        desc = reminder_match.group(1).strip()
-
-        time_part = reminder_match.group(2).strip()
-
-        # Parse time
-
-        mins_match = re.search(r'(\d+) minutes?', time_part, re.IGNORECASE)
-
-        if mins_match:
-
-            mins = int(mins_match.group(1))
-
-            reminder_time = datetime.now() + timedelta(minutes=mins)
-
-            reminders.append({'description': desc, 'time': reminder_time.isoformat()})
-
-        else:
-
-            clarification = True
-
- 
-
-    # Detect queries
-
-    if re.search(r'(?:show|list|get) (?:done|completed) tasks?', text, re.IGNORECASE):
-
-        query['completed'] = True
-
-    elif re.search(r'(?:show|list|get) (?:undone|incomplete|pending) tasks?', text, re.IGNORECASE):
-
-        query['completed'] = False
-
-    elif re.search(r'(?:what|show) (?:do i have|are my) tasks?', text, re.IGNORECASE):
-
-        query['completed'] = False
-
- 
-
-    response = "I'm not sure what you mean. Could you clarify?"
-
-    if tasks or schedules or reminders:
-
-        response = "Got it! I've processed your request."
-
-    elif query:
-
-        response = "Here are your tasks."
-
- 
-
-    return {'tasks': tasks, 'schedules': schedules, 'update_schedules': update_schedules, 'reminders': reminders, 'query': query, 'clarification': clarification, 'response': response}
-
- 
-
-@app.route('/process_input', methods=['POST'])
-
-def process_input():
-
-    data = request.json
-
-    text = data.get('text', '')
-
-    # Save the raw input as a request
-
-    user_id = session.get('user_id')
-
-    req = Request(text=text, user_id=user_id)
-
-    db.session.add(req)
-
-    db.session.commit()
-
-    parsed = parse_input_with_ollama(text, user_id)
-
- 
-
-    # Save to DB
-
-    for task_desc in parsed.get('tasks', []):
-
-        task = Task(description=task_desc)
-
-        db.session.add(task)
-
- 
-
-    for sched in parsed.get('schedules', []):
-
-        start_time = datetime.fromisoformat(sched['start_time'])
-
-        schedule = Schedule(title=sched['title'], start_time=start_time)
-
-        db.session.add(schedule)
-
- 
-
-    for update_sched in parsed.get('update_schedules', []):
-
-        schedule = Schedule.query.filter_by(title=update_sched['title']).first()
-
-        if schedule:
-
-            new_start_time = datetime.fromisoformat(update_sched['new_start_time'])
-
-            schedule.start_time = new_start_time
-
-            db.session.commit()
-
- 
-
-    for rem in parsed.get('reminders', []):
-
-        time = datetime.fromisoformat(rem['time'])
-
-        task = Task(description=rem['description'], due_date=time)
-
-        db.session.add(task)
-
-        schedule_reminder(task.id, rem['description'], time)
-
- 
-
-    db.session.commit()
-
- 
-
-    # Use AI response from parsed if available, else generate
-
-    response_message = parsed.get('response', generate_ai_response(text, parsed))
-
- 
-
-    # Save the AI response to the database
-
-    ai_response = Response(text=response_message, request_id=req.id)
-
-    db.session.add(ai_response)
-
-    db.session.commit()
-
- 
-
-    return jsonify({'message': response_message, 'parsed': parsed})
-
- 
-
-def generate_ai_response(user_input, parsed):
-
-    prompt = f"""
-
-You are a helpful AI assistant. The user said: "{user_input}"
-
- 
-
-Based on the parsed data: {parsed}
-
- 
-
-Generate a friendly, conversational response as if you're talking to the user while performing the task. For example, "Alright, I'm adding that task for you. Done! Task 'Finish report' has been created. Is there anything else on your mind today?"
-
- 
-
-Keep it natural, engaging, and end with a question to continue the conversation.
-
-"""
-
-    try:
-
-        response = ollama.chat(
-
-            model='llama2',
-
-            messages=[{"role": "user", "content": prompt}],
-
-            options={'temperature': 0.7, 'num_predict': 150}
-
-        )
-
-        return response['message']['content'].strip()
-
-    except Exception as e:
-
-        print(f"Ollama response error: {e}")
-
-        return "Processed your request successfully. What do you have to do today?"
-
- 
-
-@app.route('/get_tasks', methods=['GET'])
-
-def get_tasks():
-
-    completed_filter = request.args.get('completed')
-
-    if completed_filter is not None:
-
-        completed = completed_filter.lower() == 'true'
-
-        tasks = Task.query.filter_by(completed=completed).all()
-
-    else:
-
-        tasks = Task.query.all()
-
-    return jsonify([{
-
-        'id': t.id,
-
-        'description': t.description,
-
-        'due_date': t.due_date.isoformat() if t.due_date else None,
-
-        'completed': t.completed
-
-    } for t in tasks])
-
- 
-
-@app.route('/mark_done/<int:task_id>', methods=['PUT'])
-
-def mark_done(task_id):
-
-    task = Task.query.get(task_id)
-
-    if task:
-
-        task.completed = True
-
-        db.session.commit()
-
-        return jsonify({'message': 'Task marked as done'})
-
-    return jsonify({'error': 'Task not found'}), 404
-
- 
-
-@app.route('/mark_schedule_done/<int:schedule_id>', methods=['PUT'])
-
-def mark_schedule_done(schedule_id):
-
-    schedule = Schedule.query.get(schedule_id)
-
-    if not schedule:
-
-        return jsonify({'error': 'Schedule not found'}), 404
-
- 
-
-    # Mark schedule as completed
-
-    schedule.completed = True
-
- 
-
-    # Optionally mark related tasks as done
-
-    related_tasks = Task.query.filter(Task.description.ilike(f"%{schedule.title}%")).all()
-
-    for t in related_tasks:
-
-        t.completed = True
-
- 
-
-    try:
-
-        db.session.commit()
-
-        return jsonify({'message': f'Schedule \"{schedule.title}\" marked as completed.'})
-
-    except Exception as e:
-
-        print("Error updating schedule:", e)
-
-        return jsonify({'error': 'Could not update schedule'}), 500
-
-
-
-
-@app.route('/get_schedules', methods=['GET'])
-
-def get_schedules():
-
-    try:
-
-        schedules = Schedule.query.all()
-
-        return jsonify([
-
-            {
-
-                'id': s.id,
-
-                'title': s.title,
-
-                'start_time': s.start_time.isoformat(),
-
-                'end_time': s.end_time.isoformat() if s.end_time else None,
-
-                'description': s.description,
-
-                'completed': s.completed
-
-            }
-
-            for s in schedules
-
-        ])
-
-    except Exception as e:
-
-        import traceback
-
-        print("Error fetching schedules:", e)
-
-        traceback.print_exc()
-
-        return jsonify({'error': 'Could not fetch schedules'}), 500
-
-
-
-
-@app.route('/get_conversation_history', methods=['GET'])
-
-def get_conversation_history():
-
-    user_id = session.get('user_id')
-
-    if not user_id:
-
-        return jsonify({'error': 'User not logged in'}), 401
-
- 
-
-    # Get recent requests and their responses
-
-    recent_requests = Request.query.filter_by(user_id=user_id).order_by(Request.created_at.desc()).limit(10).all()
-
-    history = []
-
-    for req in reversed(recent_requests):
-
-        responses = Response.query.filter_by(request_id=req.id).all()
-
-        response_text = responses[0].text if responses else "No response"
-
-        history.append({
-
-            'request': req.text,
-
-            'response': response_text,
-
-            'timestamp': req.created_at.isoformat()
-
-        })
-
-    return jsonify(history)
-
- 
-
-@app.route('/update_schedule/<int:schedule_id>', methods=['PUT'])
-
-def update_schedule(schedule_id):
-
-    data = request.json
-
-    schedule = Schedule.query.get(schedule_id)
-
-    if not schedule:
-
-        return jsonify({'error': 'Schedule not found'}), 404
-
- 
-
-    schedule.title = data.get('title', schedule.title)
-
-    new_time = data.get('start_time')
-
-    if new_time:
-
-        schedule.start_time = datetime.fromisoformat(new_time)
-
- 
-
-    db.session.commit()
-
-    return jsonify({'message': 'Schedule updated'})
-
- 
-
-@app.route('/register', methods=['POST'])
-
-def register():
-
-    data = request.json
-
-    username = data.get('username')
-
-    password = data.get('password')
-
-    if not username or not password:
-
-        return jsonify({'error': 'Username and password required'}), 400
-
-    if User.query.filter_by(username=username).first():
-
-        return jsonify({'error': 'User already exists'}), 400
-
-    user = User(username=username)
-
-    user.set_password(password)
-
-    db.session.add(user)
-
-    db.session.commit()
-
-    return jsonify({'message': 'User registered successfully'})
-
- 
-
-@app.route('/login', methods=['POST'])
-
-def login():
-
-    data = request.json
-
-    username = data.get('username')
-
-    password = data.get('password')
-
-    user = User.query.filter_by(username=username).first()
-
-    if user and user.check_password(password):
-
-        session['user_id'] = user.id
-
-        return jsonify({'message': 'Login successful', 'user_id': user.id})
-
-    return jsonify({'error': 'Invalid credentials'}), 401
-
- 
-
-@app.route('/logout', methods=['POST'])
-
-def logout():
-
-    session.pop('user_id', None)
-
-    return jsonify({'message': 'Logged out'})
-
-
-
-
-@app.route('/')
-
-def home():
-
-    return render_template('index.html')
-
- 
-
-@app.route('/<path:filename>')
-
-def serve_static_files(filename):
-
-    static_dir = os.path.join(app.root_path, 'static')
-
-    return send_from_directory(static_dir, filename)
-
- 
-
-@app.route('/add_schedule', methods=['POST'])
-
-def add_schedule():
-
-    try:
-
-        data = request.get_json()
-
-        title = data.get('title')
-
-        description = data.get('description')
-
-        start_time = data.get('start_time')
-
-        end_time = data.get('end_time')
-
- 
-
-        if not title or not start_time:
-
-            return jsonify({'error': 'Missing title or start time'}), 400
-
- 
-
-        new_schedule = Schedule(
-
-            title=title,
-
-            description=description,
-
-            start_time=datetime.fromisoformat(start_time),
-
-            end_time=datetime.fromisoformat(end_time) if end_time else None,
-
-            completed=False
-
-        )
-
- 
-
-        db.session.add(new_schedule)
-
-        db.session.commit()
-
-        return jsonify({'message': 'Schedule added successfully!'})
-
- 
-
-    except Exception as e:
-
-        import traceback
-
-        print("Error saving schedule:", e)
-
-        traceback.print_exc()  # print full error
-
-        return jsonify({'error': 'Could not save schedule'}), 500
-
- 
-
-@app.route('/add_task', methods=['POST'])
-
-def add_task():
-
-    try:
-
-        data = request.get_json()
-
-        title = data.get('title')
-
-        schedule_title = data.get('schedule')
-
-        due_date = data.get('due_date')
-
- 
-
-        if not title or not schedule_title:
-
-            return jsonify({'error': 'Missing task title or schedule'}), 400
-
- 
-
-        # Convert due date string to datetime if provided
-
-        due = None
-
-        if due_date:
-
-            try:
-
-                due = datetime.fromisoformat(due_date)
-
-            except Exception:
-
-                print("Invalid due date format received:", due_date)
-
- 
-
-        new_task = Task(
-
-            description=f"{title} (Schedule: {schedule_title})",
-
-            due_date=due,
-
-            completed=False
-
-        )
-
-        db.session.add(new_task)
-
-        db.session.commit()
-
-        print(f"✅ Task added: {new_task.description}, due: {new_task.due_date}")
-
- 
-
-        return jsonify({'message': 'Task added successfully!'})
-
- 
-
-    except Exception as e:
-
-        import traceback
-
-        print("Error adding task:", e)
-
-        traceback.print_exc()
-
-        return jsonify({'error': 'Could not add task'}), 500
-
-
-
-
-if __name__ == '__main__':
-
-    app.run(debug=True)
-
- 
-
- 
-
-=======
-from flask import Flask, request, jsonify, session, render_template, send_from_directory
+from flask import Flask, request, jsonify, session, render_template, send_from_directory, g, stream_with_context
 from flask_cors import CORS
-from models import db, Task, Schedule, User, Request, Response
-from scheduler import start_scheduler, schedule_reminder
-import re, os
-from datetime import datetime, timedelta
-import openai
+from models import db, Task, Schedule, User, Request, Response, upgrade_schema
+from scheduler import start_scheduler, schedule_reminder, schedule_interval
+from json_stream import ActionStreamParser, sse_event, json_array
+from llm_cache import parse_cache, make_key
+from llm_client import CircuitOpenError
+from model_router import router
+import rule_parser
+import intent_classifier
+from conversation_engine import intent_matcher
+import user_state
+import conversation_summary
+import retrieval
+from time_parser import parse_time, TimeRange
+import llm_client
+import metrics
 import os
-import ollama
+import json
+import hashlib
+import uuid
+from datetime import datetime
+from sqlalchemy import select, tuple_
+import openai
 
 app = Flask(__name__,
     template_folder='templates',  # <-- tell Flask where your HTMLs are
     static_folder='static'        # <-- tell Flask where your CSS/JS are
 )
-CORS(app)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///ai_assistant.db'
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=['X-Next-Cursor'])
+# Signs the session cookie that carries the user id every query is scoped to
+app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-change-in-production')
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///ai_assistant.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
 
@@ -1313,39 +372,74 @@ openai.api_key = os.getenv('OPENAI_API_KEY')
 
 with app.app_context():
     db.create_all()
+    upgrade_schema()
     start_scheduler()
-
-def parse_input_with_ollama(text, user_id=None):
-    # Get recent conversation history (last 10 requests and responses for better context)
-    history = []
-    if user_id:
-        recent_requests = Request.query.filter_by(user_id=user_id).order_by(Request.created_at.desc()).limit(10).all()
-        for req in reversed(recent_requests[:-1]):  # Exclude current
-            responses = Response.query.filter_by(request_id=req.id).all()
-            response_text = responses[0].text if responses else "No response"
-            history.append({"role": "user", "content": req.text})
-            history.append({"role": "assistant", "content": response_text})
-
-    # Get user data for personalization
+    if llm_client.OLLAMA_HEALTH_INTERVAL > 0:
+        schedule_interval(llm_client.ollama_pool.health_check, llm_client.OLLAMA_HEALTH_INTERVAL, 'ollama_health_check')
+    # Load models off the request path; /ready reports 503 until this finishes
+    llm_client.start_warm_up(router.models)
+    if llm_client.OLLAMA_KEEP_WARM_INTERVAL > 0:
+        schedule_interval(lambda: llm_client.keep_warm(router.models), llm_client.OLLAMA_KEEP_WARM_INTERVAL, 'ollama_keep_warm')
+
+def ollama_chat(**kwargs):
+    # Every model round trip goes through here so we can count calls per request
+    attempted = True
+    try:
+        return llm_client.chat(**kwargs)
+    except CircuitOpenError:
+        # Rejected by the breaker without reaching the model
+        attempted = False
+        raise
+    finally:
+        if attempted:
+            g.llm_calls = g.get('llm_calls', 0) + 1
+            metrics.incr('llm.calls')
+
+def model_available():
+    # False while every endpoint's breaker is open; callers go straight to the rule-based path
+    return not llm_client.ollama_pool.is_open
+
+# How many of the latest turns must match for a cached parse to be reused. -1 (the default)
+# keys on all the history the prompt carries, summary included: a reply like "yes" or
+# "move it to 5pm" means something different in every conversation
+LLM_CACHE_HISTORY_TURNS = int(os.getenv('LLM_CACHE_HISTORY_TURNS', '-1'))
+
+def load_prompt_context(user_id=None, text=None):
+    # Rolling summary of older turns plus the latest turns, within a fixed token budget
+    history = conversation_summary.prompt_history(user_id) if user_id else []
+
+    # Get user data for personalization (one lookup of the maintained snapshot)
     user_tasks = []
     user_schedules = []
     if user_id:
-        user_tasks = Task.query.filter_by(user_id=user_id).order_by(Task.created_at.desc()).limit(5).all()
-        user_schedules = Schedule.query.filter_by(user_id=user_id).order_by(Schedule.created_at.desc()).limit(5).all()
-
-    tasks_str = "\n".join([f"- {t.description} (Due: {t.due_date.isoformat() if t.due_date else 'No due date'}, Completed: {t.completed})" for t in user_tasks])
-    schedules_str = "\n".join([f"- {s.title} at {s.start_time.isoformat()}" for s in user_schedules])
+        snapshot = user_state.get_snapshot(user_id)
+        user_tasks = snapshot.recent_tasks
+        user_schedules = snapshot.recent_schedules
+
+    task_lines = [f"- {t['description']} (Due: {t['due_date'] or 'No due date'}, Completed: {t['completed']})" for t in user_tasks]
+    schedule_lines = [f"- {s['title']} at {s['start_time']}" for s in user_schedules]
+    # Older items that look related to the input, so the model does not have to ask about them;
+    # the ones already listed above are skipped by row id
+    shown = {('task', t['id']) for t in user_tasks} | {('schedule', s['id']) for s in user_schedules}
+    related = retrieval.relevant(user_id, text, exclude=shown) if user_id else []
+    return {'history': history, 'tasks': "\n".join(task_lines), 'schedules': "\n".join(schedule_lines),
+            'related': "\n".join(related)}
+
+def context_fingerprint(context):
+    # Hash of the user state the parse prompt is built from
+    if LLM_CACHE_HISTORY_TURNS < 0:
+        turns = context['history']
+    else:
+        turns = context['history'][-2 * LLM_CACHE_HISTORY_TURNS:] if LLM_CACHE_HISTORY_TURNS > 0 else []
+    state = json.dumps([context['tasks'], context['schedules'], context['related'], turns])
+    return hashlib.sha1(state.encode('utf-8')).hexdigest()
 
-    prompt = f"""
+# Static instructions go first and never change, so the model server can reuse their
+# prompt cache across turns and users; only the per-user state and the input follow them
+PARSE_SYSTEM_PROMPT = """
 You are an advanced interactive AI assistant for a personal assistant app. You can create tasks, schedules, reminders, answer questions, and engage in natural conversation. Use the user's recent tasks and schedules to provide personalized suggestions and context.
 
-User's recent tasks:
-{tasks_str}
-
-User's recent schedules:
-{schedules_str}
-
-User input: "{text}"
+Each user message gives the user's recent tasks, recent schedules and their input.
 
 First, extract any actions if present:
 - Tasks: List of task descriptions to create (be specific and actionable).
@@ -1360,194 +454,409 @@ Return a JSON object with keys: tasks, schedules, update_schedules, reminders, q
 Then, generate a conversational response that confirms actions, provides context from user data, engages the user, and asks follow-up questions if needed.
 
 Example JSON:
-{{
+{
   "tasks": ["Finish the quarterly report by end of day"],
-  "schedules": [{{"title": "Team Meeting", "start_time": "2023-10-01T14:00:00"}}],
+  "schedules": [{"title": "Team Meeting", "start_time": "2023-10-01T14:00:00"}],
   "update_schedules": [],
-  "reminders": [{{"description": "Call dentist", "time": "2023-10-02T09:00:00"}}],
-  "query": {{"completed": false, "filter": "today"}},
+  "reminders": [{"description": "Call dentist", "time": "2023-10-02T09:00:00"}],
+  "query": {"completed": false, "filter": "today"},
   "clarification": false,
   "response": "I've added 'Finish the quarterly report' to your tasks, noting you have a meeting at 2 PM. Do you need help with anything else today?"
-}}
+}
 
 Handle multi-step requests, natural language, and provide helpful, personalized responses.
 """
-    messages = history + [{"role": "user", "content": prompt}]
+
+ACTION_KEYS = ('tasks', 'schedules', 'update_schedules', 'reminders', 'query', 'clarification')
+
+# JSON schema the parse reply is constrained to. Action keys come before "response" so they
+# finish decoding first and can be saved while the reply text is still being generated.
+PARSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "tasks": {"type": "array", "items": {"type": "string"}},
+        "schedules": {"type": "array", "items": {
+            "type": "object",
+            "properties": {"title": {"type": "string"}, "start_time": {"type": "string"},
+                           "end_time": {"type": "string"}},
+            "required": ["title", "start_time"]}},
+        "update_schedules": {"type": "array", "items": {
+            "type": "object",
+            "properties": {"title": {"type": "string"}, "new_start_time": {"type": "string"}},
+            "required": ["title", "new_start_time"]}},
+        "reminders": {"type": "array", "items": {
+            "type": "object",
+            "properties": {"description": {"type": "string"}, "time": {"type": "string"}},
+            "required": ["description", "time"]}},
+        "query": {"type": ["object", "null"], "properties": {
+            "completed": {"type": "boolean"}, "filter": {"type": "string"}}},
+        "clarification": {"type": "boolean"},
+        "response": {"type": "string"},
+    },
+    "required": list(ACTION_KEYS) + ["response"],
+}
+
+# 'schema' needs an Ollama server with structured outputs; 'json' only forces valid JSON
+PARSE_FORMAT = PARSE_SCHEMA if os.getenv('OLLAMA_PARSE_FORMAT', 'schema') == 'schema' else 'json'
+
+def build_parse_messages(text, context):
+    prompt = f"""Today is {datetime.now().strftime('%A %Y-%m-%d %H:%M')}.
+
+User's recent tasks:
+{context['tasks']}
+
+User's recent schedules:
+{context['schedules']}
+
+Other tasks and schedules related to the input:
+{context['related']}
+
+User input: "{text}"
+"""
+    return [{"role": "system", "content": PARSE_SYSTEM_PROMPT}] + context['history'] + [{"role": "user", "content": prompt}]
+
+def session_user_id(create=False):
+    # Every task, schedule and request belongs to the session's user. Visitors who have not
+    # logged in get a guest account on their first write, so their data is theirs alone too.
+    # None means the request has no owner: reads return nothing and writes are refused,
+    # never filtered on user_id IS NULL, which would match the legacy unowned rows.
+    user_id = session.get('user_id')
+    if user_id is None and create:
+        guest = User(username=f"guest-{uuid.uuid4().hex[:12]}")
+        guest.set_password(uuid.uuid4().hex)
+        db.session.add(guest)
+        db.session.commit()
+        session['user_id'] = user_id = guest.id
+        session['is_guest'] = True
+    return user_id
+
+def invalidate_user_cache(user_id=None):
+    # Cached parses were computed from the old task/schedule lists
+    parse_cache.invalidate_user(user_id)
+
+def parse_input_with_ollama(text, user_id=None, fallback=None):
+    if not model_available():
+        g.parse_route = 'llm_fallback'
+        return fallback if fallback is not None else parse_input_improved(text)
+
+    context = load_prompt_context(user_id, text)
+    cache_key = make_key(text, context_fingerprint(context))
+    cached = parse_cache.get(cache_key)
+    if cached is not None:
+        g.parse_route = 'llm_cache'
+        return cached
+
+    messages = build_parse_messages(text, context)
     try:
-        response = ollama.chat(
-            model='llama2',  # Assuming llama2 is available; can be changed to other models like mistral
+        response = ollama_chat(
+            model=router.pick(text, 500),
             messages=messages,
+            format=PARSE_FORMAT,
             options={'temperature': 0.7, 'num_predict': 500}
         )
         result = response['message']['content'].strip()
-        import json
         parsed = json.loads(result)
+        parse_cache.set(cache_key, parsed, user_id)
         return parsed
     except Exception as e:
         print(f"Ollama error: {e}")
         # Improved fallback
-        return parse_input_improved(text)
+        g.parse_route = 'llm_fallback'
+        return fallback if fallback is not None else parse_input_improved(text)
+
+# Rule parses at or above this confidence are committed without asking the model
+FAST_PATH_THRESHOLD = float(os.getenv('FAST_PATH_THRESHOLD', '0.8'))
+
+def fast_path(text):
+    # Run the rule parser first; returns its parse, its confidence and whether it is good enough
+    rule_parsed = parse_input_improved(text)
+    confidence = rule_parsed['confidence']
+    use_rules = confidence >= FAST_PATH_THRESHOLD
+    g.parse_route = 'rules' if use_rules else 'llm'
+    has_actions = any(rule_parsed[key] for key in ('tasks', 'schedules', 'update_schedules', 'reminders'))
+    # Any action keyword keeps the parse: a wrong skip would silently drop the user's actions
+    action_keywords = set(intent_matcher.match(text)) - intent_classifier.CONVERSATIONAL_INTENTS
+    if not use_rules and not has_actions and not action_keywords and intent_classifier.is_conversational(text):
+        # Small talk: only the cheaper reply generation runs
+        rule_parsed = dict(rule_parsed, response='', clarification=False)
+        g.parse_route = 'classifier'
+        use_rules = True
+    return rule_parsed, confidence, use_rules
+
+def route_and_parse(text, user_id=None):
+    rule_parsed, confidence, use_rules = fast_path(text)
+    if use_rules:
+        return rule_parsed, confidence
+    return parse_input_with_ollama(text, user_id, fallback=rule_parsed), confidence
+
+def record_route(req, confidence):
+    # Stored per request so FAST_PATH_THRESHOLD can be tuned from real traffic
+    req.route = g.get('parse_route', 'llm')
+    req.route_confidence = confidence
+    metrics.incr(f'route.{req.route}')
+    metrics.observe('route.confidence', confidence)
 
 def parse_input_improved(text):
-    # Improved fallback parsing with better regex and natural language handling
-    tasks = []
-    schedules = []
-    update_schedules = []
-    reminders = []
-    query = {}
-    clarification = False
-
-    # Detect tasks: various patterns
-    task_patterns = [
-        r'(?:create|add|make) (?:a |an )?task(?: to)? (.+)',
-        r'(?:i need to|i have to|i should) (.+)',
-        r'(?:remind me|note) (.+)'
-    ]
-    for pattern in task_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            tasks.append(match.group(1).strip())
-            break
+    # Single-scan rule parser; same JSON shape as the model parse plus a confidence score
+    return rule_parser.parse(text).to_dict()
 
-    # Detect schedules: various patterns
-    schedule_patterns = [
-        r'(?:schedule|set up|plan) (.+?) (?:at|for) (.+)',
-        r'(?:meeting|appointment) (.+?) (?:at|on) (.+)'
-    ]
-    for pattern in schedule_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            title = match.group(1).strip()
-            time_str = match.group(2).strip()
-            # Improved time parsing
-            try:
-                # Try HH:MM format
-                start_time = datetime.strptime(time_str, '%H:%M')
-                start_time = datetime.combine(datetime.today(), start_time.time())
-                schedules.append({'title': title, 'start_time': start_time.isoformat()})
-            except ValueError:
-                try:
-                    # Try "at 3pm" or similar
-                    time_match = re.search(r'(\d{1,2})(?::(\d{2}))?\s*(am|pm)', time_str, re.IGNORECASE)
-                    if time_match:
-                        hour = int(time_match.group(1))
-                        minute = int(time_match.group(2)) if time_match.group(2) else 0
-                        ampm = time_match.group(3).lower()
-                        if ampm == 'pm' and hour != 12:
-                            hour += 12
-                        elif ampm == 'am' and hour == 12:
-                            hour = 0
-                        start_time = datetime.combine(datetime.today(), datetime.min.time().replace(hour=hour, minute=minute))
-                        schedules.append({'title': title, 'start_time': start_time.isoformat()})
-                    else:
-                        clarification = True
-                except:
-                    clarification = True
-            break
-
-    # Detect update schedules
-    update_match = re.search(r'(?:update|change|reschedule) (.+?) (?:to|at) (.+)', text, re.IGNORECASE)
-    if update_match:
-        title = update_match.group(1).strip()
-        new_time_str = update_match.group(2).strip()
-        # Similar parsing as above
-        try:
-            start_time = datetime.strptime(new_time_str, '%H:%M')
-            start_time = datetime.combine(datetime.today(), start_time.time())
-            update_schedules.append({'title': title, 'new_start_time': start_time.isoformat()})
-        except ValueError:
-            clarification = True
-
-    # Detect reminders
-    reminder_match = re.search(r'(?:remind me|set a reminder) (?:to )?(.+?) (?:in|at) (.+)', text, re.IGNORECASE)
-    if reminder_match:
-        desc = reminder_match.group(1).strip()
-        time_part = reminder_match.group(2).strip()
-        # Parse time
-        mins_match = re.search(r'(\d+) minutes?', time_part, re.IGNORECASE)
-        if mins_match:
-            mins = int(mins_match.group(1))
-            reminder_time = datetime.now() + timedelta(minutes=mins)
-            reminders.append({'description': desc, 'time': reminder_time.isoformat()})
-        else:
-            clarification = True
+@app.route('/process_input', methods=['POST'])
+def process_input():
+    data = request.json
+    text = data.get('text', '')
+    # Save the raw input as a request
+    user_id = session_user_id(create=True)
+    req = Request(text=text, user_id=user_id)
+    db.session.add(req)
+    db.session.commit()
+    parsed, confidence = route_and_parse(text, user_id)
+    persist_parsed(parsed, user_id)
+    record_route(req, confidence)
 
-    # Detect queries
-    if re.search(r'(?:show|list|get) (?:done|completed) tasks?', text, re.IGNORECASE):
-        query['completed'] = True
-    elif re.search(r'(?:show|list|get) (?:undone|incomplete|pending) tasks?', text, re.IGNORECASE):
-        query['completed'] = False
-    elif re.search(r'(?:what|show) (?:do i have|are my) tasks?', text, re.IGNORECASE):
-        query['completed'] = False
+    # Use AI response from parsed if available, else template or generate
+    response_message = synthesize_response(text, parsed)
 
-    response = "I'm not sure what you mean. Could you clarify?"
-    if tasks or schedules or reminders:
-        response = "Got it! I've processed your request."
-    elif query:
-        response = "Here are your tasks."
+    # Save the AI response to the database
+    ai_response = Response(text=response_message, request_id=req.id)
+    db.session.add(ai_response)
+    db.session.commit()
+    conversation_summary.maybe_summarize(app, user_id)
 
-    return {'tasks': tasks, 'schedules': schedules, 'update_schedules': update_schedules, 'reminders': reminders, 'query': query, 'clarification': clarification, 'response': response}
+    llm_calls = g.get('llm_calls', 0)
+    metrics.incr('process_input.requests')
+    metrics.observe('process_input.llm_calls', llm_calls)
+    return jsonify({'message': response_message, 'parsed': parsed, 'llm_calls': llm_calls, 'route': req.route})
 
-@app.route('/process_input', methods=['POST'])
-def process_input():
+@app.route('/process_input_stream', methods=['POST'])
+def process_input_stream():
+    # Same pipeline as /process_input, but the reply is sent as server-sent events while it decodes
     data = request.json
     text = data.get('text', '')
-    # Save the raw input as a request
-    user_id = session.get('user_id')
+    user_id = session_user_id(create=True)
     req = Request(text=text, user_id=user_id)
     db.session.add(req)
     db.session.commit()
-    parsed = parse_input_with_ollama(text, user_id)
+    request_id = req.id
+
+    def generate():
+        reply_parts = []
+        rule_parsed, confidence, use_rules = fast_path(text)
+        parsed = rule_parsed if use_rules else None
+        if parsed is None and not model_available():
+            g.parse_route = 'llm_fallback'
+            parsed = rule_parsed
+        if parsed is None:
+            context = load_prompt_context(user_id, text)
+            cache_key = make_key(text, context_fingerprint(context))
+            parsed = parse_cache.get(cache_key)
+            if parsed is not None:
+                g.parse_route = 'llm_cache'
+        persisted = set()
+        if parsed is None:
+            parser = ActionStreamParser('response')
+            try:
+                for chunk in ollama_chat(
+                    model=router.pick(text, 500),
+                    messages=build_parse_messages(text, context),
+                    format=PARSE_FORMAT,
+                    options={'temperature': 0.7, 'num_predict': 500},
+                    stream=True
+                ):
+                    for event in parser.feed(chunk['message']['content']):
+                        if event[0] == 'text':
+                            if not reply_parts:
+                                metrics.incr('process_input_stream.first_token')
+                            reply_parts.append(event[1])
+                            yield sse_event('token', {'text': event[1]})
+                        elif event[1] in ACTION_KEYS:
+                            # Save each action list as soon as it closes, while the reply keeps decoding
+                            key, value = event[1], event[2]
+                            persist_parsed({key: value}, user_id)
+                            persisted.add(key)
+                            yield sse_event('action', {key: value})
+                if not parser.done:
+                    raise ValueError("model reply ended before the JSON object closed")
+                parsed = parser.fields
+                parse_cache.set(cache_key, parsed, user_id)
+            except Exception as e:
+                print(f"Ollama stream error: {e}")
+                g.parse_route = 'llm_fallback'
+                # Actions already saved from the stream are kept; the rule parse would duplicate them
+                parsed = parser.fields if persisted else rule_parsed
+                # Anything already streamed belonged to a reply we could not finish
+                if reply_parts:
+                    yield sse_event('reset', {})
+                reply_parts = []
+
+        persist_parsed({key: value for key, value in parsed.items() if key not in persisted}, user_id)
+        yield sse_event('actions', {key: parsed.get(key) for key in ACTION_KEYS})
+
+        if reply_parts:
+            response_message = ''.join(reply_parts).strip()
+        else:
+            for delta in stream_response(text, parsed):
+                reply_parts.append(delta)
+                yield sse_event('token', {'text': delta})
+            response_message = ''.join(reply_parts).strip()
+
+        db.session.add(Response(text=response_message, request_id=request_id))
+        record_route(db.session.get(Request, request_id), confidence)
+        db.session.commit()
+        conversation_summary.maybe_summarize(app, user_id)
+
+        llm_calls = g.get('llm_calls', 0)
+        metrics.incr('process_input_stream.requests')
+        metrics.observe('process_input.llm_calls', llm_calls)
+        yield sse_event('done', {'message': response_message, 'llm_calls': llm_calls, 'route': g.get('parse_route')})
+
+    return app.response_class(stream_with_context(generate()), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def model_datetime(value):
+    # Model output is not trusted to be ISO; None when it is not
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
 
-    # Save to DB
+def persist_parsed(parsed, user_id=None):
+    # Save every extracted action in one transaction. Items with a missing title or an unreadable
+    # time are skipped one by one, so a bad item never costs the rest of the reply its actions.
     for task_desc in parsed.get('tasks', []):
-        task = Task(description=task_desc)
-        db.session.add(task)
+        if isinstance(task_desc, str) and task_desc.strip():
+            db.session.add(Task(description=task_desc, user_id=user_id))
 
     for sched in parsed.get('schedules', []):
-        start_time = datetime.fromisoformat(sched['start_time'])
-        schedule = Schedule(title=sched['title'], start_time=start_time)
-        db.session.add(schedule)
+        sched = sched if isinstance(sched, dict) else {}
+        start_time = model_datetime(sched.get('start_time'))
+        if not sched.get('title') or start_time is None:
+            print(f"⚠️  Skipping schedule with no title or an invalid start time: {sched}")
+            continue
+        end_time = model_datetime(sched.get('end_time'))
+        db.session.add(Schedule(title=sched['title'], start_time=start_time, end_time=end_time, user_id=user_id))
 
     for update_sched in parsed.get('update_schedules', []):
-        schedule = Schedule.query.filter_by(title=update_sched['title']).first()
+        update_sched = update_sched if isinstance(update_sched, dict) else {}
+        new_start = model_datetime(update_sched.get('new_start_time'))
+        if not update_sched.get('title') or new_start is None:
+            print(f"⚠️  Skipping schedule update with no title or an invalid time: {update_sched}")
+            continue
+        schedule = Schedule.query.filter_by(user_id=user_id, title=update_sched['title']).first()
         if schedule:
-            new_start_time = datetime.fromisoformat(update_sched['new_start_time'])
-            schedule.start_time = new_start_time
-            db.session.commit()
+            schedule.start_time = new_start
 
+    reminder_tasks = []
     for rem in parsed.get('reminders', []):
-        time = datetime.fromisoformat(rem['time'])
-        task = Task(description=rem['description'], due_date=time)
+        rem = rem if isinstance(rem, dict) else {}
+        time = model_datetime(rem.get('time'))
+        if not rem.get('description') or time is None:
+            print(f"⚠️  Skipping reminder with no description or an invalid time: {rem}")
+            continue
+        task = Task(description=rem['description'], due_date=time, user_id=user_id)
         db.session.add(task)
-        schedule_reminder(task.id, rem['description'], time)
-
-    db.session.commit()
+        reminder_tasks.append((task, time))
 
-    # Use AI response from parsed if available, else generate
-    response_message = parsed.get('response', generate_ai_response(text, parsed))
+    # Reminder jobs are keyed on the task id, which the flush assigns
+    db.session.flush()
+    for task, time in reminder_tasks:
+        schedule_reminder(task.id, task.description, time)
 
-    # Save the AI response to the database
-    ai_response = Response(text=response_message, request_id=req.id)
-    db.session.add(ai_response)
     db.session.commit()
+    if any(parsed.get(key) for key in ('tasks', 'schedules', 'update_schedules', 'reminders')):
+        invalidate_user_cache(user_id)
+
+def synthesize_response(user_input, parsed):
+    # The parse call usually already wrote a reply; only generate again when it didn't
+    reply = parsed.get('response')
+    if isinstance(reply, str) and reply.strip():
+        metrics.incr('response.from_parse')
+        return reply.strip()
+
+    reply = template_response(parsed)
+    if reply:
+        metrics.incr('response.from_template')
+        return reply
+
+    metrics.incr('response.generated')
+    return generate_ai_response(user_input, parsed)
+
+def stream_response(user_input, parsed):
+    # Streaming counterpart of synthesize_response: yields the reply in pieces
+    reply = parsed.get('response')
+    if isinstance(reply, str) and reply.strip():
+        metrics.incr('response.from_parse')
+        yield reply.strip()
+        return
+
+    reply = template_response(parsed)
+    if reply:
+        metrics.incr('response.from_template')
+        yield reply
+        return
+
+    metrics.incr('response.generated')
+    try:
+        for chunk in ollama_chat(
+            model=router.pick(user_input, 150),
+            messages=build_response_messages(user_input, parsed),
+            options={'temperature': 0.7, 'num_predict': 150},
+            stream=True
+        ):
+            yield chunk['message']['content']
+    except Exception as e:
+        print(f"Ollama response error: {e}")
+        yield "Processed your request successfully. What do you have to do today?"
 
-    return jsonify({'message': response_message, 'parsed': parsed})
+def format_time(iso_time):
+    try:
+        when = datetime.fromisoformat(iso_time)
+    except (TypeError, ValueError):
+        return iso_time
+    if when.date() == datetime.today().date():
+        return when.strftime('%I:%M %p').lstrip('0')
+    return when.strftime('%a %d %b, %I:%M %p')
+
+def template_response(parsed):
+    # Build a confirmation from the extracted actions without another model call
+    lines = []
+    for task_desc in parsed.get('tasks', []):
+        lines.append(f"✅ Added task '{task_desc}'.")
+    for sched in parsed.get('schedules', []):
+        lines.append(f"📅 Scheduled '{sched.get('title')}' for {format_time(sched.get('start_time'))}.")
+    for update_sched in parsed.get('update_schedules', []):
+        lines.append(f"🔄 Moved '{update_sched.get('title')}' to {format_time(update_sched.get('new_start_time'))}.")
+    for rem in parsed.get('reminders', []):
+        lines.append(f"⏰ I'll remind you to {rem.get('description')} at {format_time(rem.get('time'))}.")
 
-def generate_ai_response(user_input, parsed):
-    prompt = f"""
-You are a helpful AI assistant. The user said: "{user_input}"
+    query = parsed.get('query') or {}
+    if not lines and 'completed' in query:
+        return "Here are your completed tasks." if query['completed'] else "Here are your pending tasks."
+    if not lines:
+        return None
 
-Based on the parsed data: {parsed}
+    lines.append("Anything else you'd like me to plan?")
+    return "\n".join(lines)
+
+RESPONSE_SYSTEM_PROMPT = """
+You are a helpful AI assistant. You are given what the user said and the actions parsed from it.
 
 Generate a friendly, conversational response as if you're talking to the user while performing the task. For example, "Alright, I'm adding that task for you. Done! Task 'Finish report' has been created. Is there anything else on your mind today?"
 
 Keep it natural, engaging, and end with a question to continue the conversation.
 """
+
+def build_response_messages(user_input, parsed):
+    prompt = f"""The user said: "{user_input}"
+
+Based on the parsed data: {parsed}
+"""
+    return [{"role": "system", "content": RESPONSE_SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+
+def generate_ai_response(user_input, parsed):
     try:
-        response = ollama.chat(
-            model='llama2',
-            messages=[{"role": "user", "content": prompt}],
+        response = ollama_chat(
+            model=router.pick(user_input, 150),
+            messages=build_response_messages(user_input, parsed),
             options={'temperature': 0.7, 'num_predict': 150}
         )
         return response['message']['content'].strip()
@@ -1555,66 +864,192 @@ Keep it natural, engaging, and end with a question to continue the conversation.
         print(f"Ollama response error: {e}")
         return "Processed your request successfully. What do you have to do today?"
 
-# @app.route('/add_schedule', methods=['POST'])
-# def add_schedule():
-#     data = request.get_json()
-#     title = data.get('title')
-#     description = data.get('description')
-#     start_time = data.get('start_time')
-#     end_time = data.get('end_time')
-
-#     if not title or not start_time:
-#         return jsonify({'error': 'Missing title or start time'}), 400
-
-#     try:
-#         new_schedule = Schedule(
-#             title=title,
-#             description=description,
-#             start_time=datetime.fromisoformat(start_time),
-#             end_time=datetime.fromisoformat(end_time) if end_time else None
-#         )
-#         db.session.add(new_schedule)
-#         db.session.commit()
-#         return jsonify({'message': 'Schedule added successfully!'})
-#     except Exception as e:
-#         print("Error saving schedule:", e)
-#         return jsonify({'error': 'Could not save schedule'}), 500
+LIST_PAGE_SIZE = int(os.getenv('LIST_PAGE_SIZE', '100'))
+LIST_MAX_PAGE_SIZE = int(os.getenv('LIST_MAX_PAGE_SIZE', '500'))
+# Rows fetched from the DB cursor and written to the client at a time in ?stream=true mode
+STREAM_CHUNK_ROWS = int(os.getenv('STREAM_CHUNK_ROWS', '500'))
+
+TASK_FIELDS = ('id', 'description', 'due_date', 'completed')
+SCHEDULE_FIELDS = ('id', 'title', 'start_time', 'end_time', 'description', 'completed')
+
+def requested_fields(allowed):
+    # ?fields=id,title selects a subset of the columns; default is all of them
+    names = [name.strip() for name in request.args.get('fields', ','.join(allowed)).split(',') if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown or not names:
+        raise ValueError(f"fields must be a subset of {','.join(allowed)}")
+    return names
+
+def time_bound(name):
+    value = request.args.get(name)
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO date/time")
+
+def row_dict(row, names):
+    return {name: getattr(row, name).isoformat() if isinstance(getattr(row, name), datetime)
+            else getattr(row, name) for name in names}
+
+def stream_json(queries, to_dict, **headers):
+    # Send a JSON array while the DB cursor is still being read, STREAM_CHUNK_ROWS rows at a time,
+    # so the first byte goes out at once and memory does not grow with the result.
+    # The queries are read one after another into the same array.
+    items = (to_dict(row) for query in queries for row in query.yield_per(STREAM_CHUNK_ROWS))
+    return app.response_class(stream_with_context(json_array(items, STREAM_CHUNK_ROWS)),
+                              mimetype='application/json', headers=headers)
+
+def list_page(model, user_id, segments, filters, allowed_fields):
+    # One page of the user's rows. segments is a list of (sort_column, descending, segment_filters)
+    # read one after another, each in (sort_column, id) order along the (user_id, sort_column) index,
+    # so SQLite never sorts a page itself. Pages continue from ?after=<id>: the segment holding that
+    # row goes on past it (> ascending, < descending) and later segments follow from their start.
+    # Only the requested columns are read. ?stream=true sends every remaining row as one streamed
+    # array instead of a page.
+    names = requested_fields(allowed_fields)
+    if user_id is None:
+        return jsonify([])
+    limit = min(max(request.args.get('limit', LIST_PAGE_SIZE, type=int), 1), LIST_MAX_PAGE_SIZE)
+    columns = [getattr(model, name) for name in names if name != 'id']
+    after = request.args.get('after', type=int)
+    if after is not None and len(segments) > 1:
+        # Skip the segments before the one the cursor row is in
+        for index, (_, _, segment_filters) in enumerate(segments):
+            if db.session.query(model.id).filter(
+                    model.id == after, model.user_id == user_id, *segment_filters).first() is not None:
+                segments = segments[index:]
+                break
+        else:
+            return jsonify([])
+    queries = []
+    for sort_column, descending, segment_filters in segments:
+        query = db.session.query(model.id, *columns).filter(model.user_id == user_id, *filters, *segment_filters)
+        if after is not None and not queries:
+            cursor = select(sort_column, model.id).where(model.id == after, model.user_id == user_id).scalar_subquery()
+            position = tuple_(sort_column, model.id)
+            query = query.filter(position < cursor if descending else position > cursor)
+        if descending:
+            query = query.order_by(sort_column.desc(), model.id.desc())
+        else:
+            query = query.order_by(sort_column, model.id)
+        queries.append(query)
+    if request.args.get('stream', '').lower() == 'true':
+        return stream_json(queries, lambda row: row_dict(row, names))
+    rows = []
+    for query in queries:
+        rows += query.limit(limit + 1 - len(rows)).all()
+        if len(rows) > limit:
+            break
+    page = rows[:limit]
+    response = jsonify([row_dict(row, names) for row in page])
+    if len(rows) > limit:
+        response.headers['X-Next-Cursor'] = str(page[-1].id)
+    return response
+
+def prefix_range(column, prefix):
+    # Case-sensitive prefix as a range, so SQLite can seek the (user_id, column) index; LIKE would scan
+    return [column >= prefix, column < prefix[:-1] + chr(ord(prefix[-1]) + 1)]
 
+def completed_filter(model):
+    value = request.args.get('completed')
+    return [] if value is None else [model.completed == (value.lower() == 'true')]
 
 @app.route('/get_tasks', methods=['GET'])
 def get_tasks():
-    completed_filter = request.args.get('completed')
-    if completed_filter is not None:
-        completed = completed_filter.lower() == 'true'
-        tasks = Task.query.filter_by(completed=completed).all()
-    else:
-        tasks = Task.query.all()
-    return jsonify([{
-        'id': t.id,
-        'description': t.description,
-        'due_date': t.due_date.isoformat() if t.due_date else None,
-        'completed': t.completed
-    } for t in tasks])
+    # Filters: ?completed=, ?due_after= / ?due_before= (ISO), ?prefix= and ?contains= on the description.
+    # Pages come newest first, in due-date order with a due range and in description order
+    # with a prefix, each along its own index. ?contains= is the exception: a substring cannot use
+    # an index, so it is checked on every one of the user's rows walked newest first.
+    try:
+        filters = completed_filter(Task)
+        order = (Task.created_at, True)
+        due_after, due_before = time_bound('due_after'), time_bound('due_before')
+        if due_after:
+            filters.append(Task.due_date >= due_after)
+        if due_before:
+            filters.append(Task.due_date < due_before)
+        if due_after or due_before:
+            order = (Task.due_date, False)
+        if request.args.get('prefix'):
+            filters += prefix_range(Task.description, request.args['prefix'])
+            order = (Task.description, False)
+        if request.args.get('contains'):
+            filters.append(Task.description.contains(request.args['contains'], autoescape=True))
+        return list_page(Task, session_user_id(), [(*order, [])], filters, TASK_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
 @app.route('/mark_done/<int:task_id>', methods=['PUT'])
 def mark_done(task_id):
-    task = Task.query.get(task_id)
+    user_id = session_user_id()
+    if user_id is None:
+        return jsonify({'error': 'Task not found'}), 404
+    task = Task.query.filter_by(id=task_id, user_id=user_id).first()
     if task:
         task.completed = True
         db.session.commit()
+        invalidate_user_cache(user_id)
         return jsonify({'message': 'Task marked as done'})
     return jsonify({'error': 'Task not found'}), 404
 
+@app.route('/mark_schedule_done/<int:schedule_id>', methods=['PUT'])
+def mark_schedule_done(schedule_id):
+    user_id = session_user_id()
+    if user_id is None:
+        return jsonify({'error': 'Schedule not found'}), 404
+    schedule = Schedule.query.filter_by(id=schedule_id, user_id=user_id).first()
+    if not schedule:
+        return jsonify({'error': 'Schedule not found'}), 404
+
+    # Mark schedule as completed
+    schedule.completed = True
+
+    # Optionally mark related tasks as done
+    related_tasks = Task.query.filter(Task.user_id == user_id, Task.description.ilike(f"%{schedule.title}%")).all()
+    for t in related_tasks:
+        t.completed = True
+
+    try:
+        db.session.commit()
+        invalidate_user_cache(user_id)
+        return jsonify({'message': f'Schedule \"{schedule.title}\" marked as completed.'})
+    except Exception as e:
+        print("Error updating schedule:", e)
+        return jsonify({'error': 'Could not update schedule'}), 500
+
 @app.route('/get_schedules', methods=['GET'])
 def get_schedules():
-    schedules = Schedule.query.all()
-    return jsonify([{
-        'id': s.id,
-        'title': s.title,
-        'start_time': s.start_time.isoformat(),
-        'end_time': s.end_time.isoformat() if s.end_time else None,
-        'description': s.description
-    } for s in schedules])
+    # Filters: ?completed=, ?start_after= / ?start_before= (ISO) and ?prefix= on the title.
+    # Without them, pages start at today's schedules and go forward in start-time order, then go on
+    # to the past ones, most recent first. A start range pages in start-time order and a prefix in
+    # title order. Every segment is read along its own index.
+    try:
+        filters = completed_filter(Schedule)
+        start_after, start_before = time_bound('start_after'), time_bound('start_before')
+        if start_after:
+            filters.append(Schedule.start_time >= start_after)
+        if start_before:
+            filters.append(Schedule.start_time < start_before)
+        if request.args.get('prefix'):
+            filters += prefix_range(Schedule.title, request.args['prefix'])
+            segments = [(Schedule.title, False, [])]
+        elif start_after or start_before:
+            segments = [(Schedule.start_time, False, [])]
+        else:
+            today = datetime.combine(datetime.today(), datetime.min.time())
+            segments = [(Schedule.start_time, False, [Schedule.start_time >= today]),
+                        (Schedule.start_time, True, [Schedule.start_time < today])]
+        return list_page(Schedule, session_user_id(), segments, filters, SCHEDULE_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        import traceback
+        print("Error fetching schedules:", e)
+        traceback.print_exc()
+        return jsonify({'error': 'Could not fetch schedules'}), 500
+
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '10'))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv('HISTORY_MAX_PAGE_SIZE', '100'))
 
 @app.route('/get_conversation_history', methods=['GET'])
 def get_conversation_history():
@@ -1622,29 +1057,65 @@ def get_conversation_history():
     if not user_id:
         return jsonify({'error': 'User not logged in'}), 401
 
-    # Get recent requests and their responses
-    recent_requests = Request.query.filter_by(user_id=user_id).order_by(Request.created_at.desc()).limit(10).all()
+    # A page of requests with their latest replies in one query; ?before=<id> pages back from
+    # that request along the (user_id, created_at) index, so deep pages cost the same as the first
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), HISTORY_MAX_PAGE_SIZE)
+    query = conversation_summary.turns_query(user_id)
+    before = request.args.get('before', type=int)
+    if before is not None:
+        cursor = db.session.query(Request.created_at, Request.id).filter_by(id=before, user_id=user_id).subquery()
+        query = query.filter(tuple_(Request.created_at, Request.id) < select(cursor.c.created_at, cursor.c.id).scalar_subquery())
+    rows = query.limit(limit + 1).all()
+    page = rows[:limit]
     history = []
-    for req in reversed(recent_requests):
-        responses = Response.query.filter_by(request_id=req.id).all()
-        response_text = responses[0].text if responses else "No response"
+    for req, response_text in reversed(page):
         history.append({
+            'id': req.id,
             'request': req.text,
-            'response': response_text,
+            'response': response_text if response_text is not None else "No response",
             'timestamp': req.created_at.isoformat()
         })
-    return jsonify(history)
+    response = jsonify(history)
+    if len(rows) > limit:
+        # Oldest request on this page; pass it back as ?before= for the page before it
+        response.headers['X-Next-Cursor'] = str(page[-1][0].id)
+    return response
+
+@app.route('/export_conversation_history', methods=['GET'])
+def export_conversation_history():
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'User not logged in'}), 401
+
+    # The whole conversation, oldest first, streamed from the same join as the history pages
+    query = (conversation_summary.turns_query(user_id)
+             .with_entities(Request.id, Request.text, Request.created_at, Response.text.label('response'))
+             .order_by(None).order_by(Request.created_at, Request.id))
+    return stream_json([query], lambda row: {
+        'id': row.id,
+        'request': row.text,
+        'response': row.response if row.response is not None else "No response",
+        'timestamp': row.created_at.isoformat()
+    }, **{'Content-Disposition': 'attachment; filename="conversation_history.json"'})
 
 @app.route('/update_schedule/<int:schedule_id>', methods=['PUT'])
 def update_schedule(schedule_id):
     data = request.json
-    schedule = Schedule.query.get(schedule_id)
-    if schedule:
-        schedule.title = data.get('title', schedule.title)
-        schedule.start_time = datetime.fromisoformat(data.get('start_time', schedule.start_time.isoformat()))
-        db.session.commit()
-        return jsonify({'message': 'Schedule updated'})
-    return jsonify({'error': 'Schedule not found'}), 404
+    user_id = session_user_id()
+    if user_id is None:
+        return jsonify({'error': 'Schedule not found'}), 404
+    schedule = Schedule.query.filter_by(id=schedule_id, user_id=user_id).first()
+    if not schedule:
+        return jsonify({'error': 'Schedule not found'}), 404
+
+    schedule.title = data.get('title', schedule.title)
+    new_time = data.get('start_time')
+    if new_time:
+        schedule.start_time = datetime.fromisoformat(new_time)
+
+    db.session.commit()
+    invalidate_user_cache(user_id)
+    return jsonify({'message': 'Schedule updated'})
 
 @app.route('/register', methods=['POST'])
 def register():
@@ -1669,24 +1140,26 @@ def login():
     user = User.query.filter_by(username=username).first()
     if user and user.check_password(password):
         session['user_id'] = user.id
+        session.pop('is_guest', None)
         return jsonify({'message': 'Login successful', 'user_id': user.id})
     return jsonify({'error': 'Invalid credentials'}), 401
 
 @app.route('/logout', methods=['POST'])
 def logout():
     session.pop('user_id', None)
+    session.pop('is_guest', None)
     return jsonify({'message': 'Logged out'})
 
-@app.route('/update_schedule/<int:schedule_id>', methods=['PUT'])
-def update_schedule(schedule_id):
-    data = request.json
-    new_time = data.get('start_time')
-    schedule = Schedule.query.get(schedule_id)
-    if schedule and new_time:
-        schedule.start_time = datetime.fromisoformat(new_time)
-        db.session.commit()
-        return jsonify({'message': 'Schedule updated'})
-    return jsonify({'error': 'Invalid schedule or time'}), 400
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify(dict(metrics.snapshot(), llm_cache=parse_cache.stats(), breakers=llm_client.breaker_states(),
+                        models=router.stats()))
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    # Only take traffic once the configured models are loaded
+    state = llm_client.warmup_state()
+    return jsonify(state), 200 if state['ready'] else 503
 
 @app.route('/')
 def home():
@@ -1697,33 +1170,88 @@ def serve_static_files(filename):
     static_dir = os.path.join(app.root_path, 'static')
     return send_from_directory(static_dir, filename)
 
+def parse_datetime_field(value):
+    # ISO from the form's date pickers, otherwise a natural-language expression
+    try:
+        return TimeRange(datetime.fromisoformat(value))
+    except (TypeError, ValueError):
+        return parse_time(value)
+
 @app.route('/add_schedule', methods=['POST'])
 def add_schedule():
-    data = request.get_json()
-    title = data.get('title')
-    description = data.get('description')
-    start_time = data.get('start_time')
-    end_time = data.get('end_time')
+    try:
+        data = request.get_json()
+        title = data.get('title')
+        description = data.get('description')
+        start_time = data.get('start_time')
+        end_time = data.get('end_time')
+
+        if not title or not start_time:
+            return jsonify({'error': 'Missing title or start time'}), 400
 
-    if not title or not start_time:
-        return jsonify({'error': 'Missing title or start time'}), 400
+        # Accept ISO timestamps or expressions like "tomorrow at 9" / "friday 2-4pm"
+        start = parse_datetime_field(start_time)
+        end = parse_datetime_field(end_time) if end_time else None
+        if start is None or (end_time and end is None):
+            return jsonify({'error': 'Could not understand the start or end time'}), 400
 
-    try:
         new_schedule = Schedule(
             title=title,
             description=description,
-            start_time=datetime.fromisoformat(start_time),
-            end_time=datetime.fromisoformat(end_time) if end_time else None
+            start_time=start.start,
+            end_time=end.start if end else start.end,  # a range like "2-4pm" carries its own end
+            completed=False,
+            user_id=session_user_id(create=True)
         )
+
         db.session.add(new_schedule)
         db.session.commit()
+        invalidate_user_cache(new_schedule.user_id)
         return jsonify({'message': 'Schedule added successfully!'})
+
     except Exception as e:
+        import traceback
         print("Error saving schedule:", e)
+        traceback.print_exc()  # print full error
         return jsonify({'error': 'Could not save schedule'}), 500
 
+@app.route('/add_task', methods=['POST'])
+def add_task():
+    try:
+        data = request.get_json()
+        title = data.get('title')
+        schedule_title = data.get('schedule')
+        due_date = data.get('due_date')
+
+        if not title or not schedule_title:
+            return jsonify({'error': 'Missing task title or schedule'}), 400
+
+        # Convert due date string to datetime if provided
+        due = None
+        if due_date:
+            try:
+                due = datetime.fromisoformat(due_date)
+            except Exception:
+                print("Invalid due date format received:", due_date)
+
+        new_task = Task(
+            description=f"{title} (Schedule: {schedule_title})",
+            due_date=due,
+            completed=False,
+            user_id=session_user_id(create=True)
+        )
+        db.session.add(new_task)
+        db.session.commit()
+        invalidate_user_cache(new_task.user_id)
+        print(f"✅ Task added: {new_task.description}, due: {new_task.due_date}")
+
+        return jsonify({'message': 'Task added successfully!'})
 
+    except Exception as e:
+        import traceback
+        print("Error adding task:", e)
+        traceback.print_exc()
+        return jsonify({'error': 'Could not add task'}), 500
 
 if __name__ == '__main__':
     app.run(debug=True)
->>>>>>> 59bb2c1d88c8d1282a6ea935485986ff7bd3de97
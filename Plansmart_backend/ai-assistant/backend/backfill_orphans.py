@@ -0,0 +1,40 @@
+"""
+Assign tasks, schedules and requests saved without a user to an account
+Rows written before every endpoint was scoped to the session user have no user_id and are
+invisible to everyone now. This hands them to one account (typically the app's only user).
+
+Usage: python backfill_orphans.py USERNAME [--dry-run]
+"""
+import argparse
+
+from app import app
+from models import db, Task, Schedule, Request, User
+import user_state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('username', help='account that receives the orphaned rows')
+    parser.add_argument('--dry-run', action='store_true', help='only count the orphaned rows')
+    args = parser.parse_args()
+
+    with app.app_context():
+        user = User.query.filter_by(username=args.username).first()
+        if user is None:
+            print(f"❌ No user named {args.username!r}")
+            return
+        for model in (Task, Schedule, Request):
+            query = model.query.filter(model.user_id.is_(None))
+            if args.dry_run:
+                print(f"{model.__tablename__}: {query.count()} orphaned rows")
+            else:
+                updated = query.update({model.user_id: user.id}, synchronize_session=False)
+                print(f"✅ {model.__tablename__}: {updated} rows assigned to {user.username}")
+        if not args.dry_run:
+            db.session.commit()
+            # Bulk updates skip the flush hook that keeps the snapshot current
+            user_state.rebuild(user.id)
+
+
+if __name__ == '__main__':
+    main()
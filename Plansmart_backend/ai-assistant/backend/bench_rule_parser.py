@@ -0,0 +1,65 @@
+"""
+Microbenchmark for the rule parser
+Times rule_parser.parse over a corpus of utterances and reports how many of them
+it would handle on its own (confidence at or above FAST_PATH_THRESHOLD).
+
+Usage: python bench_rule_parser.py [--corpus utterances.txt] [--from-db] [--repeat 200]
+"""
+import argparse
+import os
+import time
+from dotenv import load_dotenv
+
+import rule_parser
+
+# Load environment variables
+load_dotenv()
+
+FAST_PATH_THRESHOLD = float(os.getenv('FAST_PATH_THRESHOLD', '0.8'))
+
+
+def load_corpus(path):
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def load_requests():
+    # Real traffic: every input saved by /process_input
+    from app import app
+    from models import Request
+    with app.app_context():
+        return [r.text for r in Request.query.all() if r.text]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--corpus', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utterances.txt'))
+    parser.add_argument('--from-db', action='store_true', help='use saved requests instead of the corpus file')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--verbose', action='store_true', help='print the confidence of every utterance')
+    args = parser.parse_args()
+
+    corpus = load_requests() if args.from_db else load_corpus(args.corpus)
+    if not corpus:
+        print("No utterances to benchmark")
+        return
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        for text in corpus:
+            rule_parser.parse(text)
+    elapsed = time.perf_counter() - started
+    parses = args.repeat * len(corpus)
+
+    results = [(text, rule_parser.parse(text)) for text in corpus]
+    fast = sum(1 for _, result in results if result.confidence >= FAST_PATH_THRESHOLD)
+    if args.verbose:
+        for text, result in results:
+            print(f"{result.confidence:.1f}  {text}")
+
+    print(f"{len(corpus)} utterances x {args.repeat}: {elapsed * 1e6 / parses:.1f} us/parse, {parses / elapsed:,.0f} parses/s")
+    print(f"Resolved without the LLM: {fast}/{len(corpus)} ({fast / len(corpus):.0%}) at threshold {FAST_PATH_THRESHOLD}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Query-plan check for the hot per-user queries
+Runs the routes and helpers on the request path against a scratch database, records every SELECT
+they send, and fails when EXPLAIN QUERY PLAN shows one scanning a whole table or sorting rows in a
+temporary B-tree instead of reading them in index order, or when a list page is not read along the
+index its order comes from. The SQL checked is the SQL the app runs.
+
+Usage: python check_query_plans.py [--db instance/ai_assistant.db] [--verbose]   # default: empty in-memory schema
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+DAY = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+
+# Index each list page must be read along; a newest-first or past-schedules page walks it backwards,
+# which SQLite does without a sort, so a TEMP B-TREE there means the order no longer matches it
+PAGE_INDEXES = {
+    '/get_tasks': 'ix_task_user_created',
+    '/get_tasks?after=': 'ix_task_user_created',
+    '/get_tasks?due_after=&after=': 'ix_task_user_due',
+    '/get_tasks?prefix=': 'ix_task_user_description',
+    '/get_tasks?contains=': 'ix_task_user_created',
+    '/get_schedules': 'ix_schedule_user_start',
+    '/get_schedules?after= (upcoming)': 'ix_schedule_user_start',
+    '/get_schedules?after= (past)': 'ix_schedule_user_start',
+    '/get_schedules?prefix=': 'ix_schedule_user_title',
+}
+
+
+def scenarios(user_id):
+    """(name, action) for every per-user code path; action gets the logged-in test client"""
+    import app as backend
+    import conversation_summary
+    import user_state
+    from conversation_engine import conversation_engine
+
+    def get(path):
+        return lambda client: client.get(path).get_data()
+
+    def in_request(func):
+        def run(client):
+            with backend.app.test_request_context():
+                func()
+        return run
+
+    week = f"due_after={DAY.isoformat()}&due_before={(DAY + timedelta(days=7)).isoformat()}"
+    return [
+        ('/login', lambda client: client.post('/login', json={'username': 'plan-check', 'password': 'plan-check'})),
+        ('/add_task', lambda client: client.post('/add_task', json={
+            'title': 'Gym bag', 'schedule': 'Gym', 'due_date': DAY.isoformat()})),
+        ('/add_schedule', lambda client: client.post('/add_schedule', json={
+            'title': 'Gym', 'start_time': (DAY + timedelta(hours=18)).isoformat()})),
+        ('/add_schedule (past)', lambda client: client.post('/add_schedule', json={
+            'title': 'Gym', 'start_time': (DAY - timedelta(days=1)).isoformat()})),
+        ('/get_tasks', get('/get_tasks')),
+        ('/get_tasks?after=', get('/get_tasks?after=1')),
+        ('/get_tasks?completed=&due_after=&due_before=', get(f'/get_tasks?completed=false&{week}')),
+        ('/get_tasks?due_after=&after=', get(f'/get_tasks?due_after={DAY.isoformat()}&after=1')),
+        ('/get_tasks?prefix=', get('/get_tasks?prefix=Gym')),
+        # Not index-backed: the substring is checked on every row of the user, walked by index
+        ('/get_tasks?contains=', get('/get_tasks?contains=Gym')),
+        ('/get_tasks?stream=true', get('/get_tasks?stream=true&fields=id,description')),
+        ('/get_schedules', get('/get_schedules')),
+        ('/get_schedules?after= (upcoming)', get('/get_schedules?after=1')),
+        ('/get_schedules?after= (past)', get('/get_schedules?after=2')),
+        ('/get_schedules?start_after=&start_before=&after=',
+         get(f'/get_schedules?start_after={DAY.isoformat()}&start_before={(DAY + timedelta(days=7)).isoformat()}&after=1')),
+        ('/get_schedules?prefix=', get('/get_schedules?prefix=Gym')),
+        ('/mark_done', lambda client: client.put('/mark_done/1')),
+        ('/mark_schedule_done', lambda client: client.put('/mark_schedule_done/1')),
+        ('/update_schedule', lambda client: client.put('/update_schedule/1', json={'title': 'Gym'})),
+        ('process_input: save actions and update schedule by title', in_request(lambda: backend.persist_parsed({
+            'tasks': ['Pack gym bag'],
+            'update_schedules': [{'title': 'Gym', 'new_start_time': (DAY + timedelta(hours=19)).isoformat()}]},
+            user_id))),
+        ('prompt context', in_request(lambda: backend.load_prompt_context(user_id, 'gym tonight'))),
+        ('conversation summary check', lambda client: conversation_summary.maybe_summarize(backend.app, user_id)),
+        ('conversation summary fold', lambda client: conversation_summary._oldest_turns_after(
+            user_id, 0, conversation_summary.SUMMARY_BATCH_TURNS)),
+        ('user state rebuild', lambda client: user_state.rebuild(user_id)),
+        ('conversation engine user state', lambda client: conversation_engine.get_user_state(user_id)),
+        ('/get_conversation_history', get('/get_conversation_history')),
+        ('/get_conversation_history?before=', get('/get_conversation_history?before=3')),
+        ('/export_conversation_history', get('/export_conversation_history')),
+    ]
+
+
+def seed():
+    """A user with a few turns of conversation; the scenarios add their tasks and schedules"""
+    from models import db, Request, Response, User
+    user = User.query.filter_by(username='plan-check').first()
+    if user is None:
+        user = User(username='plan-check')
+        user.set_password('plan-check')
+        db.session.add(user)
+        db.session.flush()
+    for i in range(3):
+        req = Request(text=f'turn {i}', user_id=user.id)
+        db.session.add(req)
+        db.session.flush()
+        db.session.add(Response(text=f'reply {i}', request_id=req.id))
+    db.session.commit()
+    return user.id
+
+
+def problems(conn, sql, parameters):
+    """Plan lines of one statement, and the ones showing a full scan or a sort"""
+    plan = [row[3] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}', tuple(parameters or ()))]
+    found = [line for line in plan
+             if (line.startswith('SCAN') and 'USING' not in line) or 'TEMP B-TREE' in line]
+    return plan, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--db', help='SQLite file whose schema to check (a scratch copy is used, after upgrade_schema); '
+                                     'default is a fresh schema in memory')
+    parser.add_argument('--verbose', action='store_true', help='print every statement and plan')
+    args = parser.parse_args()
+
+    # The app must be imported after the database is chosen; the real file is never written to
+    scratch = None
+    if args.db:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False).name
+        shutil.copy(args.db, scratch)
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch}'
+    else:
+        os.environ['DATABASE_URL'] = 'sqlite://'
+    from sqlalchemy import event
+    from app import app
+    from models import db
+
+    app.config['TESTING'] = True
+    failed = 0
+    try:
+        with app.app_context():
+            user_id = seed()
+            captured = []
+            event.listen(db.engine, 'before_cursor_execute',
+                         lambda conn, cursor, sql, parameters, context, many:
+                         captured.append((sql, parameters)) if sql.lstrip().upper().startswith('SELECT') else None)
+            client = app.test_client()
+            for name, action in scenarios(user_id):
+                captured.clear()
+                action(client)
+                statements = list(dict.fromkeys((sql, tuple(parameters or ())) for sql, parameters in captured))
+                with db.engine.connect() as conn:
+                    results = [(sql, *problems(conn, sql, parameters)) for sql, parameters in statements]
+                bad = [result for result in results if result[2]]
+                index = PAGE_INDEXES.get(name)
+                if index and not any(index in line for _, plan, _ in results for line in plan):
+                    bad.append(('(every statement)', [], [f'no statement read along {index}']))
+                failed += bool(bad)
+                print(f"{'FAIL' if bad else 'ok':4}  {name} ({len(statements)} queries)")
+                for sql, plan, found in results if args.verbose else bad:
+                    print(f"        {' '.join(sql.split())}")
+                    for line in plan if args.verbose else found:
+                        print(f"            {line}")
+    finally:
+        if scratch:
+            os.unlink(scratch)
+    print(f"{failed} code paths with a query that has no usable index")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
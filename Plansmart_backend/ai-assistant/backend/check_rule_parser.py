@@ -0,0 +1,74 @@
+"""
+Check the rule parser on clock times it must not misread
+Parses inputs with out-of-range or half-typed clock times ("25:00", "12:5") and fails if any of them
+is saved with part of the time left in the title or is confident enough to skip the model.
+
+Usage: python check_rule_parser.py
+"""
+import argparse
+import re
+import sys
+from datetime import datetime
+
+import rule_parser
+from bench_rule_parser import FAST_PATH_THRESHOLD
+
+NOW = datetime(2024, 5, 6, 9, 0)  # a Monday morning
+CLOCK_IN_TITLE = re.compile(r'\d:\d*$')
+
+# Inputs whose time cannot be read: nothing may be saved from them without the model
+UNREADABLE = [
+    'schedule gym at 24:00',
+    'schedule gym at 25:00',
+    'schedule gym at 99:99',
+    'schedule lunch at 12:5',
+    'schedule lunch at 12:',
+    'schedule gym at 13pm',
+    'schedule gym 25:00',
+    'remind me to stretch at 25:00',
+    'move gym to 24:30',
+]
+
+# Inputs at the edges of the range, with the start time they must get
+READABLE = [
+    ('schedule gym at 23:59', 'gym', datetime(2024, 5, 6, 23, 59)),
+    ('schedule gym at 0:00 tomorrow', 'gym', datetime(2024, 5, 7, 0, 0)),
+    ('schedule lunch at 12:50', 'lunch', datetime(2024, 5, 6, 12, 50)),
+    ('schedule dentist at 12am friday', 'dentist', datetime(2024, 5, 10, 0, 0)),
+]
+
+
+def _titles(result):
+    return ([s.title for s in result.schedules] + [r.description for r in result.reminders]
+            + [u.title for u in result.update_schedules])
+
+
+def checks():
+    """(name, passed) for each input"""
+    results = []
+    for text in UNREADABLE:
+        result = rule_parser.parse(text, NOW)
+        leftover = [title for title in _titles(result) if CLOCK_IN_TITLE.search(title)]
+        results.append((f'{text!r} is not saved with a clock in its title', not leftover))
+        results.append((f'{text!r} is left to the model', result.confidence < FAST_PATH_THRESHOLD))
+    for text, title, start in READABLE:
+        result = rule_parser.parse(text, NOW)
+        got = [(s.title, s.start_time) for s in result.schedules]
+        results.append((f'{text!r} is {title!r} at {start:%a %H:%M}', got == [(title, start)]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.parse_args()
+
+    failed = 0
+    for name, passed in checks():
+        failed += not passed
+        print(f"{'ok' if passed else 'FAIL':4}  {name}")
+    print(f"{failed} clock checks failed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
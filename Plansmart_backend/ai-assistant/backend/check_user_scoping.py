@@ -0,0 +1,99 @@
+"""
+Check that requests without a session user cannot see or change anyone's rows
+Seeds an in-memory database with rows of two users and legacy rows without a user, then calls
+every task and schedule endpoint anonymously and fails if any of them is read or changed. The
+conversation engine's user state is checked too: empty without a user, and only the user's own
+rows with one.
+
+Usage: python check_user_scoping.py
+"""
+import argparse
+import os
+import sys
+
+# Never touch the real database; must be set before the app is imported
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+from app import app  # noqa: E402
+from conversation_engine import conversation_engine  # noqa: E402
+from models import db, Task, Schedule, User  # noqa: E402
+
+
+def seed():
+    users = []
+    for name in ('owner', 'other'):
+        user = User(username=name)
+        user.set_password(name)
+        db.session.add(user)
+        db.session.flush()
+        users.append(user.id)
+    rows = {}
+    for label, user_id in (('owned', users[0]), ('other', users[1]), ('orphan', None)):
+        task = Task(description=f'{label} task', completed=False, user_id=user_id)
+        schedule = Schedule(title=f'{label} schedule', start_time=db.func.now(), completed=False, user_id=user_id)
+        db.session.add_all([task, schedule])
+        db.session.flush()
+        rows[label] = (task.id, schedule.id)
+    # The other user has one more task, so counting both users' rows shows up in the totals
+    db.session.add(Task(description='other task 2', completed=False, user_id=users[1]))
+    db.session.commit()
+    return users, rows
+
+
+def state_checks(users):
+    """(name, passed) for the conversation engine's user state"""
+    owner, other = users
+    with app.app_context():
+        anonymous = conversation_engine.get_user_state(None)
+        owner_state = conversation_engine.get_user_state(owner)
+        other_state = conversation_engine.get_user_state(other)
+    return [
+        ('user state without a user is empty',
+         anonymous.get('total_tasks') == 0 and anonymous.get('total_schedules') == 0
+         and anonymous.get('incomplete_task_list') == [] and anonymous.get('today_schedule_list') == []),
+        ("user state counts only the user's tasks",
+         owner_state.get('total_tasks') == 1 and other_state.get('total_tasks') == 2),
+        ("user state lists only the user's tasks",
+         owner_state.get('incomplete_task_list') == ['owned task']
+         and sorted(other_state.get('incomplete_task_list', [])) == ['other task', 'other task 2']),
+        ("user state counts only the user's schedules",
+         owner_state.get('total_schedules') == 1 and other_state.get('total_schedules') == 1),
+    ]
+
+
+def checks(client, rows):
+    """(name, passed) for each anonymous request"""
+    results = []
+    for path in ('/get_tasks', '/get_schedules', '/get_tasks?stream=true', '/get_schedules?stream=true'):
+        response = client.get(path)
+        results.append((f'GET {path} returns nothing', response.status_code == 200 and response.get_json() == []))
+    for label, (task_id, schedule_id) in rows.items():
+        for method, path in (('put', f'/mark_done/{task_id}'),
+                             ('put', f'/mark_schedule_done/{schedule_id}'),
+                             ('put', f'/update_schedule/{schedule_id}')):
+            response = getattr(client, method)(path, json={'title': 'changed'})
+            results.append((f'{method.upper()} {path} ({label}) is refused', response.status_code in (401, 403, 404)))
+    with app.app_context():
+        changed = Task.query.filter_by(completed=True).count() + Schedule.query.filter(
+            (Schedule.completed == True) | (Schedule.title == 'changed')).count()  # noqa: E712
+    results.append(('no row was changed', changed == 0))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.parse_args()
+
+    app.config['TESTING'] = True
+    with app.app_context():
+        users, rows = seed()
+    failed = 0
+    for name, passed in checks(app.test_client(), rows) + state_checks(users):
+        failed += not passed
+        print(f"{'ok' if passed else 'FAIL':4}  {name}")
+    print(f"{failed} scoping checks failed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
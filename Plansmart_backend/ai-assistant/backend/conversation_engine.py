@@ -2,16 +2,40 @@
 Conversation engine for AI-powered suggestions and responses
 Supports both rule-based and LLM-powered responses
 """
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
-from models import Task, Schedule, db
+from models import Task, Schedule, Request, Response, db
+from sqlalchemy import and_, or_
+from llm_client import CircuitBreaker
+from keyword_matcher import KeywordMatcher
+import intent_classifier
+import user_state
 import re
 import json
 import os
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Intent -> trigger phrases; extend the JSON file to grow the catalog
+INTENTS_FILE = os.getenv('INTENTS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intents.json'))
+intent_matcher = KeywordMatcher.from_file(INTENTS_FILE)
+# Intents the rule-based replies handle as well as the LLM would
+RULE_ANSWERABLE_INTENTS = {'greeting', 'create_schedule', 'add_task', 'view_tasks', 'view_schedules'}
+# What get_user_state reports when no user is signed in
+EMPTY_USER_STATE = {
+    'total_tasks': 0, 'incomplete_tasks': 0, 'completed_tasks': 0, 'total_schedules': 0, 'today_schedules': 0,
+    'has_tasks': False, 'has_schedules': False, 'incomplete_task_list': [], 'today_schedule_list': [],
+}
+
+# In-memory history: the last N turns for each of the M most recently active users
+CONVERSATION_MEMORY_TURNS = int(os.getenv('CONVERSATION_MEMORY_TURNS', '20'))
+CONVERSATION_MEMORY_USERS = int(os.getenv('CONVERSATION_MEMORY_USERS', '1000'))
+# Save turns that drop out of memory as Request/Response rows instead of losing them
+CONVERSATION_SPILL = os.getenv('CONVERSATION_SPILL', 'false').lower() == 'true'
+
 # Try to import OpenAI
 try:
     from openai import OpenAI
@@ -24,7 +48,10 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 USE_LLM = OPENAI_AVAILABLE and OPENAI_API_KEY
 
 if USE_LLM:
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '15'))
+    # Retries would multiply the deadline; the breaker and rule-based fallback handle failures
+    client = OpenAI(api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT, max_retries=0)
+    openai_breaker = CircuitBreaker('openai', probe=lambda: client.models.list())
     OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
     OPENAI_MAX_TOKENS = int(os.getenv('OPENAI_MAX_TOKENS', '500'))
     OPENAI_TEMPERATURE = float(os.getenv('OPENAI_TEMPERATURE', '0.7'))
@@ -40,30 +67,87 @@ else:
 class ConversationEngine:
     """Handles AI conversation logic and suggestions"""
     
-    def __init__(self):
-        self.conversation_history = []
+    def __init__(self, max_turns=CONVERSATION_MEMORY_TURNS, max_users=CONVERSATION_MEMORY_USERS,
+                 spill=CONVERSATION_SPILL):
+        self.max_turns = max_turns
+        self.max_users = max_users
+        self.spill = spill
+        # user_id -> ring buffer of turns, least recently active user first
+        self._histories = OrderedDict()
+        # The engine is shared by every request thread
+        self._history_lock = threading.Lock()
         self.user_context = {}
+
+    def remember(self, user_id, turn):
+        """Add a turn to the user's ring buffer; turns pushed out are spilled if enabled"""
+        dropped = []
+        with self._history_lock:
+            history = self._histories.get(user_id)
+            if history is None:
+                history = self._histories[user_id] = deque(maxlen=self.max_turns)
+            else:
+                self._histories.move_to_end(user_id)
+            if len(history) == history.maxlen:
+                dropped.append((user_id, history[0]))
+            history.append(turn)
+            while len(self._histories) > self.max_users:
+                evicted_id, evicted = self._histories.popitem(last=False)
+                dropped.extend((evicted_id, t) for t in evicted)
+        if self.spill and dropped:
+            self._spill(dropped)
+
+    def history(self, user_id=None):
+        """The user's turns still in memory, oldest first"""
+        with self._history_lock:
+            return list(self._histories.get(user_id, ()))
+
+    def _spill(self, turns):
+        # Database work happens outside the lock so other threads are never held up by it
+        try:
+            for user_id, turn in turns:
+                req = Request(text=turn['user'][:500], user_id=user_id, route='engine',
+                              created_at=datetime.fromisoformat(turn['timestamp']))
+                db.session.add(req)
+                db.session.flush()
+                db.session.add(Response(text=turn['ai'], request_id=req.id))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️  Could not save conversation turns: {e}")
     
     def get_user_state(self, user_id=None):
         """Get user's current state: tasks, schedules, patterns"""
+        if user_id is None:
+            # Without a signed-in user there are no rows to describe; never count everyone's
+            return dict(EMPTY_USER_STATE, incomplete_task_list=[], today_schedule_list=[])
         try:
-            tasks = Task.query.filter_by(user_id=user_id).all() if user_id else Task.query.all()
-            schedules = Schedule.query.filter_by(user_id=user_id).all() if user_id else Schedule.query.all()
-            
-            incomplete_tasks = [t for t in tasks if not t.completed]
-            completed_tasks = [t for t in tasks if t.completed]
-            today_schedules = [s for s in schedules if s.start_time.date() == datetime.today().date()]
-            
+            # Counts come from the user's snapshot row and only the preview rows are loaded
+            snapshot = user_state.get_snapshot(user_id)
+            completed_tasks = snapshot.completed_tasks
+            total_tasks = snapshot.incomplete_tasks + completed_tasks
+            total_schedules, today_schedules = snapshot.total_schedules, snapshot.today_schedules
+            today = datetime.combine(datetime.today().date(), datetime.min.time())
+            is_today = and_(Schedule.start_time >= today, Schedule.start_time < today + timedelta(days=1))
+            incomplete = or_(Task.completed == False, Task.completed.is_(None))  # noqa: E712
+
+            incomplete_task_list = [row.description for row in db.session.query(Task.description)
+                                    .filter(incomplete, Task.user_id == user_id)
+                                    .order_by(Task.created_at, Task.id).limit(5)]
+            today_schedule_list = [row.title for row in db.session.query(Schedule.title)
+                                   .filter(is_today, Schedule.user_id == user_id)
+                                   .order_by(Schedule.start_time).limit(5)]
+            incomplete_tasks = total_tasks - completed_tasks
+
             return {
-                'total_tasks': len(tasks),
-                'incomplete_tasks': len(incomplete_tasks),
-                'completed_tasks': len(completed_tasks),
-                'total_schedules': len(schedules),
-                'today_schedules': len(today_schedules),
-                'has_tasks': len(incomplete_tasks) > 0,
-                'has_schedules': len(schedules) > 0,
-                'incomplete_task_list': [t.description for t in incomplete_tasks[:5]],
-                'today_schedule_list': [s.title for s in today_schedules],
+                'total_tasks': total_tasks,
+                'incomplete_tasks': incomplete_tasks,
+                'completed_tasks': completed_tasks,
+                'total_schedules': total_schedules,
+                'today_schedules': today_schedules,
+                'has_tasks': incomplete_tasks > 0,
+                'has_schedules': total_schedules > 0,
+                'incomplete_task_list': incomplete_task_list,
+                'today_schedule_list': today_schedule_list,
             }
         except Exception as e:
             print(f"Error getting user state: {e}")
@@ -71,43 +155,32 @@ class ConversationEngine:
     
     def detect_intent(self, text):
         """Detect user's intent from text"""
-        text_lower = text.lower()
-        
-        intents = {
-            'create_schedule': ['create schedule', 'new schedule', 'schedule', 'add schedule', 'make schedule'],
-            'add_task': ['create task', 'add task', 'new task', 'add to do', 'add activity'],
-            'view_tasks': ['show tasks', 'my tasks', 'list tasks', 'what tasks', 'view tasks'],
-            'view_schedules': ['show schedules', 'my schedules', 'view schedules', 'list schedules', 'what schedules'],
-            'help': ['help', 'what can you do', 'commands', 'suggest', 'advice'],
-            'greeting': ['hi', 'hello', 'hey', 'good morning', 'good evening'],
-            'mark_done': ['mark done', 'complete task', 'finished', 'done with'],
-        }
-        
-        detected = []
-        for intent, keywords in intents.items():
-            if any(keyword in text_lower for keyword in keywords):
-                detected.append(intent)
-        
+        # One scan over the text finds every intent phrase, on word boundaries only
+        detected = intent_matcher.match(text)
         return detected if detected else ['general_query']
     
     def generate_response(self, user_input, user_id=None):
         """Generate AI response with suggestions"""
         user_state = self.get_user_state(user_id)
         intents = self.detect_intent(user_input)
+        predicted = intent_classifier.confident_intent(user_input)
+        if predicted and intents == ['general_query']:
+            intents = [predicted]
         
-        # Use LLM if available, otherwise use rule-based
-        if USE_LLM:
+        # Use LLM if available and healthy, otherwise use rule-based
+        use_llm = USE_LLM and not openai_breaker.is_open and predicted not in RULE_ANSWERABLE_INTENTS
+        if use_llm:
             response = self._generate_llm_response(user_input, user_state, intents)
         else:
             response = self._generate_rule_based_response(user_input, user_state, intents)
         
         # Store in history
-        self.conversation_history.append({
+        self.remember(user_id, {
             'user': user_input,
             'ai': response,
             'timestamp': datetime.now().isoformat(),
             'intents': intents,
-            'mode': 'LLM' if USE_LLM else 'Rule-based'
+            'mode': 'LLM' if use_llm else 'Rule-based'
         })
         
         return response
@@ -137,7 +210,8 @@ Guidelines:
 """
             
             # Call OpenAI API
-            completion = client.chat.completions.create(
+            completion = openai_breaker.call(
+                client.chat.completions.create,
                 model=OPENAI_MODEL,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -277,9 +351,9 @@ def get_ai_response(user_input, user_id=None):
     return conversation_engine.generate_response(user_input, user_id)
 
 
-def get_conversation_history():
+def get_conversation_history(user_id=None):
     """Get conversation history"""
-    return conversation_engine.conversation_history
+    return conversation_engine.history(user_id)
 
 
 def is_llm_enabled():
@@ -0,0 +1,172 @@
+"""
+Rolling per-user conversation summaries
+Once a user has SUMMARY_EVERY_TURNS turns beyond the last SUMMARY_KEEP_TURNS, a background job
+folds them into the user's ConversationSummary row. The parse prompt carries that summary plus
+the turns after it, trimmed to PROMPT_HISTORY_TOKEN_BUDGET, so its size stays the same however
+long the user has been talking.
+"""
+import os
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+
+import llm_client
+import metrics
+from model_router import router
+from models import db, ConversationSummary, Request, Response
+from scheduler import run_soon
+
+# Load environment variables
+load_dotenv()
+
+# Latest turns that always stay verbatim in the prompt
+SUMMARY_KEEP_TURNS = int(os.getenv('SUMMARY_KEEP_TURNS', '4'))
+# Older turns are summarized in batches of this many
+SUMMARY_EVERY_TURNS = int(os.getenv('SUMMARY_EVERY_TURNS', '6'))
+# Most turns folded into the summary by one model call; a longer backlog takes several
+SUMMARY_BATCH_TURNS = int(os.getenv('SUMMARY_BATCH_TURNS', str(4 * SUMMARY_EVERY_TURNS)))
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '200'))
+# Summary plus verbatim turns never take more than this many prompt tokens
+PROMPT_HISTORY_TOKEN_BUDGET = int(os.getenv('PROMPT_HISTORY_TOKEN_BUDGET', '1000'))
+
+SUMMARY_PROMPT = """You maintain a short running summary of a conversation between a user and their personal assistant app.
+Merge the new turns into the current summary. Keep facts that matter later: the user's goals, preferences,
+people, places, dates, and tasks or events they mentioned. Drop greetings and small talk.
+Reply with the updated summary only, in at most {words} words."""
+
+
+def estimate_tokens(text):
+    # About four characters per token for English text; close enough for budgeting
+    return len(text or '') // 4 + 1
+
+
+def _truncate(text, max_tokens):
+    """The end of text that fits in max_tokens; the newest facts are at the end"""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    cut = text[-max_chars:]
+    return cut[cut.find(' ') + 1:] if ' ' in cut else cut
+
+
+def turns_query(user_id):
+    """The user's requests with the text of their latest reply, newest first, as one query"""
+    latest = (select(func.max(Response.id)).where(Response.request_id == Request.id)
+              .correlate(Request).scalar_subquery())
+    return (db.session.query(Request, Response.text)
+            .outerjoin(Response, Response.id == latest)
+            .filter(Request.user_id == user_id)
+            .order_by(Request.created_at.desc(), Request.id.desc()))
+
+
+def _turns_after(user_id, request_id, limit):
+    """Up to limit newest (request, reply) pairs after request_id, oldest first"""
+    rows = turns_query(user_id).filter(Request.id > request_id).limit(limit).all()
+    return [(req, reply if reply is not None else "No response") for req, reply in reversed(rows)]
+
+
+def _oldest_turns_after(user_id, request_id, limit):
+    """Up to limit oldest (request, reply) pairs after request_id, oldest first"""
+    rows = (turns_query(user_id).order_by(None).order_by(Request.created_at, Request.id)
+            .filter(Request.id > request_id).limit(limit).all())
+    return [(req, reply if reply is not None else "No response") for req, reply in rows]
+
+
+def prompt_history(user_id):
+    """Chat messages for the parse prompt: the summary, then the verbatim turns since it"""
+    summary = db.session.get(ConversationSummary, user_id)
+    through = summary.through_request_id if summary else 0
+    # Between summaries there are at most KEEP + EVERY turns, plus the request being parsed
+    turns = _turns_after(user_id, through, SUMMARY_KEEP_TURNS + SUMMARY_EVERY_TURNS + 1)[:-1]
+
+    history = []
+    budget = PROMPT_HISTORY_TOKEN_BUDGET
+    if summary and summary.text:
+        content = f"Summary of the earlier conversation:\n{summary.text}"
+        history.append({"role": "system", "content": content})
+        budget -= estimate_tokens(content)
+
+    # Newest turns win when the budget runs out
+    kept = []
+    for req, reply in reversed(turns):
+        cost = estimate_tokens(req.text) + estimate_tokens(reply)
+        if cost > budget:
+            break
+        budget -= cost
+        kept.append((req, reply))
+    for req, reply in reversed(kept):
+        history.append({"role": "user", "content": req.text})
+        history.append({"role": "assistant", "content": reply})
+    metrics.observe('prompt.history_tokens', PROMPT_HISTORY_TOKEN_BUDGET - budget)
+    return history
+
+
+def maybe_summarize(app, user_id):
+    """Queue a background summary once enough turns have piled up past the summary"""
+    if not user_id:
+        return
+    summary = db.session.get(ConversationSummary, user_id)
+    through = summary.through_request_id if summary else 0
+    pending = Request.query.filter(Request.user_id == user_id, Request.id > through).count()
+    if pending >= SUMMARY_KEEP_TURNS + SUMMARY_EVERY_TURNS:
+        run_soon(_summarize_job, f'summarize_{user_id}', app, user_id)
+
+
+def _summarize_job(app, user_id):
+    with app.app_context():
+        try:
+            summarize(user_id)
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️  Could not summarize conversation for user {user_id}: {e}")
+
+
+def summarize(user_id):
+    """Fold every turn but the last SUMMARY_KEEP_TURNS into the user's summary, oldest first"""
+    summary = db.session.get(ConversationSummary, user_id)
+    if summary is None:
+        summary = ConversationSummary(user_id=user_id, text='', through_request_id=0, turns=0)
+        db.session.add(summary)
+    pending = Request.query.filter(Request.user_id == user_id, Request.id > summary.through_request_id).count()
+    remaining = pending - SUMMARY_KEEP_TURNS
+    while remaining > 0:
+        # Each batch is committed on its own, so the summary only ever moves past turns it holds
+        folded = _oldest_turns_after(user_id, summary.through_request_id, min(remaining, SUMMARY_BATCH_TURNS))
+        if not folded:
+            break
+        text = _model_summary(summary.text, folded)
+        if text is None:
+            metrics.incr('summary.fallback')
+            text = _extractive_summary(summary.text, folded)
+        summary.text = _truncate(text, SUMMARY_MAX_TOKENS)
+        summary.through_request_id = folded[-1][0].id
+        summary.turns += len(folded)
+        db.session.commit()
+        metrics.incr('summary.updates')
+        remaining -= len(folded)
+    return summary
+
+
+def _model_summary(previous, turns):
+    # The smallest configured model is plenty for summarizing
+    if llm_client.ollama_pool.is_open:
+        return None
+    transcript = "\n".join(f"User: {req.text}\nAssistant: {reply}" for req, reply in turns)
+    try:
+        response = llm_client.chat(
+            model=router.models[0],
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT.format(words=SUMMARY_MAX_TOKENS * 3 // 4)},
+                {"role": "user", "content": f"Current summary:\n{previous or '(none)'}\n\nNew turns:\n{transcript}"},
+            ],
+            options={'temperature': 0.2, 'num_predict': SUMMARY_MAX_TOKENS},
+        )
+        return response['message']['content'].strip() or None
+    except Exception as e:
+        print(f"⚠️  Summary model call failed: {e}")
+        return None
+
+
+def _extractive_summary(previous, turns):
+    # Without a model, keep what the user asked for; _truncate keeps the newest part
+    asked = "; ".join(req.text for req, _ in turns)
+    return f"{previous}\nUser asked: {asked}".strip()
@@ -0,0 +1,362 @@
+"""
+Lightweight on-CPU intent classifier
+Texts are turned into hashed word-unigram, word-bigram and character-trigram features and
+scored by a linear softmax model. A whole batch is scored with one gather + segment-sum over
+the weight matrix. Probabilities are calibrated with a temperature fitted on k-fold held-out
+predictions, and the same predictions set how sure the model must be before a conversational
+input may skip the structured parse.
+
+Usage:
+  python intent_classifier.py train [--data intent_examples.jsonl] [--from-db] [--out intent_model.npz]
+  python intent_classifier.py bench [--model intent_model.npz] [--n 20000]
+  python intent_classifier.py predict "what's on my calendar tomorrow"
+"""
+import argparse
+import json
+import os
+import re
+import time
+import zlib
+from dotenv import load_dotenv
+
+import metrics
+
+# NumPy is optional: without it (or without a trained model) routing falls back to keywords and rules
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Load environment variables
+load_dotenv()
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+INTENT_MODEL_PATH = os.getenv('INTENT_MODEL_PATH', os.path.join(_HERE, 'intent_model.npz'))
+INTENT_FEATURE_DIM = int(os.getenv('INTENT_FEATURE_DIM', str(2 ** 14)))
+# Predictions below this probability never change routing
+INTENT_ROUTE_THRESHOLD = float(os.getenv('INTENT_ROUTE_THRESHOLD', '0.8'))
+# Intents whose inputs carry no actions; only these may skip the structured parse
+CONVERSATIONAL_INTENTS = {'greeting', 'help', 'general_query'}
+# Lowest probability at which a conversational prediction skips the parse. Training raises it
+# per model to above every held-out action request the model took for conversation.
+INTENT_SKIP_THRESHOLD = float(os.getenv('INTENT_SKIP_THRESHOLD', '0.9'))
+
+_TOKEN = re.compile(r"[a-z0-9']+")
+
+
+def featurize(text, dim):
+    """Hashed feature indices for text; always includes a constant feature so no row is empty"""
+    words = _TOKEN.findall((text or '').lower())
+    grams = ['<s>'] + ['w:' + w for w in words] + [f'b:{a} {b}' for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f'<{word}>'
+        grams += ['c:' + padded[i:i + 3] for i in range(len(padded) - 2)]
+    return [zlib.crc32(gram.encode('utf-8')) % dim for gram in grams]
+
+
+def _batch_features(texts, dim):
+    """Flat feature indices, their values and the offset where each text's features start"""
+    rows = [featurize(text, dim) for text in texts]
+    counts = np.fromiter((len(row) for row in rows), dtype=np.int64, count=len(rows))
+    indices = np.fromiter((i for row in rows for i in row), dtype=np.int64, count=int(counts.sum()))
+    # Each text's feature vector has unit length
+    values = np.repeat(1.0 / np.sqrt(counts), counts).astype(np.float32)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return indices, values, starts, counts
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class IntentClassifier:
+    """Linear softmax model over hashed n-gram features"""
+
+    def __init__(self, weights, bias, labels, temperature=1.0, skip_threshold=float('inf')):
+        self.weights = weights
+        self.bias = bias
+        self.labels = list(labels)
+        self.temperature = float(temperature)
+        # Models saved before skip thresholds were fitted never skip the parse
+        self.skip_threshold = float(skip_threshold)
+        self.dim = weights.shape[0]
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        skip_threshold = float(data['skip_threshold']) if 'skip_threshold' in data.files else float('inf')
+        return cls(data['weights'], data['bias'], [str(label) for label in data['labels']], float(data['temperature']),
+                   skip_threshold)
+
+    def save(self, path):
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, labels=np.array(self.labels),
+                            temperature=np.array(self.temperature), skip_threshold=np.array(self.skip_threshold))
+
+    def logits(self, texts):
+        indices, values, starts, _ = _batch_features(texts, self.dim)
+        # Sparse-times-dense in one shot: gather the weight rows of every feature, sum per text
+        return np.add.reduceat(self.weights[indices] * values[:, None], starts, axis=0) + self.bias
+
+    def predict_proba(self, texts):
+        """(n_texts, n_labels) calibrated probabilities"""
+        return _softmax(self.logits(texts) / self.temperature)
+
+    def classify(self, text):
+        """(label, probability) of the most likely intent"""
+        probs = self.predict_proba([text])[0]
+        best = int(probs.argmax())
+        return self.labels[best], float(probs[best])
+
+
+def fit(texts, labels, dim=INTENT_FEATURE_DIM, epochs=300, learning_rate=2.0, l2=1e-4):
+    """Train the softmax model with full-batch gradient descent"""
+    label_names = sorted(set(labels))
+    targets = np.zeros((len(texts), len(label_names)), dtype=np.float32)
+    targets[np.arange(len(texts)), [label_names.index(label) for label in labels]] = 1.0
+    indices, values, starts, counts = _batch_features(texts, dim)
+    rows = np.repeat(np.arange(len(texts)), counts)
+
+    weights = np.zeros((dim, len(label_names)), dtype=np.float32)
+    bias = np.zeros(len(label_names), dtype=np.float32)
+    for _ in range(epochs):
+        logits = np.add.reduceat(weights[indices] * values[:, None], starts, axis=0) + bias
+        error = (_softmax(logits) - targets) / len(texts)
+        grad = np.zeros_like(weights)
+        np.add.at(grad, indices, values[:, None] * error[rows])
+        weights -= learning_rate * (grad + l2 * weights)
+        bias -= learning_rate * error.sum(axis=0)
+    return IntentClassifier(weights, bias, label_names)
+
+
+def out_of_fold_logits(texts, labels, label_names, folds, dim=INTENT_FEATURE_DIM, epochs=300):
+    """Logits for every text from a model trained on the other folds, so each one is held out once"""
+    rng = np.random.default_rng(0)
+    # Stratified: shuffle, group by label, then deal the examples round-robin into the folds
+    order = sorted(rng.permutation(len(texts)), key=lambda i: labels[i])
+    logits = np.zeros((len(texts), len(label_names)), dtype=np.float32)
+    for fold in range(folds):
+        held = order[fold::folds]
+        held_set = set(held)
+        train = [i for i in order if i not in held_set]
+        model = fit([texts[i] for i in train], [labels[i] for i in train], dim, epochs)
+        # A label missing from this fold's training data gets no probability
+        fold_logits = np.full((len(held), len(label_names)), -1e4, dtype=np.float32)
+        fold_logits[:, [label_names.index(label) for label in model.labels]] = model.logits([texts[i] for i in held])
+        logits[held] = fold_logits
+    return logits
+
+
+def calibrate(logits, target):
+    """Pick the softmax temperature that minimizes log loss on held-out logits"""
+    best_temperature, best_loss = 1.0, float('inf')
+    for temperature in np.linspace(0.25, 5.0, 39):
+        probs = _softmax(logits / temperature)
+        loss = -np.log(probs[np.arange(len(target)), target] + 1e-12).mean()
+        if loss < best_loss:
+            best_temperature, best_loss = float(temperature), loss
+    return best_temperature, best_loss
+
+
+def reliability(probs, target, bins=10):
+    """Per confidence bin (low, high, count, mean confidence, accuracy), and the expected calibration error"""
+    confidence = probs.max(axis=1)
+    correct = probs.argmax(axis=1) == target
+    rows, ece = [], 0.0
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    for low, high in zip(edges[:-1], edges[1:]):
+        in_bin = (confidence > low) & (confidence <= high)
+        if not in_bin.any():
+            continue
+        mean_confidence, accuracy = float(confidence[in_bin].mean()), float(correct[in_bin].mean())
+        rows.append((low, high, int(in_bin.sum()), mean_confidence, accuracy))
+        ece += in_bin.mean() * abs(accuracy - mean_confidence)
+    return rows, float(ece)
+
+
+def skip_threshold(probs, target, label_names, floor=INTENT_SKIP_THRESHOLD):
+    """Lowest probability at which no held-out action request would have skipped the parse"""
+    conversational = np.array([label in CONVERSATIONAL_INTENTS for label in label_names])
+    predicted = probs.argmax(axis=1)
+    # Inputs with actions that the model took for conversation, and how sure it was
+    misses = probs.max(axis=1)[conversational[predicted] & ~conversational[target]]
+    if not len(misses):
+        return floor
+    # Strictly above the worst miss; above 1.0 means this model never skips the parse
+    return max(floor, float(np.nextafter(misses.max(), np.inf)))
+
+
+def load_examples(path):
+    with open(path, encoding='utf-8') as f:
+        examples = [json.loads(line) for line in f if line.strip()]
+    return [(e['text'], e['intent']) for e in examples]
+
+
+def weak_label(text):
+    """Label a logged request from a confident rule parse or an unambiguous keyword match, else None"""
+    import rule_parser
+    from conversation_engine import intent_matcher
+    parsed = rule_parser.parse(text)
+    if parsed.confidence >= 0.8:
+        if parsed.schedules or parsed.update_schedules:
+            return 'create_schedule'
+        if parsed.tasks or parsed.reminders:
+            return 'add_task'
+        if parsed.query:
+            return 'view_tasks'
+    intents = intent_matcher.match(text)
+    return intents[0] if len(intents) == 1 else None
+
+
+def load_logged_requests():
+    from app import app
+    from models import Request
+    with app.app_context():
+        texts = [r.text for r in Request.query.all() if r.text]
+    return [(text, label) for text, label in ((t, weak_label(t)) for t in texts) if label]
+
+
+def train_command(args):
+    examples = load_examples(args.data) if args.data else []
+    if args.from_db:
+        examples += load_logged_requests()
+    if not examples:
+        print("No training examples")
+        return
+
+    texts, labels = [t for t, _ in examples], [l for _, l in examples]
+    label_names = sorted(set(labels))
+    target = np.array([label_names.index(label) for label in labels])
+    # Every example is held out once; folds are capped by the rarest intent so each fold has all of them
+    folds = max(2, min(args.folds, min(labels.count(label) for label in label_names)))
+    logits = out_of_fold_logits(texts, labels, label_names, folds, args.dim, args.epochs)
+    temperature, loss = calibrate(logits, target)
+    probs = _softmax(logits / temperature)
+    accuracy = float((probs.argmax(axis=1) == target).mean())
+    print(f"Held-out ({folds}-fold): {len(texts)} examples, accuracy {accuracy:.0%}, "
+          f"log loss {loss:.3f} at temperature {temperature:.2f}")
+
+    rows, ece = reliability(probs, target)
+    print("Reliability:   confidence   count   mean conf   accuracy")
+    for low, high, count, mean_confidence, bin_accuracy in rows:
+        print(f"               {low:.1f}-{high:.1f}   {count:5d}   {mean_confidence:9.3f}   {bin_accuracy:8.3f}")
+    print(f"Expected calibration error: {ece:.3f}")
+
+    threshold = skip_threshold(probs, target, label_names, args.skip_floor)
+    is_conversational_label = np.array([label in CONVERSATIONAL_INTENTS for label in label_names])
+    conversational = is_conversational_label[target]
+    skipped = is_conversational_label[probs.argmax(axis=1)] & (probs.max(axis=1) >= threshold)
+    if threshold > 1.0:
+        print("Skip threshold: none; a held-out action request was taken for conversation at full confidence, "
+              "so this model never skips the parse")
+    else:
+        print(f"Skip threshold: {threshold:.3f}; would skip the parse for {int((skipped & conversational).sum())} "
+              f"of {int(conversational.sum())} held-out conversational inputs and {int((skipped & ~conversational).sum())} "
+              f"action requests")
+
+    # Final model sees every example and keeps the calibrated temperature and skip threshold
+    final = fit(texts, labels, args.dim, args.epochs)
+    final.temperature = temperature
+    final.skip_threshold = threshold
+    final.save(args.out)
+    print(f"Saved {len(final.labels)} intents trained on {len(examples)} examples to {args.out}")
+
+
+def bench_command(args):
+    model = IntentClassifier.load(args.model)
+    texts = [text for text, _ in load_examples(args.data)] if os.path.exists(args.data) else ['show my tasks']
+    batch = [texts[i % len(texts)] for i in range(args.n)]
+
+    started = time.perf_counter()
+    for text in batch:
+        model.classify(text)
+    single = args.n / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for i in range(0, args.n, args.batch_size):
+        model.predict_proba(batch[i:i + args.batch_size])
+    batched = args.n / (time.perf_counter() - started)
+    print(f"One at a time: {single:,.0f} classifications/s")
+    print(f"Batches of {args.batch_size}: {batched:,.0f} classifications/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train, benchmark or query the intent classifier")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    train = commands.add_parser('train')
+    train.add_argument('--data', default=os.path.join(_HERE, 'intent_examples.jsonl'), help='JSONL of {"text", "intent"}')
+    train.add_argument('--from-db', action='store_true', help='add saved requests, weakly labelled by the rule parser')
+    train.add_argument('--out', default=INTENT_MODEL_PATH)
+    train.add_argument('--dim', type=int, default=INTENT_FEATURE_DIM)
+    train.add_argument('--epochs', type=int, default=300)
+    train.add_argument('--folds', type=int, default=5, help='cross-validation folds for calibration')
+    train.add_argument('--skip-floor', type=float, default=INTENT_SKIP_THRESHOLD,
+                       help='lowest skip threshold the fitted one may have')
+
+    bench = commands.add_parser('bench')
+    bench.add_argument('--model', default=INTENT_MODEL_PATH)
+    bench.add_argument('--data', default=os.path.join(_HERE, 'intent_examples.jsonl'))
+    bench.add_argument('--n', type=int, default=20000)
+    bench.add_argument('--batch-size', type=int, default=256)
+
+    predict = commands.add_parser('predict')
+    predict.add_argument('text')
+    predict.add_argument('--model', default=INTENT_MODEL_PATH)
+
+    args = parser.parse_args()
+    if args.command == 'train':
+        train_command(args)
+    elif args.command == 'bench':
+        bench_command(args)
+    else:
+        model = IntentClassifier.load(args.model)
+        probs = model.predict_proba([args.text])[0]
+        for index in probs.argsort()[::-1]:
+            print(f"{probs[index]:.3f}  {model.labels[index]}")
+
+
+def load_default():
+    """The trained model at INTENT_MODEL_PATH, or None when NumPy or the model file is missing"""
+    if not NUMPY_AVAILABLE or not os.path.exists(INTENT_MODEL_PATH):
+        return None
+    try:
+        return IntentClassifier.load(INTENT_MODEL_PATH)
+    except Exception as e:
+        print(f"⚠️  Could not load intent model: {e}")
+        return None
+
+
+classifier = load_default()
+
+
+def classify(text):
+    """(label, probability) from the trained model, or None when no model is available"""
+    if classifier is None:
+        return None
+    label, probability = classifier.classify(text)
+    metrics.observe('intent.probability', probability)
+    return label, probability
+
+
+def is_conversational(text):
+    """True when the model is sure enough that text is small talk or a help request to skip the parse"""
+    prediction = classify(text)
+    if prediction is None:
+        return False
+    label, probability = prediction
+    return label in CONVERSATIONAL_INTENTS and probability >= max(INTENT_SKIP_THRESHOLD, classifier.skip_threshold)
+
+
+def confident_intent(text):
+    """The predicted intent when it clears INTENT_ROUTE_THRESHOLD, else None"""
+    prediction = classify(text)
+    if prediction is None or prediction[1] < INTENT_ROUTE_THRESHOLD:
+        return None
+    return prediction[0]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Helpers for consuming JSON that arrives from the model a few tokens at a time,
+and for sending JSON to the client the same way
+"""
+import json
+import re
+
+# \uD800-\uDBFF: first half of a surrogate pair, meaningless until the second half follows
+HIGH_SURROGATE_ESCAPE = re.compile(r'\\u[dD][89abAB][0-9a-fA-F]{2}$')
+
+
+class ActionStreamParser:
+    """Incrementally parses the model's top-level JSON object as it is generated
+
+    feed() returns events as soon as they can be acted on:
+    ('field', key, value) once a top-level value is complete, and
+    ('text', delta) for each decoded piece of the streamed string field (e.g. "response").
+    """
+
+    def __init__(self, stream_field='response'):
+        self.stream_field = stream_field
+        self.fields = {}
+        self.done = False
+        self._raw = ''
+        self._pos = 0
+        self._state = 'start'
+        self._key_start = None
+        self._key = None
+        self._value_start = None
+        self._nesting = 0
+        self._in_string = False
+        self._escape = False
+        self._text_from = None
+
+    def feed(self, chunk):
+        """Consume the next chunk of model output and return the events it completed"""
+        self._raw += chunk
+        events = []
+        while self._pos < len(self._raw) and not self.done:
+            ch = self._raw[self._pos]
+            state = self._state
+            if state == 'start':
+                if ch == '{':
+                    self._state = 'key'
+            elif state == 'key':
+                if ch == '"':
+                    self._key_start = self._pos + 1
+                    self._state = 'key_string'
+                elif ch == '}':
+                    self.done = True
+            elif state == 'key_string':
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._key = json.loads('"' + self._raw[self._key_start:self._pos] + '"')
+                    self._state = 'colon'
+            elif state == 'colon':
+                if ch == ':':
+                    self._state = 'value'
+            elif state == 'value':
+                if not ch.isspace():
+                    self._value_start = self._pos
+                    if ch == '"':
+                        self._state = 'string'
+                        if self._key == self.stream_field:
+                            self._text_from = self._pos + 1
+                    elif ch in '[{':
+                        self._state = 'nested'
+                        self._nesting = 1
+                    else:
+                        self._state = 'scalar'
+            elif state == 'string':
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    if self._text_from is not None:
+                        events.extend(self._flush_text(self._pos, final=True))
+                        self._text_from = None
+                    events.append(self._complete(self._pos + 1))
+            elif state == 'nested':
+                if self._in_string:
+                    if self._escape:
+                        self._escape = False
+                    elif ch == '\\':
+                        self._escape = True
+                    elif ch == '"':
+                        self._in_string = False
+                elif ch == '"':
+                    self._in_string = True
+                elif ch in '[{':
+                    self._nesting += 1
+                elif ch in ']}':
+                    self._nesting -= 1
+                    if self._nesting == 0:
+                        events.append(self._complete(self._pos + 1))
+            elif state == 'scalar':
+                if ch in ',}' or ch.isspace():
+                    events.append(self._complete(self._pos))
+                    if ch == '}':
+                        self.done = True
+            self._pos += 1
+        if self._text_from is not None:
+            events.extend(self._flush_text(self._pos))
+        return events
+
+    def _flush_text(self, end, final=False):
+        # Stop short of an escape sequence that has not fully arrived yet, and of a high surrogate
+        # whose low half is still to come; decoded alone each half would be a lone surrogate
+        segment = self._raw[self._text_from:end]
+        cut = len(segment)
+        backslash = segment.rfind('\\', max(0, cut - 6))
+        if backslash != -1:
+            run = len(segment[:backslash + 1]) - len(segment[:backslash + 1].rstrip('\\'))
+            needed = 6 if segment[backslash + 1:backslash + 2] == 'u' else 2
+            if run % 2 == 1 and cut - backslash < needed:
+                cut = backslash
+        if not final and HIGH_SURROGATE_ESCAPE.search(segment, 0, cut):
+            start = cut - 6
+            run = len(segment[:start + 1]) - len(segment[:start + 1].rstrip('\\'))
+            if run % 2 == 1:
+                cut = start
+        if cut == 0:
+            return []
+        self._text_from += cut
+        return [('text', json.loads('"' + segment[:cut] + '"'))]
+
+    def _complete(self, end):
+        value = json.loads(self._raw[self._value_start:end])
+        self.fields[self._key] = value
+        self._state = 'key'
+        return ('field', self._key, value)
+
+
+def sse_event(event, data):
+    """Format one server-sent event frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def json_array(items, batch_size=100):
+    """Yield a JSON array of items piece by piece, one string per batch_size items"""
+    yield '['
+    batch = []
+    first = True
+    for item in items:
+        batch.append(json.dumps(item))
+        if len(batch) >= batch_size:
+            yield ('' if first else ',') + ','.join(batch)
+            first = False
+            batch = []
+    if batch:
+        yield ('' if first else ',') + ','.join(batch)
+    yield ']'
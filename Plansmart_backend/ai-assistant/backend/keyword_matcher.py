@@ -0,0 +1,81 @@
+"""
+Aho-Corasick keyword matcher for intent detection
+The automaton is built once from an intent -> phrases table, and match() finds every phrase
+in a single left-to-right scan of the input, so the cost does not grow with the catalog size.
+Phrases only match on word boundaries ("hi" does not match inside "this").
+"""
+import json
+import re
+from collections import deque
+
+_NON_WORD = re.compile(r"[^a-z0-9']+")
+
+
+def normalize(text):
+    """Lowercase and turn every run of punctuation/whitespace into one space"""
+    return _NON_WORD.sub(' ', (text or '').lower()).strip()
+
+
+class KeywordMatcher:
+    """Multi-pattern matcher that maps matched phrases back to their intents"""
+
+    def __init__(self, intents):
+        self.intents = list(intents)
+        self._goto = [{}]
+        self._fail = [0]
+        # (phrase length, intent index) for every phrase ending at a state, including via fail links
+        self._outputs = [[]]
+        for index, intent in enumerate(self.intents):
+            for phrase in intents[intent]:
+                self._add(normalize(phrase), index)
+        self._build_fail_links()
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def _add(self, phrase, intent_index):
+        if not phrase:
+            return
+        state = 0
+        for ch in phrase:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            state = nxt
+        self._outputs[state].append((len(phrase), intent_index))
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                # A first-level state would otherwise fail to itself
+                self._fail[nxt] = target if target != nxt else 0
+                self._outputs[nxt] = self._outputs[nxt] + self._outputs[self._fail[nxt]]
+
+    def match(self, text):
+        """Intents with at least one phrase in text, in intent-table order"""
+        text = normalize(text)
+        found = set()
+        state = 0
+        for end, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for length, intent_index in self._outputs[state]:
+                start = end - length + 1
+                # Whole words only: the phrase must be bounded by spaces or the ends of the text
+                if (start == 0 or text[start - 1] == ' ') and (end + 1 == len(text) or text[end + 1] == ' '):
+                    found.add(intent_index)
+        return [self.intents[index] for index in sorted(found)]
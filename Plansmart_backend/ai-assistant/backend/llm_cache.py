@@ -0,0 +1,116 @@
+"""
+LRU + TTL cache for model parse results
+Entries are keyed on the normalized utterance plus a fingerprint of the user's state,
+and every entry for a user is dropped as soon as their tasks or schedules change.
+"""
+import copy
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+import metrics
+
+# Load environment variables
+load_dotenv()
+
+
+def normalize_text(text):
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    text = re.sub(r'\s+', ' ', (text or '').strip().lower())
+    return text.rstrip(' .!?')
+
+
+def make_key(text, fingerprint):
+    """Cache key for an utterance under a given user-state fingerprint"""
+    return hashlib.sha1(f"{normalize_text(text)}\x00{fingerprint}".encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """Thread-safe LRU cache with per-entry expiry and per-user invalidation"""
+
+    def __init__(self, max_entries=512, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._user_keys = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return a copy of the cached value, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                metrics.incr('llm_cache.misses')
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            metrics.incr('llm_cache.hits')
+            return copy.deepcopy(entry[0])
+
+    def set(self, key, value, user_id=None):
+        """Store a value for key, evicting the least recently used entries over the limit"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (copy.deepcopy(value), time.monotonic() + self.ttl_seconds, user_id)
+            self._user_keys.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        """Drop every entry computed from this user's state"""
+        with self._lock:
+            keys = self._user_keys.pop(user_id, set())
+            for key in keys:
+                self._entries.pop(key, None)
+            if keys:
+                self.invalidations += 1
+                metrics.incr('llm_cache.invalidations')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_keys.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def _remove(self, key):
+        _, _, user_id = self._entries.pop(key)
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
+
+
+parse_cache = LLMCache(
+    max_entries=int(os.getenv('LLM_CACHE_SIZE', '512')),
+    ttl_seconds=float(os.getenv('LLM_CACHE_TTL', '300')),
+)
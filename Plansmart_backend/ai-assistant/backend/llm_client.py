@@ -0,0 +1,389 @@
+"""
+Model server clients with hard deadlines and a circuit breaker
+A stalled or failing model backend trips the breaker, callers fall back to the rule-based
+paths immediately, and a background probe closes the breaker once the backend recovers.
+Ollama traffic is spread over a pool of endpoints, each with its own breaker and concurrency cap.
+"""
+import os
+import threading
+import time
+
+import ollama
+from dotenv import load_dotenv
+
+import metrics
+from model_router import router
+
+# Load environment variables
+load_dotenv()
+
+OLLAMA_HOST = os.getenv('OLLAMA_HOST')
+# Comma-separated model servers to spread requests over; defaults to OLLAMA_HOST alone
+OLLAMA_HOSTS = [h.strip() for h in os.getenv('OLLAMA_HOSTS', OLLAMA_HOST or '').split(',') if h.strip()] or [None]
+# Requests one endpoint works on at once; CPU boxes slow down for everyone past this
+OLLAMA_MAX_CONCURRENCY = int(os.getenv('OLLAMA_MAX_CONCURRENCY', '2'))
+# How long a request waits for a free slot before falling back to the rule-based path
+OLLAMA_QUEUE_TIMEOUT = float(os.getenv('OLLAMA_QUEUE_TIMEOUT', '5'))
+# Seconds between health checks of endpoints whose breaker is closed (0 disables them)
+OLLAMA_HEALTH_INTERVAL = float(os.getenv('OLLAMA_HEALTH_INTERVAL', '30'))
+# Load the configured models on every endpoint at startup, before reporting ready
+OLLAMA_WARMUP = os.getenv('OLLAMA_WARMUP', 'false').lower() in ('1', 'true', 'yes')
+# Seconds between keep-warm pings that stop idle models from being unloaded (0 disables them)
+OLLAMA_KEEP_WARM_INTERVAL = float(os.getenv('OLLAMA_KEEP_WARM_INTERVAL', '0'))
+# Generations whose model load took longer than this are counted as cold starts
+COLD_START_LOAD_MS = float(os.getenv('COLD_START_LOAD_MS', '500'))
+OLLAMA_TIMEOUT = float(os.getenv('OLLAMA_TIMEOUT', '30'))
+# Upper bound for a whole streamed generation (OLLAMA_TIMEOUT applies per read)
+OLLAMA_STREAM_DEADLINE = float(os.getenv('OLLAMA_STREAM_DEADLINE', '60'))
+# Keep models (and their prompt cache) resident between requests
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '3'))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '20'))
+BREAKER_PROBE_INTERVAL = float(os.getenv('BREAKER_PROBE_INTERVAL', '5'))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose breaker is open"""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a streamed generation runs past its deadline"""
+
+
+class CircuitBreaker:
+    """Opens after repeated failed or slow calls and probes for recovery in the background"""
+
+    def __init__(self, name, probe=None, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 slow_call_seconds=BREAKER_SLOW_CALL_SECONDS, probe_interval=BREAKER_PROBE_INTERVAL):
+        self.name = name
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.probe_interval = probe_interval
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+        self._prober = None
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """True when calls may go through to the backend"""
+        if not self.is_open:
+            return True
+        # Without a probe, let one call through per interval to test the backend
+        if self.probe is None:
+            with self._lock:
+                if self.opened_at is not None and time.monotonic() - self.opened_at >= self.probe_interval:
+                    self.opened_at = time.monotonic()
+                    return True
+        return False
+
+    def record_success(self, duration):
+        if duration > self.slow_call_seconds:
+            metrics.incr(f'breaker.{self.name}.slow_calls')
+            self.record_failure()
+            return
+        with self._lock:
+            self.failures = 0
+            if self.opened_at is not None:
+                self._close()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            metrics.incr(f'breaker.{self.name}.failures')
+            if self.opened_at is None and self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                metrics.incr(f'breaker.{self.name}.opened')
+                print(f"⚠️  Circuit breaker '{self.name}' opened after {self.failures} failed or slow calls")
+                self._start_prober()
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn through the breaker, timing it and recording the outcome"""
+        if not self.allow():
+            metrics.incr(f'breaker.{self.name}.rejected')
+            raise CircuitOpenError(f"{self.name} backend unavailable")
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success(time.monotonic() - started)
+        return result
+
+    def stream(self, fn, deadline, *args, **kwargs):
+        """Like call() for generators: the breaker sees the outcome of the whole stream"""
+        if not self.allow():
+            metrics.incr(f'breaker.{self.name}.rejected')
+            raise CircuitOpenError(f"{self.name} backend unavailable")
+        started = time.monotonic()
+        try:
+            chunks = fn(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        return self._guard_stream(chunks, started, deadline)
+
+    def _guard_stream(self, chunks, started, deadline):
+        first_chunk_after = None
+        try:
+            for chunk in chunks:
+                elapsed = time.monotonic() - started
+                if elapsed > deadline:
+                    raise DeadlineExceeded(f"{self.name} stream exceeded {deadline}s")
+                if first_chunk_after is None:
+                    first_chunk_after = elapsed
+                yield chunk
+        except Exception:
+            self.record_failure()
+            raise
+        # A stream counts as slow when its first token was slow, not because the reply was long
+        self.record_success(first_chunk_after or 0)
+
+    def state(self):
+        return {
+            'open': self.is_open,
+            'failures': self.failures,
+            'open_for_seconds': time.monotonic() - self.opened_at if self.is_open else 0,
+        }
+
+    def _close(self):
+        self.opened_at = None
+        self.failures = 0
+        metrics.incr(f'breaker.{self.name}.closed')
+        print(f"✅ Circuit breaker '{self.name}' closed, backend recovered")
+
+    def _start_prober(self):
+        if self.probe is None or (self._prober is not None and self._prober.is_alive()):
+            return
+        self._prober = threading.Thread(target=self._probe_loop, name=f'{self.name}-breaker-probe', daemon=True)
+        self._prober.start()
+
+    def _probe_loop(self):
+        while self.is_open:
+            time.sleep(self.probe_interval)
+            try:
+                self.probe()
+            except Exception:
+                continue
+            with self._lock:
+                if self.opened_at is not None:
+                    self._close()
+
+
+class Endpoint:
+    """One model server with its own client, breaker and count of requests in flight"""
+
+    def __init__(self, host, max_concurrency):
+        self.host = host or 'default'
+        self.client = ollama.Client(host=host, timeout=OLLAMA_TIMEOUT)
+        self.breaker = CircuitBreaker(f'ollama@{self.host}', probe=self.client.list)
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.dispatched = 0
+
+
+class PooledStream:
+    """Iterator over a streamed generation that frees its endpoint slot once it ends or is dropped"""
+
+    def __init__(self, pool, endpoint, chunks):
+        self._pool = pool
+        self._endpoint = endpoint
+        self._chunks = chunks
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._endpoint is not None:
+            self._pool.release(self._endpoint)
+            self._endpoint = None
+            self._chunks.close()
+
+    __del__ = close
+
+
+class OllamaPool:
+    """Sends each request to the healthy endpoint with the fewest requests in flight"""
+
+    def __init__(self, hosts, max_concurrency=OLLAMA_MAX_CONCURRENCY, queue_timeout=OLLAMA_QUEUE_TIMEOUT):
+        self.endpoints = [Endpoint(host, max_concurrency) for host in hosts]
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+
+    @property
+    def is_open(self):
+        """True when every endpoint's breaker is open"""
+        return all(endpoint.breaker.is_open for endpoint in self.endpoints)
+
+    def acquire(self):
+        started = time.monotonic()
+        with self._cond:
+            while True:
+                available = [e for e in self.endpoints if e.breaker.allow()]
+                if not available:
+                    metrics.incr('ollama_pool.rejected')
+                    raise CircuitOpenError("no ollama backend available")
+                free = [e for e in available if e.outstanding < e.max_concurrency]
+                if free:
+                    endpoint = min(free, key=lambda e: (e.outstanding, e.dispatched))
+                    endpoint.outstanding += 1
+                    endpoint.dispatched += 1
+                    metrics.observe('ollama_pool.queue_wait_ms', (time.monotonic() - started) * 1000)
+                    return endpoint
+                remaining = self.queue_timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    metrics.incr('ollama_pool.saturated')
+                    raise CircuitOpenError("every ollama backend is at its concurrency limit")
+                self._cond.wait(remaining)
+
+    def release(self, endpoint):
+        with self._cond:
+            endpoint.outstanding -= 1
+            self._cond.notify()
+
+    def chat(self, **kwargs):
+        endpoint = self.acquire()
+        if kwargs.get('stream'):
+            try:
+                chunks = endpoint.breaker.stream(endpoint.client.chat, OLLAMA_STREAM_DEADLINE, **kwargs)
+            except Exception:
+                self.release(endpoint)
+                raise
+            return PooledStream(self, endpoint, chunks)
+        try:
+            return endpoint.breaker.call(endpoint.client.chat, **kwargs)
+        finally:
+            self.release(endpoint)
+
+    def embeddings(self, **kwargs):
+        endpoint = self.acquire()
+        try:
+            return endpoint.breaker.call(endpoint.client.embeddings, **kwargs)
+        finally:
+            self.release(endpoint)
+
+    def health_check(self):
+        """Ping endpoints that look healthy; open breakers already have their own probe"""
+        for endpoint in self.endpoints:
+            if endpoint.breaker.is_open:
+                continue
+            try:
+                endpoint.client.list()
+            except Exception:
+                metrics.incr(f'ollama_pool.health_check_failed.{endpoint.host}')
+                endpoint.breaker.record_failure()
+
+    def state(self):
+        return {
+            endpoint.breaker.name: dict(endpoint.breaker.state(), outstanding=endpoint.outstanding,
+                                        dispatched=endpoint.dispatched)
+            for endpoint in self.endpoints
+        }
+
+
+ollama_pool = OllamaPool(OLLAMA_HOSTS)
+
+
+def record_usage(response):
+    """Track prompt-eval cost and model speed from the final message of a generation"""
+    if not response.get('done'):
+        return
+    metrics.observe('llm.prompt_eval_count', response.get('prompt_eval_count', 0))
+    metrics.observe('llm.prompt_eval_ms', response.get('prompt_eval_duration', 0) / 1e6)
+    metrics.observe('llm.eval_count', response.get('eval_count', 0))
+    load_ms = response.get('load_duration', 0) / 1e6
+    if load_ms > COLD_START_LOAD_MS:
+        # The model was not resident when this request arrived
+        metrics.incr('llm.cold_starts')
+        metrics.observe('llm.cold_start_load_ms', load_ms)
+    router.observe(response)
+
+
+def _recording_usage(chunks):
+    for chunk in chunks:
+        record_usage(chunk)
+        yield chunk
+
+
+def chat(**kwargs):
+    """ollama.chat on the least-loaded endpoint, with a per-call timeout, a stream deadline and its breaker in front"""
+    kwargs.setdefault('keep_alive', OLLAMA_KEEP_ALIVE)
+    if kwargs.get('stream'):
+        return _recording_usage(ollama_pool.chat(**kwargs))
+    response = ollama_pool.chat(**kwargs)
+    record_usage(response)
+    return response
+
+
+def embeddings(**kwargs):
+    """ollama.embeddings on the least-loaded endpoint, behind the same breakers as chat"""
+    kwargs.setdefault('keep_alive', OLLAMA_KEEP_ALIVE)
+    return ollama_pool.embeddings(**kwargs)
+
+
+def breaker_states():
+    return ollama_pool.state()
+
+
+warmup_complete = threading.Event()
+warm_models = {}
+
+
+def load_model(endpoint, model):
+    """Ask one endpoint to load a model (an empty chat only loads it) and return the seconds it took"""
+    started = time.monotonic()
+    endpoint.client.chat(model=model, messages=[], keep_alive=OLLAMA_KEEP_ALIVE)
+    return time.monotonic() - started
+
+
+def warm_up(models):
+    """Load every model on every endpoint so the first user request does not pay for it"""
+    for endpoint in ollama_pool.endpoints:
+        for model in models:
+            try:
+                seconds = load_model(endpoint, model)
+            except Exception as e:
+                metrics.incr('llm.warmup_failures')
+                print(f"⚠️  Warm-up of {model} on {endpoint.host} failed: {e}")
+                continue
+            metrics.observe('llm.warmup_load_ms', seconds * 1000)
+            warm_models.setdefault(endpoint.host, []).append(model)
+            print(f"🔥 {model} loaded on {endpoint.host} in {seconds:.1f}s")
+    warmup_complete.set()
+
+
+def start_warm_up(models):
+    """Warm up in the background when OLLAMA_WARMUP is set; otherwise report ready straight away"""
+    if not OLLAMA_WARMUP:
+        warmup_complete.set()
+        return
+    threading.Thread(target=warm_up, args=(list(models),), name='ollama-warmup', daemon=True).start()
+
+
+def keep_warm(models):
+    """Re-load models on healthy endpoints so their keep-alive never runs out"""
+    for endpoint in ollama_pool.endpoints:
+        if endpoint.breaker.is_open:
+            continue
+        for model in models:
+            try:
+                load_model(endpoint, model)
+            except Exception:
+                metrics.incr('llm.keep_warm_failures')
+
+
+def warmup_state():
+    return {'ready': warmup_complete.is_set(), 'warmup': OLLAMA_WARMUP, 'warm_models': warm_models}
@@ -0,0 +1,37 @@
+"""
+In-process metrics for the assistant backend
+Thread-safe counters and running summaries exposed through /metrics
+"""
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_summaries = {}
+
+
+def incr(name, value=1):
+    """Increase a counter by value"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name, value):
+    """Record one observation (latency, call count, ...) for a summary"""
+    with _lock:
+        summary = _summaries.get(name)
+        if summary is None:
+            summary = _summaries[name] = {'count': 0, 'sum': 0.0, 'min': value, 'max': value, 'last': value}
+        summary['count'] += 1
+        summary['sum'] += value
+        summary['min'] = min(summary['min'], value)
+        summary['max'] = max(summary['max'], value)
+        summary['last'] = value
+
+
+def snapshot():
+    """Return a copy of all counters and summaries"""
+    with _lock:
+        summaries = {}
+        for name, summary in _summaries.items():
+            summaries[name] = dict(summary, avg=summary['sum'] / summary['count'])
+        return {'counters': dict(_counters), 'summaries': summaries}
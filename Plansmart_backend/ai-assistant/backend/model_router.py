@@ -0,0 +1,114 @@
+"""
+Picks which local model serves each request
+Short command-like inputs go to the smallest configured model and open-ended ones to the largest,
+stepping down to smaller models whenever the measured speed of a model would blow the latency budget.
+"""
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+import metrics
+
+# Load environment variables
+load_dotenv()
+
+# Comma-separated, ordered from smallest/fastest to largest
+OLLAMA_MODELS = [m.strip() for m in os.getenv('OLLAMA_MODELS', 'llama2').split(',') if m.strip()]
+LLM_LATENCY_BUDGET_MS = float(os.getenv('LLM_LATENCY_BUDGET_MS', '8000'))
+ROUTER_SHORT_INPUT_WORDS = int(os.getenv('ROUTER_SHORT_INPUT_WORDS', '12'))
+ROUTER_COMMAND_WORDS = {w.strip().lower() for w in os.getenv(
+    'ROUTER_COMMAND_WORDS',
+    'add,create,schedule,remind,set,plan,book,move,reschedule,change,mark,show,list,delete,cancel'
+).split(',') if w.strip()}
+# Weight of the newest measurement in the moving averages
+ROUTER_EWMA_ALPHA = float(os.getenv('ROUTER_EWMA_ALPHA', '0.3'))
+# An over-budget model gets one request again after this long, so a recovered box is noticed
+ROUTER_REMEASURE_SECONDS = float(os.getenv('ROUTER_REMEASURE_SECONDS', '300'))
+
+
+class ModelRouter:
+    """Chooses a model per request from timings reported by the model server"""
+
+    def __init__(self, models, latency_budget_ms, short_input_words, command_words, alpha=0.3,
+                 remeasure_seconds=300):
+        self.models = list(models)
+        self.latency_budget_ms = latency_budget_ms
+        self.short_input_words = short_input_words
+        self.command_words = set(command_words)
+        self.alpha = alpha
+        self.remeasure_seconds = remeasure_seconds
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def is_command(self, text):
+        """Short inputs that start with an action word"""
+        words = (text or '').lower().split()
+        return 0 < len(words) <= self.short_input_words and words[0].strip(',.!?') in self.command_words
+
+    def estimate_ms(self, model, max_tokens):
+        """Expected latency for a generation of up to max_tokens, or None when there is no recent measurement"""
+        with self._lock:
+            timing = self._timings.get(model)
+            if timing is None or time.monotonic() - timing['measured_at'] > self.remeasure_seconds:
+                return None
+            tokens = min(max_tokens, timing['eval_count'])
+            return timing['prompt_ms'] + tokens * timing['ms_per_token']
+
+    def pick(self, text, max_tokens):
+        """Model for this input: the preferred size, or the largest smaller one that fits the budget"""
+        if len(self.models) == 1:
+            return self.models[0]
+        preferred = 0 if self.is_command(text) else len(self.models) - 1
+        chosen = self.models[0]
+        for model in reversed(self.models[:preferred + 1]):
+            estimate = self.estimate_ms(model, max_tokens)
+            # Unmeasured models are tried so the router learns (or relearns) their speed
+            if estimate is None or estimate <= self.latency_budget_ms:
+                chosen = model
+                break
+        metrics.incr(f'router.picked.{chosen}')
+        return chosen
+
+    def observe(self, response):
+        """Fold the timings from a finished generation into the model's averages"""
+        model = self._canonical(response.get('model'))
+        eval_count = response.get('eval_count') or 0
+        if model is None or not eval_count:
+            return
+        sample = {
+            'ms_per_token': response.get('eval_duration', 0) / 1e6 / eval_count,
+            'prompt_ms': response.get('prompt_eval_duration', 0) / 1e6,
+            'eval_count': eval_count,
+        }
+        measured_at = time.monotonic()
+        with self._lock:
+            timing = self._timings.get(model)
+            if timing is None:
+                self._timings[model] = dict(sample, samples=1, measured_at=measured_at)
+                return
+            for key, value in sample.items():
+                timing[key] += self.alpha * (value - timing[key])
+            timing['samples'] += 1
+            timing['measured_at'] = measured_at
+
+    def stats(self):
+        with self._lock:
+            return {
+                'models': self.models,
+                'latency_budget_ms': self.latency_budget_ms,
+                'timings': {model: {key: value for key, value in timing.items() if key != 'measured_at'}
+                            for model, timing in self._timings.items()},
+            }
+
+    def _canonical(self, name):
+        # The server reports "llama2:latest" for a model configured as "llama2"
+        if name in self.models or name is None:
+            return name
+        if name.endswith(':latest') and name[:-len(':latest')] in self.models:
+            return name[:-len(':latest')]
+        return name
+
+
+router = ModelRouter(OLLAMA_MODELS, LLM_LATENCY_BUDGET_MS, ROUTER_SHORT_INPUT_WORDS,
+                     ROUTER_COMMAND_WORDS, ROUTER_EWMA_ALPHA, ROUTER_REMEASURE_SECONDS)
@@ -1,4 +1,3 @@
-<<<<<<< HEAD
 # from flask_sqlalchemy import SQLAlchemy
 # from datetime import datetime
 # from werkzeug.security import generate_password_hash, check_password_hash
@@ -39,146 +38,115 @@
 
 
 from flask_sqlalchemy import SQLAlchemy
-
+from sqlalchemy import inspect, text
 from datetime import datetime
-
 from werkzeug.security import generate_password_hash, check_password_hash
 
- 
-
 db = SQLAlchemy()
 
- 
-
 class User(db.Model):
-
     id = db.Column(db.Integer, primary_key=True)
-
     username = db.Column(db.String(80), unique=True, nullable=False)
-
     password_hash = db.Column(db.String(128), nullable=False)
-
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
- 
-
     def set_password(self, password):
-
         self.password_hash = generate_password_hash(password)
 
- 
-
     def check_password(self, password):
-
         return check_password_hash(self.password_hash, password)
 
- 
-
 class Task(db.Model):
-
     id = db.Column(db.Integer, primary_key=True)
-
     description = db.Column(db.String(200), nullable=False)
-
     due_date = db.Column(db.DateTime, nullable=True)
-
     completed = db.Column(db.Boolean, default=False)
-
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
 
- 
+    __table_args__ = (
+        db.Index('ix_task_user_created', 'user_id', 'created_at'),  # newest tasks
+        db.Index('ix_task_user_completed_due', 'user_id', 'completed', 'due_date'),  # done/pending lists by due date
+        db.Index('ix_task_user_due', 'user_id', 'due_date'),  # /get_tasks?due_after=&due_before=
+        db.Index('ix_task_user_description', 'user_id', 'description'),  # /get_tasks?prefix=
+    )
 
 class Schedule(db.Model):
-
     id = db.Column(db.Integer, primary_key=True)
-
     title = db.Column(db.String(100), nullable=False)
-
     start_time = db.Column(db.DateTime, nullable=False)
-
     end_time = db.Column(db.DateTime, nullable=True)
-
     completed = db.Column(db.Boolean, default=False)
-
     description = db.Column(db.String(200), nullable=True)
-
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
 
- 
+    __table_args__ = (
+        db.Index('ix_schedule_user_start', 'user_id', 'start_time'),  # today's / upcoming schedules
+        db.Index('ix_schedule_user_created', 'user_id', 'created_at'),  # newest schedules
+        db.Index('ix_schedule_user_title', 'user_id', 'title'),  # updates by title, /get_schedules?prefix=
+    )
 
 class Request(db.Model):
-
     id = db.Column(db.Integer, primary_key=True)
-
     text = db.Column(db.String(500), nullable=False)
-
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
-
+    route = db.Column(db.String(20), nullable=True)  # rules, classifier, llm, llm_cache, llm_fallback or engine
+    route_confidence = db.Column(db.Float, nullable=True)
     responses = db.relationship('Response', backref='request', lazy=True)
 
- 
+    __table_args__ = (
+        db.Index('ix_request_user_created', 'user_id', 'created_at'),  # conversation history
+    )
 
 class Response(db.Model):
-
     id = db.Column(db.Integer, primary_key=True)
-
     text = db.Column(db.Text, nullable=False)
-
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
     request_id = db.Column(db.Integer, db.ForeignKey('request.id'), nullable=False)
-=======
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
-
-db = SQLAlchemy()
 
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
-
-class Task(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    description = db.Column(db.String(200), nullable=False)
-    due_date = db.Column(db.DateTime, nullable=True)
-    completed = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
-
-class Schedule(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(100), nullable=False)
-    start_time = db.Column(db.DateTime, nullable=False)
-    end_time = db.Column(db.DateTime, nullable=True)
-    description = db.Column(db.String(200), nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
-
-class Request(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    text = db.Column(db.String(500), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
-    responses = db.relationship('Response', backref='request', lazy=True)
-
-class Response(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    text = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    request_id = db.Column(db.Integer, db.ForeignKey('request.id'), nullable=False)
->>>>>>> 59bb2c1d88c8d1282a6ea935485986ff7bd3de97
+    __table_args__ = (
+        db.Index('ix_response_request', 'request_id'),
+    )
+
+class UserStateSnapshot(db.Model):
+    # Per-user counts and recent items, kept current by user_state.py in the same transaction as each write
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False)
+    incomplete_tasks = db.Column(db.Integer, nullable=False, default=0)
+    completed_tasks = db.Column(db.Integer, nullable=False, default=0)
+    total_schedules = db.Column(db.Integer, nullable=False, default=0)
+    today = db.Column(db.Date, nullable=False)  # day today_schedules was counted for
+    today_schedules = db.Column(db.Integer, nullable=False, default=0)
+    recent_tasks = db.Column(db.JSON, nullable=False, default=list)
+    recent_schedules = db.Column(db.JSON, nullable=False, default=list)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ConversationSummary(db.Model):
+    # Rolling summary of a user's older turns; the prompt carries it plus the turns after through_request_id
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False)
+    text = db.Column(db.Text, nullable=False, default='')
+    through_request_id = db.Column(db.Integer, nullable=False, default=0)  # last request folded in
+    turns = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+def upgrade_schema():
+    """Add columns and indexes that were introduced after an existing SQLite table was created"""
+    # db.create_all() only creates missing tables, so older databases need the new columns and indexes added
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+            print(f"Added column {table.name}.{column.name}")
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(db.engine)
+                print(f"Added index {index.name}")
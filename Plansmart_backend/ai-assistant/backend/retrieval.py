@@ -0,0 +1,267 @@
+"""
+Per-user vector index over task descriptions and schedule titles
+The parse prompt gets the user's items most similar to the input, not just the newest ones.
+Texts are embedded with the hashed n-gram features the intent classifier uses (no model call),
+or with an Ollama embedding model when RETRIEVAL_EMBED_MODEL is set. Small indexes are searched
+exactly; large ones first narrow the candidates with random-hyperplane LSH codes.
+Indexes live in memory, are built on first use and are patched after every committed write.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+import llm_client
+import metrics
+import user_state
+from intent_classifier import featurize
+from models import db, Task, Schedule
+
+# NumPy is optional: without it the prompt only carries the recent items
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Load environment variables
+load_dotenv()
+
+RETRIEVAL_ENABLED = NUMPY_AVAILABLE and os.getenv('RETRIEVAL_ENABLED', 'true').lower() == 'true'
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '5'))
+# Cosine similarity below this is not worth a line in the prompt
+RETRIEVAL_MIN_SCORE = float(os.getenv('RETRIEVAL_MIN_SCORE', '0.25'))
+# Empty: hashed n-gram vectors of RETRIEVAL_DIM; otherwise an Ollama embedding model, e.g. nomic-embed-text
+RETRIEVAL_EMBED_MODEL = os.getenv('RETRIEVAL_EMBED_MODEL', '')
+RETRIEVAL_DIM = int(os.getenv('RETRIEVAL_DIM', '512'))
+# Indexes kept in memory, least recently used dropped first
+RETRIEVAL_MAX_USERS = int(os.getenv('RETRIEVAL_MAX_USERS', '100'))
+# Users with at least this many items are searched through LSH candidates
+RETRIEVAL_ANN_MIN_ITEMS = int(os.getenv('RETRIEVAL_ANN_MIN_ITEMS', '2000'))
+RETRIEVAL_LSH_TABLES = int(os.getenv('RETRIEVAL_LSH_TABLES', '8'))
+RETRIEVAL_LSH_BITS = int(os.getenv('RETRIEVAL_LSH_BITS', '10'))
+
+
+def embed(texts):
+    """(len(texts), dim) unit-length float32 vectors"""
+    if RETRIEVAL_EMBED_MODEL:
+        vectors = np.array([llm_client.embeddings(model=RETRIEVAL_EMBED_MODEL, prompt=text)['embedding']
+                            for text in texts], dtype=np.float32).reshape(len(texts), -1)
+    else:
+        vectors = np.zeros((len(texts), RETRIEVAL_DIM), dtype=np.float32)
+        for row, text in enumerate(texts):
+            # Skip the constant feature, which would make every pair of texts look alike
+            np.add.at(vectors[row], featurize(text, RETRIEVAL_DIM)[1:], 1.0)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def task_line(description, due_date, completed):
+    return f"- {description} (Due: {due_date.isoformat() if due_date else 'No due date'}, Completed: {bool(completed)})"
+
+
+def schedule_line(title, start_time):
+    return f"- {title} at {start_time.isoformat() if start_time else 'no time'}"
+
+
+class UserIndex:
+    """One user's item vectors in a growable matrix, with LSH codes for approximate search"""
+
+    def __init__(self, dim, version=None):
+        self.keys = []    # ('task' | 'schedule', id) per row
+        self.lines = []   # prompt line per row
+        self.positions = {}
+        self.vectors = np.zeros((16, dim), dtype=np.float32)
+        self.codes = np.zeros((RETRIEVAL_LSH_TABLES, 16), dtype=np.int64)
+        self.planes = _planes(dim)
+        self.version = version
+
+    def __len__(self):
+        return len(self.keys)
+
+    def upsert(self, key, line, vector=None):
+        """Add or replace an item; vector None keeps the stored one (only the line changed)"""
+        row = self.positions.get(key)
+        if row is None:
+            if vector is None:
+                return
+            row = len(self.keys)
+            if row == len(self.vectors):
+                # Double the capacity so appends stay amortized O(dim)
+                self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+                self.codes = np.concatenate([self.codes, np.zeros_like(self.codes)], axis=1)
+            self.keys.append(key)
+            self.lines.append(line)
+            self.positions[key] = row
+        self.lines[row] = line
+        if vector is not None:
+            self.vectors[row] = vector
+            self.codes[:, row] = _lsh_codes(self.planes, vector[None])[:, 0]
+
+    def remove(self, key):
+        row = self.positions.pop(key, None)
+        if row is None:
+            return
+        last = len(self.keys) - 1
+        if row != last:
+            # Move the last item into the hole
+            self.keys[row], self.lines[row] = self.keys[last], self.lines[last]
+            self.vectors[row], self.codes[:, row] = self.vectors[last], self.codes[:, last]
+            self.positions[self.keys[row]] = row
+        self.keys.pop()
+        self.lines.pop()
+
+    def search(self, query, k):
+        """[(score, key, line)] for the k most similar items, best first"""
+        n = len(self.keys)
+        if n == 0:
+            return []
+        rows = None
+        if n >= RETRIEVAL_ANN_MIN_ITEMS:
+            # Only rows that share a bucket with the query in at least one table are scored
+            query_codes = _lsh_codes(self.planes, query[None])
+            rows = np.flatnonzero((self.codes[:, :n] == query_codes).any(axis=0))
+            if len(rows) < k:
+                rows = None
+        if rows is None:
+            rows = np.arange(n)
+        scores = self.vectors[rows] @ query
+        top = np.argpartition(-scores, min(k, len(rows)) - 1)[:k] if len(rows) > k else np.arange(len(rows))
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.keys[rows[i]], self.lines[rows[i]]) for i in top]
+
+
+_planes_by_dim = {}
+
+
+def _planes(dim):
+    # Fixed random hyperplanes per dimension, so codes stay comparable across indexes
+    if dim not in _planes_by_dim:
+        rng = np.random.default_rng(0)
+        _planes_by_dim[dim] = rng.standard_normal((RETRIEVAL_LSH_TABLES, RETRIEVAL_LSH_BITS, dim)).astype(np.float32)
+    return _planes_by_dim[dim]
+
+
+def _lsh_codes(planes, vectors):
+    """(tables, n) bucket number of each vector in each table"""
+    bits = np.einsum('tbd,nd->tnb', planes, vectors) > 0
+    return bits.astype(np.int64) @ (1 << np.arange(planes.shape[1], dtype=np.int64))
+
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def _build(user_id, version):
+    tasks = db.session.query(Task.id, Task.description, Task.due_date, Task.completed).filter(Task.user_id == user_id).all()
+    schedules = db.session.query(Schedule.id, Schedule.title, Schedule.start_time).filter(Schedule.user_id == user_id).all()
+    texts = [t.description for t in tasks] + [s.title for s in schedules]
+    vectors = embed(texts) if texts else None
+    index = UserIndex(vectors.shape[1] if vectors is not None else _dim(), version)
+    for row, t in enumerate(tasks):
+        index.upsert(('task', t.id), task_line(t.description, t.due_date, t.completed), vectors[row])
+    for row, s in enumerate(schedules, start=len(tasks)):
+        index.upsert(('schedule', s.id), schedule_line(s.title, s.start_time), vectors[row])
+    metrics.incr('retrieval.builds')
+    return index
+
+
+def _dim():
+    return embed(['']).shape[1] if RETRIEVAL_EMBED_MODEL else RETRIEVAL_DIM
+
+
+def get_index(user_id):
+    """The user's index, rebuilt when another process has changed their items since it was built"""
+    version = user_state.get_snapshot(user_id).updated_at
+    with _lock:
+        index = _indexes.get(user_id)
+        if index is not None and index.version == version:
+            _indexes.move_to_end(user_id)
+            return index
+    index = _build(user_id, version)
+    with _lock:
+        _indexes[user_id] = index
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > RETRIEVAL_MAX_USERS:
+            _indexes.popitem(last=False)
+    return index
+
+
+def relevant(user_id, text, exclude=()):
+    """Prompt lines of the user's items most similar to text, skipping the ('task'|'schedule', id) keys in exclude"""
+    if not RETRIEVAL_ENABLED or not user_id or not (text or '').strip():
+        return []
+    started = time.perf_counter()
+    try:
+        index = get_index(user_id)
+        query = embed([text])[0]
+        with _lock:
+            hits = index.search(query, RETRIEVAL_TOP_K + len(exclude))
+    except Exception as e:
+        print(f"⚠️  Retrieval failed: {e}")
+        return []
+    metrics.observe('retrieval.search_ms', (time.perf_counter() - started) * 1000)
+    lines = [line for score, key, line in hits if score >= RETRIEVAL_MIN_SCORE and key not in exclude]
+    return lines[:RETRIEVAL_TOP_K]
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    # Remember what changed for users whose index is loaded; applied once the transaction commits
+    with _lock:
+        loaded = set(_indexes)
+    if not loaded:
+        return
+    changes = session.info.setdefault('retrieval_changes', [])
+    for obj, deleted in [(o, False) for o in session.new] + [(o, False) for o in session.dirty] + [(o, True) for o in session.deleted]:
+        if isinstance(obj, Task):
+            key, text_attr = ('task', obj.id), 'description'
+            line = task_line(obj.description, obj.due_date, obj.completed)
+        elif isinstance(obj, Schedule):
+            key, text_attr = ('schedule', obj.id), 'title'
+            line = schedule_line(obj.title, obj.start_time)
+        else:
+            continue
+        if obj.user_id not in loaded:
+            continue
+        new_text = obj in session.new or inspect(obj).attrs[text_attr].history.has_changes()
+        changes.append((obj.user_id, key, None if deleted else line, getattr(obj, text_attr) if new_text else None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    changes = session.info.pop('retrieval_changes', None)
+    versions = session.info.pop('user_state_versions', {})
+    if not changes:
+        return
+    texts = [text for _, _, line, text in changes if line is not None and text is not None]
+    try:
+        vectors = iter(embed(texts)) if texts else iter(())
+    except Exception as e:
+        # Drop the affected indexes; they are rebuilt on next use
+        print(f"⚠️  Could not embed changed items: {e}")
+        with _lock:
+            for user_id, _, _, _ in changes:
+                _indexes.pop(user_id, None)
+        return
+    with _lock:
+        for user_id, key, line, text in changes:
+            index = _indexes.get(user_id)
+            vector = next(vectors) if line is not None and text is not None else None
+            if index is None:
+                continue
+            if line is None:
+                index.remove(key)
+            else:
+                index.upsert(key, line, vector)
+            if user_id in versions:
+                index.version = versions[user_id]
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    session.info.pop('retrieval_changes', None)
+    session.info.pop('user_state_versions', None)
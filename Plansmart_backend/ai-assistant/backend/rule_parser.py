@@ -0,0 +1,232 @@
+"""
+Rule-based parser for assistant input
+All action patterns are compiled once into a single alternation, so one scan over the input
+finds every task, schedule, update, reminder and query phrase. Alternatives are listed in
+priority order: where two could start at the same position, the earlier one wins.
+Dates and times are handed to time_parser, which splits "dentist next friday at 10am"
+into a title and a time. Compound input ("add task X and schedule Y at 6pm") is first split
+into clauses at conjunctions that are followed by another action phrase.
+"""
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional
+
+from time_parser import parse_time
+
+_ACTIONS = re.compile(r"""
+      (?P<reminder>\b(?:remind\ me|set\ a\ reminder)(?:\ to)?\ (?P<reminder_rest>.+))
+    | (?P<update>\b(?:update|change|reschedule|move)\ (?:the\ |my\ )?(?P<update_title>.+?)\ (?:to|at)\ (?P<update_time>.+))
+    | (?P<schedule>\b(?:schedule|set\ up|plan)\ (?P<schedule_rest>.+))
+    | (?P<meeting>\b(?:meeting|appointment)\ (?P<meeting_rest>.+))
+    | (?P<task>\b(?:create|add|make)\ (?:a\ |an\ )?task(?:\ to)?\ (?P<task_desc>.+))
+    | (?P<soft_task>\b(?:i\ need\ to|i\ have\ to|i\ should)\ (?P<soft_task_desc>.+))
+    | (?P<note>\bnote\ (?P<note_desc>.+))
+    | (?P<query_done>\b(?:show|list|get)\ (?:done|completed)\ tasks?)
+    | (?P<query_pending>\b(?:show|list|get)\ (?:undone|incomplete|pending)\ tasks?
+                      | \b(?:what|show)\ (?:do\ i\ have|are\ my)\ tasks?)
+""", re.IGNORECASE | re.VERBOSE)
+
+# A conjunction or comma followed by the start of another action phrase ends a clause
+_CLAUSE_BREAK = re.compile(r'''
+    (?:\s*[,;]\s*(?:and\s+|then\s+|also\s+)*|\s+(?:and|then|also|plus)\s+(?:then\s+|also\s+)?)
+    (?=(?:please\s+)?(?:remind\ me|set\ a\ reminder|update|change|reschedule|move|schedule|set\ up|plan
+        |create|add|make|i\ need\ to|i\ have\ to|i\ should|note|show|list|get|what)\b)
+''', re.IGNORECASE | re.VERBOSE)
+
+# Words a time expression can start with; candidate split points between a title and its time
+_TIME_START = re.compile(
+    r'\b(?:at|on|in|by|for|from|between|around|this|next|coming|every|each|daily|today|tonight|tomorrow|tmrw'
+    r'|day\ after|noon|midnight|mon|tue|wed|thu|fri|sat|sun)|(?<![\d:])\d', re.IGNORECASE)
+# A title ending in part of a clock ("gym at 25:") means the time was not fully read
+_CLOCK_LEFTOVER = re.compile(r'\d:\d*$')
+# Signs that one capture holds more than one request
+_COMPOUND = re.compile(r'\b(?:and|then|also)\b|,', re.IGNORECASE)
+
+# Phrasings that usually, but not always, mean what the rule assumes
+_WEAK_KINDS = {'soft_task', 'note', 'meeting'}
+
+
+@dataclass
+class ScheduleAction:
+    title: str
+    start_time: datetime
+    end_time: Optional[datetime] = None
+
+
+@dataclass
+class ScheduleUpdate:
+    title: str
+    new_start_time: datetime
+
+
+@dataclass
+class Reminder:
+    description: str
+    time: datetime
+
+
+@dataclass
+class ParseResult:
+    tasks: List[str] = field(default_factory=list)
+    schedules: List[ScheduleAction] = field(default_factory=list)
+    update_schedules: List[ScheduleUpdate] = field(default_factory=list)
+    reminders: List[Reminder] = field(default_factory=list)
+    query: dict = field(default_factory=dict)
+    clarification: bool = False
+    confidence: float = 0.0
+
+    @property
+    def has_actions(self):
+        return bool(self.tasks or self.schedules or self.update_schedules or self.reminders)
+
+    def to_dict(self):
+        """The JSON shape the model parse returns, plus the rule confidence"""
+        response = "I'm not sure what you mean. Could you clarify?"
+        if self.has_actions:
+            # Confirmation is built from the extracted actions in synthesize_response
+            response = ''
+        elif self.query:
+            response = "Here are your tasks."
+        return {
+            'tasks': list(self.tasks),
+            'schedules': [_schedule_dict(s) for s in self.schedules],
+            'update_schedules': [{'title': u.title, 'new_start_time': u.new_start_time.isoformat()}
+                                 for u in self.update_schedules],
+            'reminders': [{'description': r.description, 'time': r.time.isoformat()} for r in self.reminders],
+            'query': dict(self.query),
+            'clarification': self.clarification,
+            'response': response,
+            'confidence': self.confidence,
+        }
+
+
+def _schedule_dict(schedule):
+    data = {'title': schedule.title, 'start_time': schedule.start_time.isoformat()}
+    if schedule.end_time is not None:
+        data['end_time'] = schedule.end_time.isoformat()
+    return data
+
+
+def split_time(text, now=None):
+    """Split "dentist next friday at 10am" into ('dentist', TimeRange)
+
+    Returns None when no suffix of text is a time expression, and ('', None) when
+    text has none of the words a time expression starts with.
+    """
+    starts = [match.start() for match in _TIME_START.finditer(text) if match.start() > 0]
+    if not starts:
+        return '', None
+    for start in starts:
+        when = parse_time(text[start:], now)
+        if when is not None:
+            return text[:start].strip(), when
+    return None
+
+
+def _parse_clause(text, now=None):
+    """Actions in one clause, whether any phrasing was weak, and the text captured for them"""
+    result = ParseResult()
+    weak = False
+    captured = []
+    for match in _ACTIONS.finditer(text):
+        kind = match.lastgroup
+        weak = weak or kind in _WEAK_KINDS
+        if kind == 'reminder':
+            rest = match.group('reminder_rest').strip()
+            split = split_time(rest, now)
+            if split is None:
+                result.clarification = True
+            elif split[1] is None:
+                # "remind me to buy milk" has no time: keep it as a task
+                result.tasks.append(rest)
+                captured.append(rest)
+                weak = True
+            else:
+                desc, when = split
+                result.reminders.append(Reminder(desc, when.start))
+                captured.append(rest)
+                weak = weak or when.approximate or when.recurrence is not None or bool(_CLOCK_LEFTOVER.search(desc))
+        elif kind == 'update':
+            when = parse_time(match.group('update_time'), now)
+            if when is None:
+                result.clarification = True
+                continue
+            title = match.group('update_title').strip()
+            result.update_schedules.append(ScheduleUpdate(title, when.start))
+            captured.append(match.group('update_time'))
+            weak = weak or when.approximate or bool(_CLOCK_LEFTOVER.search(title))
+        elif kind in ('schedule', 'meeting'):
+            rest = match.group(f'{kind}_rest').strip()
+            split = split_time(rest, now)
+            if split is None:
+                result.clarification = True
+            elif split[1] is not None and split[0]:
+                title, when = split
+                result.schedules.append(ScheduleAction(title, when.start, when.end))
+                captured.append(rest)
+                # Schedules have no recurrence, so "every monday" would only keep the first one
+                weak = weak or when.approximate or when.recurrence is not None or bool(_CLOCK_LEFTOVER.search(title))
+        elif kind in ('task', 'soft_task', 'note'):
+            desc = match.group(f'{kind}_desc').strip()
+            result.tasks.append(desc)
+            captured.append(desc)
+        elif kind == 'query_done':
+            result.query['completed'] = True
+        elif kind == 'query_pending':
+            result.query.setdefault('completed', False)
+
+    return result, weak, captured
+
+
+def split_clauses(text):
+    """(start, end) spans of the clauses in text"""
+    spans = []
+    start = 0
+    for match in _CLAUSE_BREAK.finditer(text):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, len(text)))
+    return spans
+
+
+def parse(text, now=None) -> ParseResult:
+    """Extract every action from text, one clause at a time, in a single pass"""
+    clauses = []
+    for start, end in split_clauses(text):
+        clause = _parse_clause(text[start:end], now)
+        if clauses and not _found(clause[0]):
+            # "buy milk and get eggs": the break was a false alarm, keep it in the previous clause
+            start = clauses.pop()[0]
+            clause = _parse_clause(text[start:end], now)
+        clauses.append((start, clause))
+
+    result = ParseResult()
+    weak = False
+    captured = []
+    unparsed = False
+    for _, (part, part_weak, part_captured) in clauses:
+        result.tasks += part.tasks
+        result.schedules += part.schedules
+        result.update_schedules += part.update_schedules
+        result.reminders += part.reminders
+        result.query.update(part.query)
+        result.clarification = result.clarification or part.clarification
+        weak = weak or part_weak
+        captured += part_captured
+        # A leading clause nothing matched ("hey, schedule gym at 6pm") may still hold a request
+        unparsed = unparsed or not _found(part)
+
+    # How sure we are that the rules captured the whole request (drives the fast path)
+    if result.clarification or not _found(result):
+        result.confidence = 0.0
+    elif weak or unparsed or any(_COMPOUND.search(c) for c in captured):
+        # Soft phrasing, a clause we could not read, or what looks like more than one request in one capture
+        result.confidence = 0.6
+    else:
+        result.confidence = 0.9
+    return result
+
+
+def _found(result):
+    return result.has_actions or bool(result.query) or result.clarification
@@ -20,6 +20,14 @@ def schedule_reminder(task_id, task_description, reminder_time):
         )
         logger.info(f"Scheduled reminder for task {task_id} at {reminder_time}")
 
+def schedule_interval(func, seconds, job_id):
+    # Recurring background job, e.g. model server health checks
+    scheduler.add_job(func, trigger='interval', seconds=seconds, id=job_id, replace_existing=True)
+
+def run_soon(func, job_id, *args):
+    # One-off background job; while one with the same id is queued it is replaced, not duplicated
+    scheduler.add_job(func, args=args, id=job_id, replace_existing=True)
+
 def start_scheduler():
     scheduler.start()
 
@@ -5,6 +5,7 @@ This script creates a demo user account with sample tasks and schedules for test
 
 from app import app, db
 from models import User, Task, Schedule
+import user_state
 from datetime import datetime, timedelta
 
 def seed_demo_data():
@@ -154,6 +155,8 @@ def seed_demo_data():
             db.session.add(schedule)
         
         db.session.commit()
+        # The bulk deletes above bypass the snapshot bookkeeping
+        user_state.rebuild(user.id)
         print(f"✅ Schedules created successfully!")
         
         # Display summary
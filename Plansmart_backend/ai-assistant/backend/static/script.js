@@ -83,36 +83,159 @@ voiceBtn.addEventListener('click', () => {
 });
 
 /* --- Backend Communication --- */
+// Paragraph under the transcript that the assistant's reply is streamed into
+function getReplyEl() {
+  let replyEl = document.getElementById('ai-reply');
+  if (!replyEl) {
+    replyEl = document.createElement('p');
+    replyEl.id = 'ai-reply';
+    transcriptEl.after(replyEl);
+  }
+  return replyEl;
+}
+
 async function processVoiceInput(text) {
+  const replyEl = getReplyEl();
+  replyEl.textContent = '';
+  // Lists touched by this reply's actions; each is reloaded once, when the stream is done
+  const touched = new Set();
   try {
-    const response = await fetch('http://localhost:5000/process_input', {
+    const response = await fetch('http://localhost:5000/process_input_stream', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ text }),
     });
-    const data = await response.json();
-    console.log('Processed:', data);
-    loadTasks();
-    loadSchedules();
+    if (!response.body) {
+      // No readable stream support: handle all frames once the body has arrived
+      const body = await response.text();
+      body.split('\n\n').filter(Boolean).forEach(frame => handleStreamEvent(frame, replyEl, touched));
+      return;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      // SSE frames are separated by a blank line
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const frame = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        handleStreamEvent(frame, replyEl, touched);
+      }
+    }
   } catch (error) {
     console.error('Error processing input:', error);
   }
 }
 
+function handleStreamEvent(frame, replyEl, touched) {
+  let event = 'message';
+  let data = '';
+  frame.split('\n').forEach(line => {
+    if (line.startsWith('event: ')) event = line.slice(7);
+    else if (line.startsWith('data: ')) data += line.slice(6);
+  });
+  const payload = data ? JSON.parse(data) : {};
+
+  if (event === 'token') {
+    replyEl.textContent += payload.text;
+  } else if (event === 'reset') {
+    replyEl.textContent = '';
+  } else if (event === 'action' || event === 'actions') {
+    // Saved server-side already; note which lists changed and reload them once at the end
+    const saved = key => Array.isArray(payload[key]) && payload[key].length > 0;
+    if (saved('tasks') || saved('reminders')) touched.add('tasks');
+    if (saved('schedules') || saved('update_schedules')) touched.add('schedules');
+  } else if (event === 'done') {
+    if (touched.has('tasks')) loadTasks();
+    if (touched.has('schedules')) loadSchedules();
+    console.log('Processed:', payload);
+  }
+}
+
+// Lists come back a page at a time; the X-Next-Cursor header says where the next page starts
+async function fetchPage(path, params = {}, after = null) {
+  const query = new URLSearchParams(params);
+  if (after) query.set('after', after);
+  const response = await fetch(`http://localhost:5000${path}?${query}`);
+  if (!response.ok) throw new Error(`${path} failed with ${response.status}`);
+  return { items: await response.json(), next: response.headers.get('X-Next-Cursor') };
+}
+
+// Render the first page right away; later pages are only fetched when the user asks for them
+async function renderPaged(container, path, params, renderItem, emptyHtml = '') {
+  const { items, next } = await fetchPage(path, params);
+  if (items.length === 0 && emptyHtml) {
+    container.innerHTML = emptyHtml;
+    return;
+  }
+  appendPage(container, path, params, renderItem, items, next);
+}
+
+// Append a page of items, followed by a "Load more" button while there are more pages
+function appendPage(container, path, params, renderItem, items, next) {
+  items.forEach(item => container.appendChild(renderItem(item)));
+  if (!next) return;
+  const more = document.createElement(container.tagName === 'UL' ? 'li' : 'div');
+  more.className = 'load-more';
+  const btn = document.createElement('button');
+  btn.textContent = 'Load more';
+  btn.className = 'same-style-btn';
+  btn.addEventListener('click', async (e) => {
+    // Keep the list's own click handlers (open folder, open card) from seeing this click
+    e.stopPropagation();
+    btn.disabled = true;
+    try {
+      const page = await fetchPage(path, params, next);
+      more.remove();
+      appendPage(container, path, params, renderItem, page.items, page.next);
+    } catch (err) {
+      btn.disabled = false;
+      console.error(`Error loading more from ${path}:`, err);
+    }
+  });
+  more.appendChild(btn);
+  container.appendChild(more);
+}
+
+function taskItem(task) {
+  const li = document.createElement('li');
+  li.className = `task-item ${task.completed ? 'completed' : ''}`;
+  li.innerHTML = `
+    <span>${task.description} ${task.due_date ? `(Due: ${new Date(task.due_date).toLocaleString()})` : ''}</span>
+    ${!task.completed ? `<button class="complete-btn" onclick="markDone(${task.id})">Mark Done</button>` : ''}
+  `;
+  return li;
+}
+
+function scheduleItem(s) {
+  const li = document.createElement('li');
+  li.innerHTML = `
+    <span>${s.title} - ${new Date(s.start_time).toLocaleString()}</span>
+  `;
+  return li;
+}
+
+function scheduleCard(s) {
+  const card = document.createElement('div');
+  card.classList.add('schedule-card');
+  const date = new Date(s.start_time);
+  card.innerHTML = `
+    <h3>${s.title}</h3>
+    <p>${date.toLocaleString()}</p>
+    ${s.description ? `<p>${s.description}</p>` : ''}
+  `;
+  return card;
+}
+
 async function loadTasks() {
   try {
-    const response = await fetch('http://localhost:5000/get_tasks');
-    const tasks = await response.json();
     tasksList.innerHTML = '';
-    tasks.forEach(task => {
-      const li = document.createElement('li');
-      li.className = `task-item ${task.completed ? 'completed' : ''}`;
-      li.innerHTML = `
-        <span>${task.description} ${task.due_date ? `(Due: ${new Date(task.due_date).toLocaleString()})` : ''}</span>
-        ${!task.completed ? `<button class="complete-btn" onclick="markDone(${task.id})">Mark Done</button>` : ''}
-      `;
-      tasksList.appendChild(li);
-    });
+    await renderPaged(tasksList, '/get_tasks', {}, taskItem);
   } catch (err) {
     console.error('Error loading tasks:', err);
   }
@@ -120,16 +243,8 @@ async function loadTasks() {
 
 async function loadSchedules() {
   try {
-    const response = await fetch('http://localhost:5000/get_schedules');
-    const schedules = await response.json();
     schedulesList.innerHTML = '';
-    schedules.forEach(s => {
-      const li = document.createElement('li');
-      li.innerHTML = `
-        <span>${s.title} - ${new Date(s.start_time).toLocaleString()}</span>
-      `;
-      schedulesList.appendChild(li);
-    });
+    await renderPaged(schedulesList, '/get_schedules', { fields: 'title,start_time' }, scheduleItem);
   } catch (err) {
     console.error('Error loading schedules:', err);
   }
@@ -273,23 +388,43 @@ window.addEventListener('click', (e) => {
   if (e.target === addTaskModal) addTaskModal.style.display = 'none';
 });
 
-// Load schedules into dropdown
+// Load schedules into dropdown, a page at a time: choosing "More schedules…" loads the next one
+const MORE_SCHEDULES = '__more__';
+let nextScheduleOptions = null;
+
+function addScheduleOptions(schedules, next) {
+  taskScheduleSelect.querySelector(`option[value="${MORE_SCHEDULES}"]`)?.remove();
+  schedules.forEach(s => {
+    const option = document.createElement('option');
+    option.value = s.title;
+    option.textContent = s.title;
+    taskScheduleSelect.appendChild(option);
+  });
+  nextScheduleOptions = next;
+  if (next) taskScheduleSelect.appendChild(new Option('More schedules…', MORE_SCHEDULES));
+}
+
 async function populateScheduleDropdown() {
   try {
-    const res = await fetch('http://localhost:5000/get_schedules');
-    const schedules = await res.json();
+    const { items, next } = await fetchPage('/get_schedules', { fields: 'title' });
     taskScheduleSelect.innerHTML = '<option value="">-- Choose Schedule --</option>';
-    schedules.forEach(s => {
-      const option = document.createElement('option');
-      option.value = s.title;
-      option.textContent = s.title;
-      taskScheduleSelect.appendChild(option);
-    });
+    addScheduleOptions(items, next);
   } catch (err) {
     console.error('Failed to load schedules:', err);
   }
 }
 
+taskScheduleSelect.addEventListener('change', async () => {
+  if (taskScheduleSelect.value !== MORE_SCHEDULES) return;
+  taskScheduleSelect.value = '';
+  try {
+    const { items, next } = await fetchPage('/get_schedules', { fields: 'title' }, nextScheduleOptions);
+    addScheduleOptions(items, next);
+  } catch (err) {
+    console.error('Failed to load more schedules:', err);
+  }
+});
+
 // Submit task
 submitTaskBtn.addEventListener('click', async () => {
   const scheduleTitle = taskScheduleSelect.value;
@@ -419,9 +554,8 @@ const transcriptElMain = document.getElementById('transcript');
 
 viewScheduleBtn.addEventListener('click', async () => {
   try {
-    // Fetch schedules from backend
-    const response = await fetch('http://localhost:5000/get_schedules');
-    const schedules = await response.json();
+    // Fetch the first page of schedules from backend; the grid loads more on demand
+    const { items: schedules, next } = await fetchPage('/get_schedules');
 
     // --- Animate Fade Out of Mic and Text ---
     voiceBtnMain.style.transition = 'opacity 0.4s ease';
@@ -509,25 +643,15 @@ viewScheduleBtn.addEventListener('click', async () => {
     taskGrid.classList.add('schedule-grid');
 
     try {
-      const res = await fetch('http://localhost:5000/get_tasks');
-      const tasks = await res.json();
-      const related = tasks.filter(t =>
-        t.description.toLowerCase().includes(scheduleTitle.toLowerCase())
-      );
-
-      if (related.length === 0) {
-        taskGrid.innerHTML = '<p>No tasks yet for this schedule.</p>';
-      } else {
-        related.forEach(t => {
-          const card = document.createElement('div');
-          card.classList.add('schedule-card');
-          card.innerHTML = `
-            <h3>${t.description}</h3>
-            ${t.due_date ? `<p>Due: ${new Date(t.due_date).toLocaleString()}</p>` : ''}
-          `;
-          taskGrid.appendChild(card);
-        });
-      }
+      await renderPaged(taskGrid, '/get_tasks', { contains: scheduleTitle, fields: 'description,due_date' }, t => {
+        const card = document.createElement('div');
+        card.classList.add('schedule-card');
+        card.innerHTML = `
+          <h3>${t.description}</h3>
+          ${t.due_date ? `<p>Due: ${new Date(t.due_date).toLocaleString()}</p>` : ''}
+        `;
+        return card;
+      }, '<p>No tasks yet for this schedule.</p>');
     } catch (err) {
       console.error('Failed to load related tasks:', err);
     }
@@ -550,7 +674,7 @@ viewScheduleBtn.addEventListener('click', async () => {
       // --- Click Schedule Folder to Expand ---
 schedulesList.addEventListener('click', async (e) => {
   const li = e.target.closest('li');
-  if (!li) return;
+  if (!li || li.classList.contains('load-more')) return;
 
   const scheduleTitle = li.textContent.split(' - ')[0].trim();
 
@@ -592,10 +716,19 @@ schedulesList.addEventListener('click', async (e) => {
         }, 400);
       });
 
-      // Load all tasks linked to this schedule
-      const response = await fetch('http://localhost:5000/get_tasks');
-      const tasks = await response.json();
-      const filtered = tasks.filter(t => t.description.toLowerCase().includes(scheduleTitle.toLowerCase()));
+      // Load the first page of tasks linked to this schedule; more on demand
+      const taskGrid = document.createElement('div');
+      taskGrid.classList.add('schedule-grid');
+      await renderPaged(taskGrid, '/get_tasks', { contains: scheduleTitle }, t => {
+        const card = document.createElement('div');
+        card.classList.add('schedule-card');
+        card.innerHTML = `
+          <h3>${t.description}</h3>
+          ${t.due_date ? `<p>Due: ${new Date(t.due_date).toLocaleString()}</p>` : ''}
+          ${t.completed ? `<p style="color:green;">✅ Completed</p>` : `<p style="color:red;">❌ Not Done</p>`}
+        `;
+        return card;
+      }, '<p style="text-align:center;">No tasks yet.</p>');
 
       const titleEl = document.createElement('h2');
       titleEl.textContent = `Tasks for "${scheduleTitle}"`;
@@ -608,25 +741,13 @@ addTaskInFolderBtn.style.marginBottom = '15px';
 addTaskInFolderBtn.addEventListener('click', async () => {
   addTaskModal.style.display = 'flex';
   await populateScheduleDropdown();
+  // The folder's schedule may not be on the dropdown's first page
+  if (![...taskScheduleSelect.options].some(o => o.value === scheduleTitle)) {
+    taskScheduleSelect.add(new Option(scheduleTitle, scheduleTitle), 1);
+  }
   taskScheduleSelect.value = scheduleTitle; // auto-select current folder
 });
 
-      const taskGrid = document.createElement('div');
-      taskGrid.classList.add('schedule-grid');
-      if (filtered.length === 0) {
-        taskGrid.innerHTML = '<p style="text-align:center;">No tasks yet.</p>';
-      } else {
-        filtered.forEach(t => {
-          const card = document.createElement('div');
-          card.classList.add('schedule-card');
-          card.innerHTML = `
-            <h3>${t.description}</h3>
-            ${t.due_date ? `<p>Due: ${new Date(t.due_date).toLocaleString()}</p>` : ''}
-            ${t.completed ? `<p style="color:green;">✅ Completed</p>` : `<p style="color:red;">❌ Not Done</p>`}
-          `;
-          taskGrid.appendChild(card);
-        });
-      }
 
       wrapper.appendChild(backBtn);
       wrapper.appendChild(titleEl);
@@ -653,17 +774,7 @@ addTaskInFolderBtn.addEventListener('click', async () => {
       if (schedules.length === 0) {
         grid.innerHTML = `<p style="text-align:center;">No schedules yet.</p>`;
       } else {
-        schedules.forEach((s) => {
-          const card = document.createElement('div');
-          card.classList.add('schedule-card');
-          const date = new Date(s.start_time);
-          card.innerHTML = `
-            <h3>${s.title}</h3>
-            <p>${date.toLocaleString()}</p>
-            ${s.description ? `<p>${s.description}</p>` : ''}
-          `;
-          grid.appendChild(card);
-        });
+        appendPage(grid, '/get_schedules', {}, scheduleCard, schedules, next);
       }
 
       // --- Combine elements ---
@@ -767,30 +878,13 @@ loginBtn.addEventListener('click', async () => {
 
 async function showSchedulesGrid() {
   try {
-    const response = await fetch('http://localhost:5000/get_schedules');
-    const schedules = await response.json();
-
     const textPage = document.getElementById('textpage');
     const wrapper = document.createElement('div');
     wrapper.classList.add('schedule-grid');
-    textPage.innerHTML = '';
-
-    if (schedules.length === 0) {
-      wrapper.innerHTML = `<p style="text-align:center;">No schedules yet.</p>`;
-    } else {
-      schedules.forEach((s) => {
-        const card = document.createElement('div');
-        card.classList.add('schedule-card');
-        const date = new Date(s.start_time);
-        card.innerHTML = `
-          <h3>${s.title}</h3>
-          <p>${date.toLocaleString()}</p>
-          ${s.description ? `<p>${s.description}</p>` : ''}
-        `;
-        wrapper.appendChild(card);
-      });
-    }
+    await renderPaged(wrapper, '/get_schedules', {}, scheduleCard,
+      `<p style="text-align:center;">No schedules yet.</p>`);
 
+    textPage.innerHTML = '';
     textPage.appendChild(wrapper);
   } catch (err) {
     console.error('Error showing schedules grid:', err);
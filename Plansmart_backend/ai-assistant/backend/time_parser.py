@@ -0,0 +1,240 @@
+"""
+Deterministic parser for date/time expressions
+Understands clock times ("9", "3pm", "14:30", "noon"), relative days ("today", "tomorrow"),
+weekdays ("friday", "next friday"), offsets ("in 2 hours", "in half an hour"), parts of the
+day ("tomorrow morning"), ranges ("from 2pm to 4pm", "2-4pm") and weekly/daily recurrence.
+
+Expressions are compiled into a TimeSpec that does not depend on the current time, and the
+compiled specs are memoized on the normalized expression; resolving a spec against "now" is cheap.
+"""
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Optional, Tuple
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+TIME_PARSER_CACHE_SIZE = int(os.getenv('TIME_PARSER_CACHE_SIZE', '4096'))
+
+WEEKDAYS = {'mon': 0, 'tue': 1, 'wed': 2, 'thu': 3, 'fri': 4, 'sat': 5, 'sun': 6}
+NUMBER_WORDS = {'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6,
+                'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12,
+                'fifteen': 15, 'twenty': 20, 'thirty': 30, 'forty five': 45}
+UNIT_MINUTES = {'m': 1, 'h': 60}
+UNIT_DAYS = {'d': 1, 'w': 7}
+# Hour used when only a part of the day is given
+PART_OF_DAY_HOURS = {'morning': 9, 'afternoon': 14, 'evening': 18, 'tonight': 20, 'night': 20}
+DEFAULT_HOUR = 9
+
+_CLOCK = r'(?:\d{1,2}(?::\d{2})?(?:\s*[ap]\.?m\.?)?|noon|midnight)'
+_WEEKDAY = r'(?:mon|tue|tues|wed|thu|thur|thurs|fri|sat|sun)(?:day|nesday|sday|rsday|urday)?'
+
+_OFFSET = re.compile(r'\bin (?P<n>\d+|forty five|[a-z]+)? ?(?P<unit>min(?:ute)?s?|hours?|hrs?)\b')
+_HALF_HOUR = re.compile(r'\bin half an hour\b')
+_EVERY_DAY = re.compile(r'\b(?:every ?day|daily)\b')
+_WEEKDAY_RE = re.compile(rf'\b(?P<every>every |each )?(?P<next>next |this |coming )?(?P<weekday>{_WEEKDAY})\b')
+_DAY = re.compile(r'\b(?P<day>day after tomorrow|today|tomorrow|tmrw|tonight)\b')
+_IN_DAYS = re.compile(r'\bin (?P<n>\d+|[a-z]+) (?P<unit>days?|weeks?)\b')
+_PART = re.compile(r'\b(?:in the |this )?(?P<part>morning|afternoon|evening|night)\b')
+_RANGE = re.compile(rf'(?:\bfrom |\bbetween )?(?P<start>{_CLOCK})\s*(?:-|to|until|till|and)\s*(?P<end>{_CLOCK})(?![\d:])')
+_SINGLE_CLOCK = re.compile(rf'(?<![\d:])(?P<clock>{_CLOCK})(?![\d:])')
+_CLOCK_PARTS = re.compile(r'^(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*(?:(?P<meridiem>[ap])\.?m\.?)?$')
+# Words that may surround a time expression without changing it
+_FILLERS = {'at', 'on', 'the', 'by', 'for', 'from', 'of', 'around', 'about', 'this', 'in', "o'clock", 'oclock'}
+
+
+@dataclass(frozen=True)
+class TimeSpec:
+    """A time expression with everything that does not depend on the current time worked out"""
+    offset_minutes: Optional[int] = None
+    day_offset: Optional[int] = None
+    weekday: Optional[int] = None
+    next_week: bool = False
+    clock: Optional[Tuple[int, int]] = None
+    end_clock: Optional[Tuple[int, int]] = None
+    part: Optional[str] = None
+    recurrence: Optional[str] = None
+
+    @property
+    def approximate(self):
+        """True when no exact time was said and a default hour had to be used"""
+        return self.offset_minutes is None and self.clock is None
+
+    def resolve(self, now=None):
+        now = now or datetime.now()
+        if self.offset_minutes is not None:
+            return TimeRange(now + timedelta(minutes=self.offset_minutes), None, self.recurrence, False)
+
+        hour, minute = self.clock or (PART_OF_DAY_HOURS.get(self.part, DEFAULT_HOUR), 0)
+        day = now.date()
+        if self.day_offset is not None:
+            day += timedelta(days=self.day_offset)
+        elif self.weekday is not None:
+            ahead = (self.weekday - day.weekday()) % 7
+            if ahead == 0 and (self.next_week or (hour, minute) <= (now.hour, now.minute)):
+                ahead = 7
+            day += timedelta(days=ahead)
+        start = datetime.combine(day, datetime.min.time().replace(hour=hour, minute=minute))
+        if self.day_offset is None and self.weekday is None and self.recurrence != 'daily' and start <= now:
+            # A bare time that already passed today means the next one
+            start += timedelta(days=1)
+        elif self.recurrence == 'daily' and start <= now:
+            start += timedelta(days=1)
+
+        end = None
+        if self.end_clock is not None:
+            end = datetime.combine(start.date(), datetime.min.time().replace(hour=self.end_clock[0], minute=self.end_clock[1]))
+            if end <= start:
+                end += timedelta(days=1)
+        return TimeRange(start, end, self.recurrence, self.approximate)
+
+
+@dataclass(frozen=True)
+class TimeRange:
+    start: datetime
+    end: Optional[datetime] = None
+    recurrence: Optional[str] = None
+    approximate: bool = False
+
+
+def normalize(text):
+    """Lowercase, collapse whitespace and drop surrounding punctuation"""
+    return re.sub(r'\s+', ' ', (text or '').lower()).strip(' .,!?')
+
+
+def _number(word):
+    if word is None:
+        return 1
+    if word.isdigit():
+        return int(word)
+    return NUMBER_WORDS.get(word)
+
+
+def _clock(text, part=None, meridiem_hint=None):
+    """(hour, minute) for a clock expression, or None"""
+    if text == 'noon':
+        return 12, 0
+    if text == 'midnight':
+        return 0, 0
+    match = _CLOCK_PARTS.match(text.replace(' ', ''))
+    if not match:
+        return None
+    hour = int(match.group('hour'))
+    minute = int(match.group('minute') or 0)
+    meridiem = match.group('meridiem') or meridiem_hint
+    if minute >= 60:
+        return None
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        if meridiem == 'p' and hour != 12:
+            hour += 12
+        elif meridiem == 'a' and hour == 12:
+            hour = 0
+    elif hour > 23:
+        return None
+    elif hour <= 12 and part in ('afternoon', 'evening', 'night', 'tonight') and hour != 12:
+        hour += 12
+    elif 1 <= hour <= 6 and match.group('minute') is None:
+        # "at 3" almost always means the afternoon
+        hour += 12
+    return hour, minute
+
+
+@lru_cache(maxsize=TIME_PARSER_CACHE_SIZE)
+def compile_expression(expression):
+    """TimeSpec for a normalized expression, or None when any part of it is not understood"""
+    rest = f' {expression} '
+    spec = {}
+
+    match = _HALF_HOUR.search(rest)
+    if match:
+        spec['offset_minutes'] = 30
+        rest = rest[:match.start()] + ' ' + rest[match.end():]
+    else:
+        match = _OFFSET.search(rest)
+        if match:
+            n = _number(match.group('n'))
+            if n is None:
+                return None
+            spec['offset_minutes'] = n * UNIT_MINUTES[match.group('unit')[0]]
+            rest = rest[:match.start()] + ' ' + rest[match.end():]
+
+    match = _EVERY_DAY.search(rest)
+    if match:
+        spec['recurrence'] = 'daily'
+        rest = rest[:match.start()] + ' ' + rest[match.end():]
+
+    match = _DAY.search(rest)
+    if match:
+        day = match.group('day')
+        spec['day_offset'] = {'today': 0, 'tonight': 0, 'tomorrow': 1, 'tmrw': 1, 'day after tomorrow': 2}[day]
+        if day == 'tonight':
+            spec['part'] = 'tonight'
+        rest = rest[:match.start()] + ' ' + rest[match.end():]
+    else:
+        match = _IN_DAYS.search(rest)
+        if match:
+            n = _number(match.group('n'))
+            if n is None:
+                return None
+            spec['day_offset'] = n * UNIT_DAYS[match.group('unit')[0]]
+            rest = rest[:match.start()] + ' ' + rest[match.end():]
+
+    match = _WEEKDAY_RE.search(rest)
+    if match:
+        if 'day_offset' in spec:
+            return None
+        spec['weekday'] = WEEKDAYS[match.group('weekday')[:3]]
+        spec['next_week'] = match.group('next') == 'next '
+        if match.group('every'):
+            spec['recurrence'] = 'weekly'
+        rest = rest[:match.start()] + ' ' + rest[match.end():]
+
+    match = _PART.search(rest)
+    if match:
+        spec['part'] = match.group('part')
+        rest = rest[:match.start()] + ' ' + rest[match.end():]
+
+    match = _RANGE.search(rest)
+    if match:
+        end_meridiem = re.search(r'([ap])\.?m\.?$', match.group('end'))
+        end = _clock(match.group('end'), spec.get('part'))
+        start = _clock(match.group('start'), spec.get('part'),
+                       end_meridiem.group(1) if end_meridiem else None)
+        if start is None or end is None:
+            return None
+        if start > end and end_meridiem and end_meridiem.group(1) == 'p':
+            # "11-1pm": the start is still in the morning
+            start = _clock(match.group('start'), None, 'a')
+        spec['clock'], spec['end_clock'] = start, end
+        rest = rest[:match.start()] + ' ' + rest[match.end():]
+    else:
+        match = _SINGLE_CLOCK.search(rest)
+        if match:
+            clock = _clock(match.group('clock'), spec.get('part'))
+            if clock is None:
+                return None
+            spec['clock'] = clock
+            rest = rest[:match.start()] + ' ' + rest[match.end():]
+
+    if not spec or any(word not in _FILLERS for word in rest.split()):
+        return None
+    if 'offset_minutes' in spec and len(spec) > 1:
+        # "in 2 hours on friday" mixes an offset with a calendar time
+        return None
+    return TimeSpec(**spec)
+
+
+def parse_time(text, now=None):
+    """TimeRange for a date/time expression, or None when it is not (entirely) a time expression"""
+    spec = compile_expression(normalize(text))
+    return spec.resolve(now) if spec is not None else None
+
+
+def cache_info():
+    return compile_expression.cache_info()._asdict()
@@ -0,0 +1,291 @@
+"""
+Incrementally maintained per-user state snapshots
+A flush hook folds every Task/Schedule insert, update and delete into the owner's
+UserStateSnapshot row, so the snapshot is written in the same transaction as the change.
+Readers (prompt building, get_user_state) do one primary-key lookup instead of recounting.
+
+Usage: python user_state.py check [--fix]   # rebuild every snapshot from the tables and diff
+"""
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import and_, case, event, func, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import db, Task, Schedule, UserStateSnapshot
+
+PREVIEW_SIZE = 5
+
+_TASK_FIELDS = ('user_id', 'description', 'due_date', 'completed', 'created_at')
+_SCHEDULE_FIELDS = ('user_id', 'title', 'start_time', 'created_at')
+
+
+def _today():
+    return datetime.today().date()
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _task_entry(task_id, state):
+    return {'id': task_id, 'description': state['description'], 'due_date': _iso(state['due_date']),
+            'completed': bool(state['completed']), 'created_at': _iso(state['created_at'])}
+
+
+def _schedule_entry(schedule_id, state):
+    return {'id': schedule_id, 'title': state['title'], 'start_time': _iso(state['start_time']),
+            'created_at': _iso(state['created_at'])}
+
+
+def _recent_first(entries):
+    # Same order as the table queries: newest first, ties broken by id
+    return sorted(entries, key=lambda e: (e['created_at'] or '', e['id']), reverse=True)
+
+
+def _is_today(start_time, today):
+    return start_time is not None and start_time.date() == today
+
+
+def _day_bounds(today):
+    start = datetime.combine(today, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+
+def _recent_tasks(session, user_id, limit, exclude=()):
+    query = session.query(Task).filter(Task.user_id == user_id)
+    if exclude:
+        query = query.filter(Task.id.notin_(exclude))
+    rows = query.order_by(Task.created_at.desc(), Task.id.desc()).limit(limit)
+    return [_task_entry(t.id, {f: getattr(t, f) for f in _TASK_FIELDS}) for t in rows]
+
+
+def _recent_schedules(session, user_id, limit, exclude=()):
+    query = session.query(Schedule).filter(Schedule.user_id == user_id)
+    if exclude:
+        query = query.filter(Schedule.id.notin_(exclude))
+    rows = query.order_by(Schedule.created_at.desc(), Schedule.id.desc()).limit(limit)
+    return [_schedule_entry(s.id, {f: getattr(s, f) for f in _SCHEDULE_FIELDS}) for s in rows]
+
+
+def compute_values(session, user_id, today=None):
+    """Snapshot column values computed from scratch from the Task and Schedule tables"""
+    today = today or _today()
+    day_start, day_end = _day_bounds(today)
+    completed, total = session.query(
+        func.coalesce(func.sum(case((Task.completed == True, 1), else_=0)), 0),  # noqa: E712
+        func.count(Task.id),
+    ).filter(Task.user_id == user_id).one()
+    total_schedules, today_schedules = session.query(
+        func.count(Schedule.id),
+        func.coalesce(func.sum(case((and_(Schedule.start_time >= day_start, Schedule.start_time < day_end), 1),
+                                    else_=0)), 0),
+    ).filter(Schedule.user_id == user_id).one()
+    return {
+        'incomplete_tasks': total - completed,
+        'completed_tasks': completed,
+        'total_schedules': total_schedules,
+        'today': today,
+        'today_schedules': today_schedules,
+        'recent_tasks': _recent_tasks(session, user_id, PREVIEW_SIZE),
+        'recent_schedules': _recent_schedules(session, user_id, PREVIEW_SIZE),
+    }
+
+
+def _rebuild_in(session, user_id):
+    # Count before adding a new row, or the counting queries would autoflush it half-filled
+    values = compute_values(session, user_id)
+    snapshot = session.get(UserStateSnapshot, user_id)
+    if snapshot is None:
+        snapshot = UserStateSnapshot(user_id=user_id)
+        session.add(snapshot)
+    for key, value in values.items():
+        setattr(snapshot, key, value)
+    return snapshot
+
+
+def rebuild(user_id):
+    """Recount a user's snapshot; needed after bulk query.update()/delete(), which skip the flush hook"""
+    snapshot = _rebuild_in(db.session, user_id)
+    db.session.commit()
+    return snapshot
+
+
+def get_snapshot(user_id):
+    """The user's snapshot, rebuilt first if it is missing or was counted on another day"""
+    snapshot = db.session.get(UserStateSnapshot, user_id)
+    if snapshot is None or snapshot.today != _today():
+        snapshot = _rebuild_in(db.session, user_id)
+        db.session.commit()
+    return snapshot
+
+
+def _before(obj, fields):
+    """Attribute values as they were before this flush"""
+    insp = inspect(obj)
+    state = {}
+    for name in fields:
+        history = insp.attrs[name].history
+        if history.deleted:
+            state[name] = history.deleted[0]
+        elif history.unchanged:
+            state[name] = history.unchanged[0]
+        else:
+            state[name] = getattr(obj, name)
+    return state
+
+
+def _changes(session):
+    """(obj, state before, state after) for each task/schedule row this flush wrote; None for a side that does not exist"""
+    for obj in session.new:
+        yield obj, None, 'after'
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            yield obj, 'before', 'after'
+    for obj in session.deleted:
+        yield obj, 'before', None
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_changes(session, flush_context):
+    # Runs once the rows are written, so new ids and column defaults are known, while attribute
+    # history still holds the old values. ORM changes made here would be discarded, so the
+    # snapshot row is written with plain SQL on the flush's own connection.
+    changes = {}
+    for obj, before, after in _changes(session):
+        if isinstance(obj, Task):
+            kind, fields = 'task', _TASK_FIELDS
+        elif isinstance(obj, Schedule):
+            kind, fields = 'schedule', _SCHEDULE_FIELDS
+        else:
+            continue
+        before = _before(obj, fields) if before else None
+        after = {name: getattr(obj, name) for name in fields} if after else None
+        for user_id in {state['user_id'] for state in (before, after) if state is not None}:
+            if user_id is not None:
+                changes.setdefault(user_id, []).append((kind, obj, before, after))
+    if not changes:
+        return
+
+    today = _today()
+    with session.no_autoflush:
+        for user_id, user_changes in changes.items():
+            # The instance the session holds may have been loaded long before this flush (the prompt
+            # reads it before the model call), so re-read the row; this flush's writes already hold
+            # the database write lock, so no other writer can change it in between
+            snapshot = (session.query(UserStateSnapshot).populate_existing().with_for_update()
+                        .filter(UserStateSnapshot.user_id == user_id).one_or_none())
+            if snapshot is None or snapshot.today != today:
+                # The tables already hold this flush, so a rebuild needs no deltas on top
+                _write(session, snapshot, user_id, compute_values(session, user_id, today))
+            else:
+                deltas, previews = _apply_user_changes(session, snapshot, user_id, user_changes, today)
+                _write(session, snapshot, user_id, previews, deltas)
+
+
+COUNTS = ('incomplete_tasks', 'completed_tasks', 'total_schedules', 'today_schedules')
+
+
+def _write(session, snapshot, user_id, values, deltas=None):
+    """Store values as given and add deltas to the stored counts in SQL, never as absolute numbers"""
+    table = UserStateSnapshot.__table__
+    values = dict(values, updated_at=datetime.utcnow())
+    # Version stamp for caches derived from this user's rows (see retrieval.py)
+    session.info.setdefault('user_state_versions', {})[user_id] = values['updated_at']
+    if snapshot is None:
+        session.connection().execute(table.insert().values(user_id=user_id, **values))
+        return
+    increments = {key: table.c[key] + delta for key, delta in (deltas or {}).items() if delta}
+    session.connection().execute(table.update().where(table.c.user_id == user_id).values(**values, **increments))
+    # Keep the loaded instance in step without marking it dirty
+    for key, delta in (deltas or {}).items():
+        values[key] = getattr(snapshot, key) + delta
+    for key, value in values.items():
+        set_committed_value(snapshot, key, value)
+
+
+def _apply_user_changes(session, snapshot, user_id, user_changes, today):
+    """(count deltas, new previews) for this flush's changes to user_id's rows"""
+    touched = {'task': {}, 'schedule': {}}
+    for kind, obj, before, after in user_changes:
+        touched[kind][obj.id] = (obj, before, after)
+
+    deltas = dict.fromkeys(COUNTS, 0)
+    for obj, before, after in touched['task'].values():
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None or state['user_id'] != user_id:
+                continue
+            deltas['completed_tasks' if state['completed'] else 'incomplete_tasks'] += sign
+    for obj, before, after in touched['schedule'].values():
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None or state['user_id'] != user_id:
+                continue
+            deltas['total_schedules'] += sign
+            if _is_today(state['start_time'], today):
+                deltas['today_schedules'] += sign
+
+    counts = {key: getattr(snapshot, key) + deltas[key] for key in COUNTS}
+    return deltas, dict(
+        recent_tasks=_merge_preview(session, user_id, snapshot.recent_tasks, touched['task'], _task_entry,
+                                    _recent_tasks, counts['incomplete_tasks'] + counts['completed_tasks']),
+        recent_schedules=_merge_preview(session, user_id, snapshot.recent_schedules, touched['schedule'],
+                                        _schedule_entry, _recent_schedules, counts['total_schedules']),
+    )
+
+
+def _merge_preview(session, user_id, preview, touched, make_entry, load_recent, total):
+    """Preview with this flush's rows replaced by their new state; refilled from the table only if it ran short"""
+    ids = set(touched)
+    kept = [entry for entry in (preview or []) if entry['id'] not in ids]
+    entries = kept + [make_entry(obj.id, after) for obj, _, after in touched.values()
+                      if after is not None and after['user_id'] == user_id]
+    if len(kept) < len(preview or []) and len(entries) < min(total, PREVIEW_SIZE):
+        # A row left the preview and nothing newer replaced it: fetch the next ones
+        seen = {entry['id'] for entry in entries} | ids
+        entries += [entry for entry in load_recent(session, user_id, PREVIEW_SIZE + len(seen), tuple(ids))
+                    if entry['id'] not in seen]
+    return _recent_first(entries)[:PREVIEW_SIZE]
+
+
+def check(fix=False):
+    """Rebuild every snapshot in memory, print the differences and optionally store the rebuilt ones"""
+    user_ids = {row[0] for row in db.session.query(Task.user_id).filter(Task.user_id.isnot(None)).distinct()}
+    user_ids |= {row[0] for row in db.session.query(Schedule.user_id).filter(Schedule.user_id.isnot(None)).distinct()}
+    user_ids |= {row[0] for row in db.session.query(UserStateSnapshot.user_id)}
+    mismatched = 0
+    for user_id in sorted(user_ids):
+        expected = compute_values(db.session, user_id)
+        snapshot = db.session.get(UserStateSnapshot, user_id)
+        if snapshot is not None and snapshot.today != expected['today']:
+            # Counted on an earlier day; the next read rebuilds it anyway
+            continue
+        diffs = {key: (None if snapshot is None else getattr(snapshot, key), value)
+                 for key, value in expected.items()
+                 if snapshot is None or getattr(snapshot, key) != value}
+        if diffs:
+            mismatched += 1
+            print(f"user {user_id}:")
+            for key, (stored, rebuilt) in diffs.items():
+                print(f"  {key}: stored {stored!r}, rebuilt {rebuilt!r}")
+            if fix:
+                _rebuild_in(db.session, user_id)
+    if fix:
+        db.session.commit()
+    print(f"{len(user_ids)} users checked, {mismatched} snapshots differ" + (" (rebuilt)" if fix and mismatched else ""))
+    return mismatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check user state snapshots against the task and schedule tables")
+    commands = parser.add_subparsers(dest='command', required=True)
+    check_parser = commands.add_parser('check')
+    check_parser.add_argument('--fix', action='store_true', help='rebuild the snapshots that differ')
+    args = parser.parse_args()
+
+    from app import app
+    with app.app_context():
+        check(fix=args.fix)
+
+
+if __name__ == '__main__':
+    main()